@@ -0,0 +1,123 @@
+"""Compare encode time and output size of the tile encoders and settings.
+
+Usage:
+    python benchmarks/bench_encoders.py --image data/raw/RGB.png --tiles 16
+    python benchmarks/bench_encoders.py --bands 4 --dtype uint16   # GeoTIFF
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from splitraster.encoders import Encoder, gtiff_options
+
+IMAGE_SETTINGS = [
+    ("png level 0", Encoder("png", compress_level=0)),
+    ("png level 1", Encoder("png", compress_level=1)),
+    ("png level 6", Encoder("png")),
+    ("png level 9", Encoder("png", compress_level=9)),
+    ("jpeg q75", Encoder("jpeg", quality=75)),
+    ("jpeg q95", Encoder("jpeg")),
+    ("webp q90", Encoder("webp")),
+    ("tiff raw", Encoder("tiff")),
+    ("tiff zlib", Encoder("tiff", compression="zlib")),
+    ("npy", Encoder("npy")),
+]
+
+GTIFF_SETTINGS = [
+    ("gtiff raw", gtiff_options()),
+    ("gtiff lzw", gtiff_options("LZW")),
+    ("gtiff deflate", gtiff_options("DEFLATE")),
+    ("gtiff deflate pred2", gtiff_options("DEFLATE", predictor=2)),
+    ("gtiff zstd", gtiff_options("ZSTD")),
+    ("gtiff zstd tiled", gtiff_options("ZSTD", predictor=2, tiled=True)),
+]
+
+
+def synthetic_tiles(n, crop_size, bands, dtype, seed=0):
+    # smooth gradients plus noise, compresses roughly like real imagery
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:crop_size, 0:crop_size] / crop_size
+    top = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+    tiles = []
+    for _ in range(n):
+        base = np.sin(6 * x * rng.random() + 4 * y * rng.random()) * 0.4 + 0.5
+        noise = rng.normal(0, 0.05, (crop_size, crop_size, bands))
+        tiles.append(np.clip(base[..., None] + noise, 0, 1) * top)
+    return [tile.astype(dtype) for tile in tiles]
+
+
+def image_tiles(path, n, crop_size):
+    from splitraster import io, tile
+
+    img = io.read_image(path)
+    tiles = [t for _, _, t in tile.iter_tiles(img, crop_size)]
+    return tiles[:n]
+
+
+def report(name, seconds, sizes, raw_bytes):
+    n = len(sizes)
+    size = sum(sizes) / n
+    print(
+        f"{name:<22}{seconds / n * 1000:>10.2f}{size / 1024:>12.1f}"
+        f"{raw_bytes / size:>8.2f}"
+    )
+
+
+def bench_images(tiles):
+    for name, encoder in IMAGE_SETTINGS:
+        start = time.perf_counter()
+        try:
+            sizes = [len(encoder.encode(t)) for t in tiles]
+        except (TypeError, ValueError, OSError):
+            print(f"{name:<22}{'unsupported for ' + str(tiles[0].dtype):>30}")
+            continue
+        report(name, time.perf_counter() - start, sizes, tiles[0].nbytes)
+
+
+def bench_gtiff(tiles):
+    try:
+        import osgeo  # noqa: F401
+    except ImportError:
+        print("GDAL is not installed, GeoTIFF settings skipped")
+        return
+    from splitraster.geo import save_rasterGeoTIF
+
+    gt = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+    with tempfile.TemporaryDirectory() as folder:
+        for name, options in GTIFF_SETTINGS:
+            paths = [str(Path(folder) / f"{i}.tif") for i in range(len(tiles))]
+            start = time.perf_counter()
+            for t, path in zip(tiles, paths):
+                save_rasterGeoTIF(t.transpose(2, 0, 1), gt, "", path, options=options)
+            seconds = time.perf_counter() - start
+            sizes = [Path(path).stat().st_size for path in paths]
+            for path in paths:
+                Path(path).unlink()
+            report(name, seconds, sizes, tiles[0].nbytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="split this image instead of synthetic tiles")
+    parser.add_argument("--tiles", type=int, default=16)
+    parser.add_argument("--crop-size", type=int, default=256)
+    parser.add_argument("--bands", type=int, default=3)
+    parser.add_argument("--dtype", default="uint8")
+    args = parser.parse_args()
+
+    if args.image:
+        tiles = image_tiles(args.image, args.tiles, args.crop_size)
+    else:
+        tiles = synthetic_tiles(args.tiles, args.crop_size, args.bands, args.dtype)
+    print(f"{len(tiles)} tiles of {tiles[0].shape} {tiles[0].dtype}")
+    print(f"{'setting':<22}{'ms/tile':>10}{'KB/tile':>12}{'ratio':>8}")
+    bench_images(tiles)
+    bench_gtiff(tiles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Measure the import time of the splitraster modules in fresh interpreters.
+
+Fails (exit code 1) when importing a module pulls in a heavy backend
+(scikit-image, imageio, GDAL) that should only be imported on first use.
+
+Usage:
+    python benchmarks/bench_import.py --repeat 5
+"""
+
+import argparse
+import subprocess
+import sys
+
+MODULES = ["splitraster.tile", "splitraster.io", "splitraster.geo", "splitraster.cli"]
+HEAVY = ["skimage", "imageio", "osgeo"]
+
+
+def import_time(module: str) -> float:
+    # cumulative import time of `module` in microseconds, from -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return float(fields[1])
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def heavy_imports(module: str) -> list:
+    code = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20}{'best (ms)':>12}  heavy modules loaded")
+    for module in MODULES:
+        best = min(import_time(module) for _ in range(args.repeat)) / 1000
+        heavy = heavy_imports(module)
+        failed = failed or bool(heavy)
+        print(f"{module:<20}{best:>12.1f}  {', '.join(heavy) or '-'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,329 @@
+"""Benchmark the hot paths of splitraster on synthetic rasters, against a baseline.
+
+Every case runs in a fresh interpreter and reports its median wall time, the
+growth of the peak resident memory (RSS) and the tiles per second. Save the
+results as a baseline, later runs compare with it and fail (exit code 1) when
+a case is slower or uses more memory than the tolerance allows.
+
+Usage:
+    python benchmarks/bench_suite.py --save benchmarks/baseline.json
+    python benchmarks/bench_suite.py --compare benchmarks/baseline.json
+    python benchmarks/bench_suite.py --size 8000 --bands 4 --dtype uint16 -k split
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+# extra RSS a case may use over its baseline before it counts as a regression
+RSS_SLACK_MB = 8
+# extra seconds likewise, short cases vary more than the tolerance between runs
+TIME_SLACK_S = 0.25
+
+
+def synthetic_raster(size, bands, dtype, seed=0):
+    # (H, W, C) smooth gradients plus noise, compresses like real imagery
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / 256
+    top = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+    img = np.empty((size, size, bands), dtype=dtype)
+    for b in range(bands):
+        base = np.sin(x * rng.random() + y * rng.random() + b) * 0.4 + 0.5
+        noise = rng.normal(0, 0.05, (size, size))
+        img[..., b] = (np.clip(base + noise, 0, 1) * top).astype(dtype)
+    return img
+
+
+def synthetic_label(size, n_classes=4, seed=0):
+    # blocky class map with a rare class, as in segmentation labels
+    rng = np.random.default_rng(seed)
+    blocks = rng.choice(n_classes, (size // 64 + 1,) * 2, p=[0.6, 0.25, 0.1, 0.05])
+    return np.kron(blocks, np.ones((64, 64), dtype=np.uint8))[:size, :size]
+
+
+def make_inputs(folder, args):
+    folder = Path(folder)
+    img = synthetic_raster(args.size, args.bands, args.dtype)
+    np.save(folder / "image.npy", img)
+    np.save(folder / "label.npy", synthetic_label(args.size))
+    if img.dtype == np.uint8 and args.bands in (1, 3, 4):
+        from splitraster.io import save_image
+
+        save_image(img, str(folder / "image.png"))
+
+
+# cases: name -> function(folder, args) returning the number of tiles
+
+
+def case_pad(folder, args):
+    from splitraster.tile import pad_image
+
+    img = np.load(Path(folder) / "image.npy")
+    pad_image(img, args.crop_size)
+    return 0
+
+
+def split_case(folder, args, **options):
+    from splitraster import io
+    from splitraster.encoders import Encoder
+
+    return io.split_image(
+        str(Path(folder) / "image.npy"),
+        str(Path(folder) / "out"),
+        args.crop_size,
+        repetition_rate=args.repetition_rate,
+        workers=args.workers,
+        encoder=Encoder("npy"),
+        **options,
+    )
+
+
+def case_split(folder, args):
+    return split_case(folder, args)
+
+
+def case_split_virtual(folder, args):
+    return split_case(folder, args, virtual_padding=True)
+
+
+def case_split_mmap(folder, args):
+    return split_case(folder, args, mmap=True)
+
+
+def case_split_png(folder, args):
+    from splitraster import io
+
+    return io.split_image(
+        str(Path(folder) / "image.png"),
+        str(Path(folder) / "out_png"),
+        args.crop_size,
+        repetition_rate=args.repetition_rate,
+        workers=args.workers,
+    )
+
+
+def case_random_crop(folder, args):
+    from splitraster import io
+
+    folder = Path(folder)
+    return io.random_crop_image(
+        str(folder / "image.npy"),
+        str(folder / "crop_img"),
+        str(folder / "label.npy"),
+        str(folder / "crop_label"),
+        crop_size=args.crop_size,
+        crop_number=args.crop_number,
+        img_ext=".tif",
+        label_ext=".tif",
+        workers=args.workers,
+        seed=0,
+    )
+
+
+def case_random_crop_balanced(folder, args):
+    from splitraster import io
+
+    folder = Path(folder)
+    return io.random_crop_image(
+        str(folder / "image.npy"),
+        str(folder / "crop_img"),
+        str(folder / "label.npy"),
+        str(folder / "crop_label"),
+        crop_size=args.crop_size,
+        crop_number=args.crop_number,
+        img_ext=".tif",
+        label_ext=".tif",
+        workers=args.workers,
+        seed=0,
+        class_proportions="balanced",
+    )
+
+
+def encode_case(fmt):
+    def case(folder, args):
+        from splitraster.encoders import Encoder
+        from splitraster.tile import iter_tiles
+
+        img = np.load(Path(folder) / "image.npy", mmap_mode="r")
+        encoder = Encoder(fmt)
+        n = 0
+        for _, _, tile in iter_tiles(img[: args.crop_size * 4], args.crop_size):
+            encoder.encode(tile)
+            n += 1
+        return n
+
+    return case
+
+
+CASES = {
+    "pad": case_pad,
+    "split": case_split,
+    "split virtual": case_split_virtual,
+    "split mmap": case_split_mmap,
+    "split png": case_split_png,
+    "random crop": case_random_crop,
+    "random crop balanced": case_random_crop_balanced,
+    **{
+        f"encode {fmt}": encode_case(fmt)
+        for fmt in ["png", "jpeg", "webp", "tiff", "npy"]
+    },
+}
+
+
+def peak_rss_mb():
+    # peak resident memory of this process, None where it is not reported.
+    # On Linux ru_maxrss survives exec, the parent peak would hide the case,
+    # VmHWM belongs to the address space of this interpreter only
+    status = Path("/proc/self/status")
+    if status.is_file():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2**10
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_case(name, folder, args):
+    # runs in a fresh interpreter, so the peak RSS is the one of this case
+    import contextlib
+    import io
+
+    fn = CASES[name]
+    start_rss = peak_rss_mb()
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            n_tiles = fn(folder, args)
+            times.append(time.perf_counter() - start)
+    seconds = float(np.median(times))
+    end_rss = peak_rss_mb()
+    rss = None if start_rss is None else end_rss - start_rss
+    return {
+        "seconds": seconds,
+        "rss_mb": rss,
+        "tiles": n_tiles,
+        "tiles_per_s": n_tiles / seconds if n_tiles else None,
+    }
+
+
+def config(args):
+    keys = ["size", "bands", "dtype", "crop_size", "repetition_rate"]
+    keys += ["crop_number", "workers"]
+    return {key: getattr(args, key) for key in keys}
+
+
+def compare(results, baseline, tolerance):
+    # names of the cases slower or larger than the baseline allows
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None or "error" in result or "error" in base:
+            continue
+        limit = max(base["seconds"] * (1 + tolerance), base["seconds"] + TIME_SLACK_S)
+        if result["seconds"] > limit:
+            regressions.append(f"{name}: time")
+        if result["rss_mb"] is not None and base["rss_mb"] is not None:
+            limit = max(base["rss_mb"] * (1 + tolerance), base["rss_mb"] + RSS_SLACK_MB)
+            if result["rss_mb"] > limit:
+                regressions.append(f"{name}: peak RSS")
+    return regressions
+
+
+def report(name, result, base=None):
+    if "error" in result:
+        print(f"{name:<22}{'failed: ' + result['error']:>50}")
+        return
+    tiles = result["tiles_per_s"]
+    line = (
+        f"{name:<22}{result['seconds']:>10.3f}"
+        f"{result['rss_mb'] if result['rss_mb'] is not None else float('nan'):>10.1f}"
+        f"{tiles if tiles else float('nan'):>12.1f}"
+    )
+    if base is not None and "error" not in base:
+        line += f"{result['seconds'] / base['seconds']:>10.2f}x"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=4000, help="raster height/width")
+    parser.add_argument("--bands", type=int, default=3)
+    parser.add_argument("--dtype", default="uint8")
+    parser.add_argument("--crop-size", type=int, default=256)
+    parser.add_argument("--repetition-rate", type=float, default=0.0)
+    parser.add_argument("--crop-number", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("-k", dest="select", help="only the cases containing this")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare with this baseline file")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%"
+    )
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline["config"] != config(args):
+            print(f"Baseline config differs: {baseline['config']}")
+            sys.exit(2)
+
+    names = [name for name in CASES if not args.select or args.select in name]
+    print(f"raster {args.size}x{args.size}x{args.bands} {args.dtype}, ", end="")
+    print(f"crop size {args.crop_size}, median of {args.repeat}")
+    header = f"{'case':<22}{'time (s)':>10}{'RSS (MB)':>10}{'tiles/s':>12}"
+    print(header + (f"{'vs base':>11}" if baseline else ""))
+    results = {}
+    spawn = get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        make_inputs(folder, args)
+        for name in names:
+            if name == "split png" and not (Path(folder) / "image.png").is_file():
+                continue
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                try:
+                    results[name] = pool.submit(run_case, name, folder, args).result()
+                except Exception as e:
+                    results[name] = {"error": f"{type(e).__name__}: {e}"}
+            base = baseline["results"].get(name) if baseline else None
+            report(name, results[name], base)
+
+    if args.save:
+        Path(args.save).write_text(
+            json.dumps(
+                {
+                    "config": config(args),
+                    "machine": f"{platform.platform()}, Python {platform.python_version()}",
+                    "results": results,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+        print(f"Saved baseline to {args.save}")
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,7 @@ setup(
     python_requires=">=3.7, <3.14",
     keywords="split raster tiling ",
     install_requires=read_requirements(),
+    entry_points={"console_scripts": ["splitraster=splitraster.cli:main"]},
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
@@ -0,0 +1,3 @@
+from splitraster.cli import main
+
+raise SystemExit(main())
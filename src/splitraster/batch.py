@@ -0,0 +1,221 @@
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from tqdm import tqdm
+
+from .manifest import scene_signature
+from .timing import StageTimer
+
+STATUS_FILE = ".splitraster_batch.json"
+
+
+def find_scenes(pattern: str) -> List[str]:
+    """
+    Find the input images matching a glob pattern, e.g. "data/raw/**/*.tif"
+    Args: pattern: glob pattern
+    Returns: sorted list of absolute image paths
+    """
+    files = glob.glob(pattern, recursive=True)
+    return sorted(str(Path(f).resolve()) for f in files if Path(f).is_file())
+
+
+def glob_root(pattern: str) -> Path:
+    # the leading folders of a glob pattern, before the first wildcard
+    parts = []
+    for part in Path(pattern).parts[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts).resolve() if parts else Path.cwd()
+
+
+def scene_folders(scenes: List[str], pattern: str) -> dict:
+    """
+    Name the output folder of every scene from its path relative to the fixed
+    root of the glob pattern, without suffix: "root/a/scene.png" gets
+    "a/scene", so scenes with the same file name in different folders do not
+    share a folder.
+    Args:
+        scenes: absolute image paths, see find_scenes
+        pattern: glob pattern the scenes were found with
+    Returns:
+        dict of image path -> relative output folder
+    Raises:
+        ValueError: when two scenes get the same folder, e.g. "scene.png"
+            and "scene.tif" in one folder
+    """
+    root = glob_root(pattern)
+    folders, owners = {}, {}
+    for img_path in scenes:
+        path = Path(img_path)
+        try:
+            folder = path.relative_to(root).with_suffix("")
+        except ValueError:
+            folder = Path(path.stem)
+        if folder in owners:
+            raise ValueError(
+                f"{owners[folder]} and {img_path} would both be split into {folder}"
+            )
+        owners[folder] = img_path
+        folders[img_path] = str(folder)
+    return folders
+
+
+def load_status(save_root: str) -> dict:
+    status_path = Path(save_root) / STATUS_FILE
+    if not status_path.is_file():
+        return {}
+    with open(status_path) as f:
+        return json.load(f)
+
+
+def save_status(save_root: str, status: dict) -> None:
+    # write to a temporary file first, so a crash never leaves half a file
+    status_path = Path(save_root) / STATUS_FILE
+    tmp_path = status_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp_path, status_path)
+
+
+def split_scene(
+    backend: str,
+    img_path: str,
+    save_path: str,
+    crop_size: int,
+    kwargs: dict,
+    profile: bool = False,
+) -> Tuple[Optional[int], Optional[tuple]]:
+    # runs in a worker process, import the backend there; with profile the
+    # (seconds, calls) of the stages of the scene are returned as well
+    if backend == "geo":
+        from splitraster import geo as module
+    else:
+        from splitraster import io as module
+    timer = StageTimer() if profile else None
+    n = module.split_image(img_path, save_path, crop_size, timer=timer, **kwargs)
+    return n, (timer.seconds, timer.calls) if profile else None
+
+
+def split_directory(
+    pattern: str,
+    save_root: str,
+    crop_size: int,
+    repetition_rate: float = 0,
+    backend: str = "io",
+    workers: Optional[int] = None,
+    resume: bool = True,
+    timer: Optional[StageTimer] = None,
+    **kwargs,
+) -> dict:
+    """
+    Split every image matching a glob pattern, scenes run on a process pool.
+    The tiles of scene "root/a/name.png" go to save_root/a/name/, where root
+    is the part of the pattern before its first wildcard. Completed and
+    failed scenes are recorded in save_root/.splitraster_batch.json, with
+    resume=True a rerun only processes the failed, new or changed scenes.
+    Args:
+        pattern: glob pattern of the input images
+        save_root: output root folder
+        crop_size: crop size
+        repetition_rate: repetition rate
+        backend: "io" for images, "geo" for GeoTIFF rasters
+        workers: number of processes, defaults to the number of CPUs
+        resume: skip the scenes completed by a previous run
+        timer: optional StageTimer, gets the stage times of every scene,
+            summed over the processes
+        kwargs: other arguments of split_image
+    Returns:
+        summary of the run, with the aggregate tiles/s and MB/s
+    """
+    Path(save_root).mkdir(parents=True, exist_ok=True)
+    scenes = find_scenes(pattern)
+    # checked before any scene is written
+    folders = scene_folders(scenes, pattern)
+    status = load_status(save_root) if resume else {}
+
+    todo = []
+    for img_path in scenes:
+        record = status.get(img_path, {})
+        done = record.get("status") == "done"
+        if done and record.get("signature") == scene_signature(img_path):
+            continue
+        todo.append(img_path)
+    # largest scenes first, so a big scene does not start last while the
+    # other workers are idle.
+    todo.sort(key=lambda f: os.path.getsize(f), reverse=True)
+    print(f"{len(scenes)} scenes found, {len(scenes) - len(todo)} already done")
+
+    kwargs["repetition_rate"] = repetition_rate
+    n_tiles, n_bytes, failed = 0, 0, []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(
+        total=len(todo), desc="Scenes", colour="green", leave=True, unit="scene"
+    ) as pbar:
+        futures = {
+            pool.submit(
+                split_scene,
+                backend,
+                img_path,
+                str(Path(save_root) / folders[img_path]),
+                crop_size,
+                kwargs,
+                timer is not None,
+            ): img_path
+            for img_path in todo
+        }
+        for future in as_completed(futures):
+            img_path = futures[future]
+            record = {"signature": scene_signature(img_path)}
+            try:
+                n, stages = future.result()
+            except Exception as e:
+                n, stages, record["error"] = None, None, str(e)
+            if stages is not None:
+                timer.merge(*stages)
+            if n is None:
+                record["status"] = "failed"
+                failed.append(img_path)
+            else:
+                record.update(status="done", tiles=n)
+                n_tiles += n
+                n_bytes += record["signature"]["size"]
+            status[img_path] = record
+            save_status(save_root, status)
+            pbar.update(1)
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "scenes": len(scenes),
+        "processed": len(todo) - len(failed),
+        "skipped": len(scenes) - len(todo),
+        "failed": failed,
+        "tiles": n_tiles,
+        "seconds": elapsed,
+        "tiles_per_second": n_tiles / elapsed if elapsed > 0 else 0.0,
+        "mb_per_second": n_bytes / 2**20 / elapsed if elapsed > 0 else 0.0,
+    }
+    print(
+        f"{summary['processed']} scenes split, {summary['skipped']} skipped, "
+        f"{len(failed)} failed: {n_tiles} tiles in {elapsed:.1f}s "
+        f"({summary['tiles_per_second']:.1f} tiles/s, "
+        f"{summary['mb_per_second']:.1f} MB/s)"
+    )
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # same as "splitraster split-dir", which parses the arguments
+    from .cli import main as cli_main
+
+    return cli_main(["split-dir", *(sys.argv[1:] if argv is None else argv)])
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,394 @@
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from .encoders import FORMATS, Encoder, gtiff_options
+from .filters import TileFilter
+from .tile import plan_split
+from .timing import StageTimer
+
+MMAP_HELP = "memory-map .npy and uncompressed TIFF inputs"
+
+
+def format_bytes(n: float) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if n < 1024 or unit == "TB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def image_info(img_path: str, backend: str):
+    # (height, width, bands, itemsize) read from the file header only
+    if backend == "geo":
+        from osgeo import gdal, gdal_array
+
+        dataset = gdal.Open(img_path, gdal.GA_ReadOnly)
+        if dataset is None:
+            raise FileNotFoundError(img_path)
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+            dataset.GetRasterBand(1).DataType
+        )
+        return (
+            dataset.RasterYSize,
+            dataset.RasterXSize,
+            dataset.RasterCount,
+            dtype().itemsize,
+        )
+    if Path(img_path).suffix.lower() == ".npy":
+        # imageio has no .npy plugin, the header is read through a mapping
+        import numpy as np
+
+        props = np.load(img_path, mmap_mode="r")
+    else:
+        import imageio.v3 as iio
+
+        props = iio.improps(img_path)
+    bands = props.shape[2] if len(props.shape) == 3 else 1
+    return props.shape[0], props.shape[1], bands, props.dtype.itemsize
+
+
+def is_mapped(img_path: str, args) -> bool:
+    # the io backend maps .npy and uncompressed TIFF inputs with --mmap
+    if not getattr(args, "mmap", False):
+        return False
+    suffix = Path(img_path).suffix.lower()
+    if suffix in [".tif", ".tiff"]:
+        from .io import memmap_tiff
+
+        return memmap_tiff(img_path) is not None
+    return suffix == ".npy"
+
+
+def print_plan(plan: dict) -> None:
+    n_rows, n_cols = plan["grid"]
+    H, W = plan["padded_shape"]
+    print(f"grid: {n_rows} x {n_cols} (stride {plan['stride']}, padded {H} x {W})")
+    print(f"tiles: {plan['tiles']}")
+    print(f"estimated output: {format_bytes(plan['output_bytes'])} (uncompressed)")
+    print(f"estimated peak memory: {format_bytes(plan['peak_memory_bytes'])}")
+
+
+def dry_run_split(args) -> dict:
+    height, width, bands, itemsize = image_info(args.img_path, args.backend)
+    print(f"{args.img_path}: {height} x {width} x {bands} bands")
+    streaming = getattr(args, "stream", False)
+    plan = plan_split(
+        height,
+        width,
+        bands,
+        itemsize,
+        args.crop_size,
+        args.repetition_rate,
+        virtual_padding=args.virtual_padding,
+        strip_rows=args.strip_rows if streaming else None,
+        workers=args.workers,
+        mmap=is_mapped(args.img_path, args),
+    )
+    print_plan(plan)
+    return plan
+
+
+def dry_run_random_crop(args) -> dict:
+    image = image_info(args.img_path, args.backend)
+    label = image_info(args.label_path, args.backend)
+    crop_bytes = sum(
+        args.crop_size**2 * bands * size for _, _, bands, size in [image, label]
+    )
+    # a mapped input is not loaded, only the pages of the crops are read
+    source_bytes = sum(
+        h * w * bands * size
+        for path, (h, w, bands, size) in [
+            (args.img_path, image),
+            (args.label_path, label),
+        ]
+        if not is_mapped(path, args)
+    )
+    plan = {
+        "tiles": 2 * args.crop_number,
+        "output_bytes": args.crop_number * crop_bytes,
+        "peak_memory_bytes": source_bytes + 2 * max(args.workers, 1) * crop_bytes,
+    }
+    print(f"crop pairs: {args.crop_number}, files: {plan['tiles']}")
+    print(f"estimated output: {format_bytes(plan['output_bytes'])} (uncompressed)")
+    print(f"estimated peak memory: {format_bytes(plan['peak_memory_bytes'])}")
+    return plan
+
+
+def make_encoder(args) -> Optional[Encoder]:
+    # None keeps the format of the input image with default settings
+    if args.format is None:
+        return None
+    options = {}
+    if args.quality is not None:
+        options["quality"] = args.quality
+    if args.compress_level is not None:
+        options["compress_level"] = args.compress_level
+    return Encoder(args.format, **options)
+
+
+def make_filter(args) -> Optional[TileFilter]:
+    # None writes every tile
+    if args.max_nodata is None and args.min_std is None:
+        return None
+    return TileFilter(
+        nodata=args.nodata,
+        max_nodata=1.0 if args.max_nodata is None else args.max_nodata,
+        min_std=args.min_std or 0.0,
+    )
+
+
+def run_split(args, timer) -> Optional[int]:
+    kwargs = dict(
+        repetition_rate=args.repetition_rate,
+        overwrite=not args.no_overwrite,
+        workers=args.workers,
+        pad_mode=args.pad_mode,
+        pad_value=args.pad_value,
+        virtual_padding=args.virtual_padding,
+        timer=timer,
+        incremental=args.incremental,
+        tile_filter=make_filter(args),
+    )
+    if args.backend == "geo":
+        from splitraster import geo
+
+        kwargs.update(
+            stream=args.stream,
+            strip_rows=args.strip_rows,
+            block_cache=not args.no_block_cache,
+            vsimem=args.vsimem,
+            index_path=args.index,
+            creation_options=gtiff_options(
+                args.compress, args.predictor, args.level, args.tiled
+            ),
+        )
+        if args.pyramid:
+            counts = geo.split_pyramid(
+                args.img_path,
+                args.save_path,
+                args.crop_size,
+                levels=args.pyramid,
+                resampling=args.resampling,
+                build=args.build_overviews,
+                **kwargs,
+            )
+            return None if counts is None else sum(counts.values())
+        return geo.split_image(args.img_path, args.save_path, args.crop_size, **kwargs)
+    from splitraster import io
+
+    kwargs["encoder"] = make_encoder(args)
+    kwargs["mmap"] = args.mmap
+    kwargs["pipeline"] = args.pipeline
+    return io.split_image(args.img_path, args.save_path, args.crop_size, **kwargs)
+
+
+def run_random_crop(args, timer) -> Optional[int]:
+    kwargs = dict(
+        crop_size=args.crop_size,
+        crop_number=args.crop_number,
+        img_ext=args.img_ext,
+        label_ext=args.label_ext,
+        overwrite=not args.no_overwrite,
+        workers=args.workers,
+        timer=timer,
+        seed=args.seed,
+        replace=not args.no_replace,
+        min_spacing=args.min_spacing,
+        class_proportions="balanced" if args.balanced else None,
+    )
+    if args.backend == "geo":
+        from splitraster import geo as module
+
+        kwargs["index_path"] = args.index
+    else:
+        from splitraster import io as module
+
+        kwargs["mmap"] = args.mmap
+    return module.random_crop_image(
+        args.img_path,
+        args.img_save_path,
+        args.label_path,
+        args.label_save_path,
+        **kwargs,
+    )
+
+
+def run_split_directory(args, timer) -> int:
+    from splitraster import batch
+
+    summary = batch.split_directory(
+        args.pattern,
+        args.save_root,
+        args.crop_size,
+        repetition_rate=args.repetition_rate,
+        backend=args.backend,
+        workers=args.workers,
+        resume=not args.no_resume,
+        timer=timer,
+    )
+    return None if summary["failed"] else summary["tiles"]
+
+
+def add_common_arguments(
+    parser, workers_help="number of writer threads", workers=1
+) -> None:
+    parser.add_argument("--crop-size", type=int, default=256, help="tile size")
+    parser.add_argument("--workers", type=int, default=workers, help=workers_help)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the tile count, output size and peak memory, write nothing",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="print the time spent per stage"
+    )
+
+
+def add_split_arguments(parser) -> None:
+    parser.add_argument("img_path")
+    parser.add_argument("save_path")
+    add_common_arguments(parser)
+    parser.add_argument("--repetition-rate", type=float, default=0)
+    parser.add_argument("--no-overwrite", action="store_true")
+    parser.add_argument(
+        "--pad-mode",
+        default="reflect",
+        choices=["reflect", "symmetric", "edge", "constant"],
+    )
+    parser.add_argument("--pad-value", type=float, default=0)
+    parser.add_argument("--virtual-padding", action="store_true")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip the tiles recorded in the manifest of the output folder",
+    )
+    parser.add_argument("--nodata", type=float, help="nodata value of the filter")
+    parser.add_argument(
+        "--max-nodata", type=float, help="drop tiles with more nodata, e.g. 0.99"
+    )
+    parser.add_argument("--min-std", type=float, help="drop flat tiles")
+
+
+def add_random_crop_arguments(parser, ext: str) -> None:
+    parser.add_argument("img_path")
+    parser.add_argument("img_save_path")
+    parser.add_argument("label_path")
+    parser.add_argument("label_save_path")
+    add_common_arguments(parser)
+    parser.add_argument("--crop-number", type=int, default=20)
+    parser.add_argument("--img-ext", default=ext)
+    parser.add_argument("--label-ext", default=".png" if ext == ".jpg" else ext)
+    parser.add_argument("--seed", type=int, help="seed of the crop sampler")
+    parser.add_argument("--no-replace", action="store_true", help="distinct crops")
+    parser.add_argument("--min-spacing", type=int, default=0, help="in pixels")
+    parser.add_argument(
+        "--balanced", action="store_true", help="same share of crops per class"
+    )
+    parser.add_argument("--no-overwrite", action="store_true")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="splitraster", description="Split images and rasters into tiles."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="split an image into tiles")
+    add_split_arguments(split)
+    split.add_argument("--format", choices=list(FORMATS), help="tile format")
+    split.add_argument("--quality", type=int, help="jpeg/webp quality")
+    split.add_argument("--compress-level", type=int, help="png compression 0-9")
+    split.add_argument("--mmap", action="store_true", help=MMAP_HELP)
+    split.add_argument(
+        "--pipeline", action="store_true", help="read/encode/write stage threads"
+    )
+    split.set_defaults(run=run_split, plan=dry_run_split, backend="io")
+
+    geo_split = commands.add_parser("geo-split", help="split a GeoTIFF into tiles")
+    add_split_arguments(geo_split)
+    geo_split.add_argument("--stream", action="store_true")
+    geo_split.add_argument("--strip-rows", type=int, default=1)
+    geo_split.add_argument(
+        "--no-block-cache", action="store_true", help="stream without BlockCache"
+    )
+    geo_split.add_argument(
+        "--vsimem", action="store_true", help="encode the tiles in memory"
+    )
+    geo_split.add_argument("--index", help="write a GeoJSON/.csv tile index")
+    geo_split.add_argument("--compress", help="DEFLATE, LZW, ZSTD, ...")
+    geo_split.add_argument("--predictor", type=int, help="2 for integers, 3 floats")
+    geo_split.add_argument("--level", type=int, help="DEFLATE/ZSTD level")
+    geo_split.add_argument("--tiled", action="store_true", help="internal tiling")
+    geo_split.add_argument(
+        "--pyramid", type=int, nargs="+", help="split at these levels, e.g. 1 2 4"
+    )
+    geo_split.add_argument(
+        "--resampling",
+        default="average",
+        choices=["nearest", "average", "bilinear", "cubic", "mode"],
+    )
+    geo_split.add_argument(
+        "--build-overviews", action="store_true", help="build missing overviews"
+    )
+    geo_split.set_defaults(run=run_split, plan=dry_run_split, backend="geo")
+
+    crop = commands.add_parser("random-crop", help="random crop image/label pairs")
+    add_random_crop_arguments(crop, ".jpg")
+    crop.add_argument("--mmap", action="store_true", help=MMAP_HELP)
+    crop.set_defaults(run=run_random_crop, plan=dry_run_random_crop, backend="io")
+
+    geo_crop = commands.add_parser(
+        "geo-random-crop", help="random crop GeoTIFF image/label pairs"
+    )
+    add_random_crop_arguments(geo_crop, ".tif")
+    geo_crop.add_argument("--index", help="write a GeoJSON/.csv crop index")
+    geo_crop.set_defaults(run=run_random_crop, plan=dry_run_random_crop, backend="geo")
+
+    split_dir = commands.add_parser(
+        "split-dir", help="split every image matching a glob pattern"
+    )
+    split_dir.add_argument("pattern", help='glob pattern, e.g. "data/raw/*.tif"')
+    split_dir.add_argument("save_root", help="output root folder")
+    add_common_arguments(
+        split_dir, "number of processes, defaults to the number of CPUs", None
+    )
+    split_dir.add_argument("--repetition-rate", type=float, default=0)
+    split_dir.add_argument("--backend", choices=["io", "geo"], default="io")
+    split_dir.add_argument(
+        "--geo",
+        dest="backend",
+        action="store_const",
+        const="geo",
+        help="GeoTIFF scenes, same as --backend geo",
+    )
+    split_dir.add_argument("--no-resume", action="store_true")
+    split_dir.set_defaults(run=run_split_directory, plan=None)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.dry_run:
+        if args.plan is None:
+            print(f"--dry-run is not supported by {args.command}")
+            return 2
+        args.plan(args)
+        return 0
+
+    timer = StageTimer() if args.profile else None
+    start = time.perf_counter()
+    n = args.run(args, timer)
+    elapsed = time.perf_counter() - start
+    if n is None:
+        return 1
+    if timer is not None and timer.seconds:
+        print(timer.report())
+    if timer is not None:
+        rate = n / elapsed if elapsed > 0 else 0.0
+        print(f"total {elapsed:.3f}s, {rate:.1f} tiles/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
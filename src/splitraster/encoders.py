@@ -0,0 +1,76 @@
+import io
+from typing import List, Optional
+
+import numpy as np
+
+# format name -> (file suffix, default imageio/pillow write options)
+FORMATS = {
+    "png": (".png", {"compress_level": 6}),
+    "jpeg": (".jpg", {"quality": 95}),
+    "webp": (".webp", {"quality": 90}),
+    "tiff": (".tif", {}),
+    "npy": (".npy", {}),
+}
+
+
+class Encoder:
+    """
+    Encode tiles to the bytes of one file format, with fixed settings.
+    Args:
+        fmt: "png", "jpeg", "webp", "tiff" or "npy"
+        options: write options of the format, e.g. compress_level=1 for png,
+            quality=80 for jpeg/webp, compression="zlib" for tiff
+    """
+
+    def __init__(self, fmt: str = "png", **options):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}, use one of {list(FORMATS)}")
+        self.fmt = fmt
+        self.ext, defaults = FORMATS[fmt]
+        self.options = {**defaults, **options}
+
+    def encode(self, img_arr: np.ndarray) -> bytes:
+        if self.fmt == "npy":
+            buffer = io.BytesIO()
+            np.save(buffer, img_arr)
+            return buffer.getvalue()
+        import imageio.v3 as iio  # imported on first use, it is slow
+
+        if img_arr.dtype == bool:
+            img_arr = img_arr.astype(np.uint8) * 255
+        return iio.imwrite("<bytes>", img_arr, extension=self.ext, **self.options)
+
+    def __repr__(self) -> str:
+        options = ", ".join(f"{k}={v!r}" for k, v in self.options.items())
+        return f"Encoder({self.fmt!r}{', ' if options else ''}{options})"
+
+
+def gtiff_options(
+    compress: Optional[str] = None,
+    predictor: Optional[int] = None,
+    level: Optional[int] = None,
+    tiled: bool = False,
+    blocksize: int = 256,
+) -> List[str]:
+    """
+    Build the GDAL GTiff creation options of geo tiles
+    Args:
+        compress: "DEFLATE", "LZW", "ZSTD", ... or None for uncompressed
+        predictor: 2 (horizontal differencing) for integer data, 3 for floats
+        level: compression level, ZLEVEL for DEFLATE, ZSTD_LEVEL for ZSTD
+        tiled: write internal tiles instead of strips
+        blocksize: internal tile size when tiled
+    Returns:
+        list of "KEY=VALUE" creation options
+    """
+    options = []
+    if compress:
+        options.append(f"COMPRESS={compress.upper()}")
+        if predictor:
+            options.append(f"PREDICTOR={predictor}")
+        if level is not None:
+            key = "ZSTD_LEVEL" if compress.upper() == "ZSTD" else "ZLEVEL"
+            options.append(f"{key}={level}")
+    if tiled:
+        options += ["TILED=YES", f"BLOCKXSIZE={blocksize}", f"BLOCKYSIZE={blocksize}"]
+    return options
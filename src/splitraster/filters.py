@@ -0,0 +1,186 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from .tile import block_sums
+
+# smallest block size of the summed-area tables, 1 byte per image pixel
+MIN_BLOCK_SIZE = 8
+
+
+def window_sums(blocks: np.ndarray, origins: np.ndarray, n_blocks: int) -> np.ndarray:
+    # sums of the n_blocks x n_blocks windows of blocks at the block origins,
+    # read from its summed-area table; windows may reach past the last block
+    table = np.zeros((blocks.shape[0] + 1, blocks.shape[1] + 1))
+    np.cumsum(np.cumsum(blocks, axis=0), axis=1, out=table[1:, 1:])
+    h0 = np.minimum(origins[:, 0], blocks.shape[0])
+    w0 = np.minimum(origins[:, 1], blocks.shape[1])
+    h1 = np.minimum(origins[:, 0] + n_blocks, blocks.shape[0])
+    w1 = np.minimum(origins[:, 1] + n_blocks, blocks.shape[1])
+    return table[h1, w1] - table[h0, w1] - table[h1, w0] + table[h0, w0]
+
+
+def as_channel_first(img: np.ndarray, channel_first: bool) -> np.ndarray:
+    # (C, H, W) view of an image in any of the layouts of the package
+    if channel_first and img.ndim == 3:
+        return img
+    return np.moveaxis(np.atleast_3d(img), 2, 0)
+
+
+class TileFilter:
+    """
+    Drop empty tiles before they are encoded and written. The statistics of
+    all tiles are computed at once: the image is reduced to blocks of
+    gcd(crop_size, stride) pixels, and the sum over each tile is read from
+    the summed-area table of the blocks. Tile pixels outside the image (the
+    padding) count as nodata.
+    Memory: the block sums and their tables take about 64 bytes per block
+    (4 float64 sums, 4 tables), i.e. 64 / block_size**2 bytes per image
+    pixel. Blocks smaller than MIN_BLOCK_SIZE (e.g. crop_size 256 with
+    stride 255 has blocks of 1 pixel) would need 64 bytes per pixel, the
+    statistics are then summed over the pixels of each tile instead, one
+    tile at a time.
+    Args:
+        nodata: nodata value, a pixel is nodata when all its bands are
+        max_nodata: drop tiles with a larger fraction of nodata pixels
+        min_std: drop tiles with a smaller standard deviation of the valid
+            pixel values, e.g. flat filled areas
+        min_positive: drop tiles with a smaller fraction of label pixels > 0
+        chunk_rows: rows of the image reduced at once, bounds the memory
+    """
+
+    def __init__(
+        self,
+        nodata: Optional[float] = None,
+        max_nodata: float = 1.0,
+        min_std: float = 0.0,
+        min_positive: float = 0.0,
+        chunk_rows: int = 1024,
+    ):
+        self.nodata = nodata
+        self.max_nodata = max_nodata
+        self.min_std = min_std
+        self.min_positive = min_positive
+        self.chunk_rows = chunk_rows
+        self.kept = 0
+        self.dropped = {"nodata": 0, "variance": 0, "label": 0}
+
+    def __repr__(self) -> str:
+        return (
+            f"TileFilter(nodata={self.nodata!r}, max_nodata={self.max_nodata!r}, "
+            f"min_std={self.min_std!r}, min_positive={self.min_positive!r})"
+        )
+
+    @property
+    def report(self) -> dict:
+        return {
+            "kept": self.kept,
+            "dropped": sum(self.dropped.values()),
+            **self.dropped,
+        }
+
+    def valid_values(self, bands: np.ndarray):
+        # float64 copy of the bands with the nodata pixels set to 0, and the
+        # (H, W) mask of the valid pixels
+        x = bands.astype(np.float64)
+        if self.nodata is None:
+            valid = np.ones(x.shape[1:], dtype=bool)
+        else:
+            valid = ~np.all(x == self.nodata, axis=0)
+        x *= valid
+        return x, valid
+
+    def block_stats(self, bands: np.ndarray, size: int, label=None) -> dict:
+        # per block of the (C, H, W) bands: number of valid pixels, sum and
+        # squared sum of their values over all bands, number of positive
+        # label pixels
+        step = max(self.chunk_rows // size, 1) * size
+        stats = {"valid": [], "sum": [], "sumsq": [], "positive": []}
+        for top in range(0, bands.shape[1], step):
+            x, valid = self.valid_values(bands[:, top : top + step])
+            stats["valid"].append(block_sums(valid.astype(np.float64), size))
+            stats["sum"].append(block_sums(x.sum(axis=0), size))
+            stats["sumsq"].append(block_sums((x * x).sum(axis=0), size))
+            if label is not None:
+                positive = (label[top : top + step] > 0).astype(np.float64)
+                stats["positive"].append(block_sums(positive, size))
+        return {k: np.concatenate(v) for k, v in stats.items() if v}
+
+    def window_stats(self, bands, origins, crop_size: int, size: int, label=None):
+        # the tile sums of block_stats, read from the summed-area tables of
+        # blocks of size pixels
+        stats = self.block_stats(bands, size, label)
+        origins = np.asarray(origins) // size
+        return {k: window_sums(v, origins, crop_size // size) for k, v in stats.items()}
+
+    def tile_stats(self, bands, origins, crop_size: int, label=None) -> dict:
+        # the tile sums of block_stats, summed over the pixels of each tile,
+        # for block sizes too small for the summed-area tables
+        stats = {"valid": [], "sum": [], "sumsq": [], "positive": []}
+        for h, w in np.asarray(origins):
+            rows, cols = slice(h, h + crop_size), slice(w, w + crop_size)
+            x, valid = self.valid_values(bands[:, rows, cols])
+            stats["valid"].append(valid.sum())
+            stats["sum"].append(x.sum())
+            stats["sumsq"].append((x * x).sum())
+            if label is not None:
+                stats["positive"].append((label[rows, cols] > 0).sum())
+        return {k: np.array(v, dtype=np.float64) for k, v in stats.items()}
+
+    def keep(
+        self,
+        img: np.ndarray,
+        origins: np.ndarray,
+        crop_size: int,
+        stride: int,
+        channel_first: bool = False,
+        label: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Decide which tiles to keep, and count them in the report
+        Args:
+            img: image array, or a strip of its rows; not padded
+            origins: (N, 2) array of tile (h, w) origins relative to img
+            crop_size: tile size
+            stride: stride, the origins are multiples of it
+            channel_first: bands are stored in the first dimension
+            label: label array for min_positive, defaults to img
+        Returns:
+            (N,) boolean array, True for the tiles to write
+        """
+        bands = as_channel_first(img, channel_first)
+        if self.min_positive <= 0:
+            label = None
+        elif label is None:
+            label = bands[0]
+        else:
+            label = as_channel_first(label, channel_first)[0]
+        size = math.gcd(crop_size, stride)
+        if size < MIN_BLOCK_SIZE:
+            sums = self.tile_stats(bands, origins, crop_size, label)
+        else:
+            sums = self.window_stats(bands, origins, crop_size, size, label)
+        area = float(crop_size * crop_size)
+
+        valid = sums["valid"]
+        keep = np.ones(len(origins), dtype=bool)
+        by_nodata = 1 - valid / area > self.max_nodata
+        n_values = np.maximum(valid * bands.shape[0], 1)
+        mean = sums["sum"] / n_values
+        var = sums["sumsq"] / n_values - mean**2
+        by_variance = np.sqrt(np.maximum(var, 0)) < self.min_std
+        if label is not None:
+            positive = sums["positive"] / area
+            by_label = positive < self.min_positive
+        else:
+            by_label = np.zeros(len(origins), dtype=bool)
+
+        self.dropped["nodata"] += int(by_nodata.sum())
+        keep &= ~by_nodata
+        self.dropped["variance"] += int((keep & by_variance).sum())
+        keep &= ~by_variance
+        self.dropped["label"] += int((keep & by_label).sum())
+        keep &= ~by_label
+        self.kept += int(keep.sum())
+        return keep
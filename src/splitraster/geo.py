@@ -1,13 +1,251 @@
 from tqdm import tqdm
-from osgeo import gdal, gdal_array
 import numpy as np
 from pathlib import Path
-import random
-from typing import Tuple, Optional
+from functools import partial
+import json
+import csv
+import math
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional, Sequence
+from .manifest import TileManifest, start_manifest
+from .merge import TileMerger, find_tiles
+from .writer import TileWriter, first_tile_name
+from .timing import timed
+from .tile import (
+    get_stride,
+    padded_size,
+    grid_shape,
+    tile_generator,
+    pad_index,
+    pad_image,
+    get_tile,
+    tile_origins,
+    sample_crop_origins,
+    stratified_crop_origins,
+)
 
+# GDAL is imported by the functions which use it, so importing this module
+# (e.g. for the tile index helpers) does not pay the GDAL import time.
+if TYPE_CHECKING:
+    from osgeo import gdal
+
+
+# resampling name -> (GDAL RasterIO algorithm, BuildOverviews method)
+RESAMPLING = {
+    "nearest": ("GRIORA_NearestNeighbour", "NEAREST"),
+    "average": ("GRIORA_Average", "AVERAGE"),
+    "bilinear": ("GRIORA_Bilinear", "BILINEAR"),
+    "cubic": ("GRIORA_Cubic", "CUBIC"),
+    "mode": ("GRIORA_Mode", "MODE"),
+}
+
+
+class OverviewLevel:
+    """
+    A raster read at 1/factor of its resolution, with the dataset interface
+    the split functions use. Windows are read with buf_xsize/buf_ysize, so
+    GDAL reads them from the closest overview of the raster and only
+    resamples the rest; nothing is resampled in Python.
+    Args:
+        dataset: the full resolution gdal.Dataset
+        factor: downsampling factor, e.g. 2 for half the width and height
+        resampling: "nearest", "average", "bilinear", "cubic" or "mode"
+    """
+
+    def __init__(self, dataset: "gdal.Dataset", factor: int, resampling="average"):
+        from osgeo import gdal
+
+        if resampling not in RESAMPLING:
+            raise ValueError(
+                f"Unsupported resampling: {resampling}, use one of {list(RESAMPLING)}"
+            )
+        self.dataset = dataset
+        self.factor = factor
+        self.resample_alg = getattr(gdal, RESAMPLING[resampling][0])
+        self.RasterCount = dataset.RasterCount
+        # the size GDAL gives the overview of this factor
+        self.RasterXSize = -(-dataset.RasterXSize // factor)
+        self.RasterYSize = -(-dataset.RasterYSize // factor)
+        self.scale_x = dataset.RasterXSize / self.RasterXSize
+        self.scale_y = dataset.RasterYSize / self.RasterYSize
+
+    def GetProjection(self) -> str:
+        return self.dataset.GetProjection()
+
+    def GetGeoTransform(self) -> Tuple[float, ...]:
+        gt = self.dataset.GetGeoTransform()
+        return (
+            gt[0],
+            gt[1] * self.scale_x,
+            gt[2] * self.scale_y,
+            gt[3],
+            gt[4] * self.scale_x,
+            gt[5] * self.scale_y,
+        )
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None) -> np.ndarray:
+        xsize = self.RasterXSize - xoff if xsize is None else xsize
+        ysize = self.RasterYSize - yoff if ysize is None else ysize
+        # the window in full resolution pixels, rounded when the raster size
+        # is not a multiple of the factor
+        x0 = round(xoff * self.scale_x)
+        y0 = round(yoff * self.scale_y)
+        x1 = min(round((xoff + xsize) * self.scale_x), self.dataset.RasterXSize)
+        y1 = min(round((yoff + ysize) * self.scale_y), self.dataset.RasterYSize)
+        return self.dataset.ReadAsArray(
+            x0,
+            y0,
+            x1 - x0,
+            y1 - y0,
+            buf_xsize=int(xsize),
+            buf_ysize=int(ysize),
+            resample_alg=self.resample_alg,
+        )
+
+
+class BlockCache:
+    """
+    Read windows of a raster block by block, through an LRU cache of the
+    decoded GDAL blocks. Blocks are read whole (block-aligned reads), so a
+    block shared by two windows, e.g. by overlapping strips, is decoded once
+    as long as it stays in the cache. The block size is the one of the
+    bands, their least common multiple when the bands differ.
+    Args:
+        dataset: gdal.Dataset
+        max_blocks: number of decoded blocks kept in the cache
+    """
+
+    def __init__(self, dataset: "gdal.Dataset", max_blocks: int = 64):
+        self.dataset = dataset
+        self.RasterCount = dataset.RasterCount
+        self.RasterXSize = dataset.RasterXSize
+        self.RasterYSize = dataset.RasterYSize
+        sizes = [
+            dataset.GetRasterBand(i + 1).GetBlockSize()
+            for i in range(dataset.RasterCount)
+        ]
+        block_width = block_height = 1
+        for bw, bh in sizes:
+            block_width = block_width * bw // math.gcd(block_width, bw)
+            block_height = block_height * bh // math.gcd(block_height, bh)
+        self.block_width = min(block_width, self.RasterXSize)
+        self.block_height = min(block_height, self.RasterYSize)
+        self.n_block_cols = -(-self.RasterXSize // self.block_width)
+        self.n_block_rows = -(-self.RasterYSize // self.block_height)
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()  # (block row, block col) -> (D, h, w)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def report(self) -> dict:
+        # misses == blocks: every block of the raster was decoded once
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocks": self.n_block_rows * self.n_block_cols,
+            "block_size": (self.block_width, self.block_height),
+        }
+
+    def GetProjection(self) -> str:
+        return self.dataset.GetProjection()
+
+    def GetGeoTransform(self) -> Tuple[float, ...]:
+        return self.dataset.GetGeoTransform()
+
+    def _read_blocks(self, by: int, first: int, last: int) -> None:
+        # decode the blocks [first, last) of block row by in one read
+        bw, bh = self.block_width, self.block_height
+        x0, y0 = first * bw, by * bh
+        x1 = min(last * bw, self.RasterXSize)
+        y1 = min(y0 + bh, self.RasterYSize)
+        data = read_rasterWindow(self.dataset, x0, y0, x1 - x0, y1 - y0)
+        for bx in range(first, last):
+            key = (by, bx)
+            if key not in self.blocks:
+                self.misses += 1
+            self.blocks[key] = data[:, :, (bx - first) * bw : (bx - first + 1) * bw]
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None) -> np.ndarray:
+        xsize = self.RasterXSize - xoff if xsize is None else xsize
+        ysize = self.RasterYSize - yoff if ysize is None else ysize
+        bw, bh = self.block_width, self.block_height
+        cols = range(xoff // bw, (xoff + xsize - 1) // bw + 1)
+        out = None
+        for by in range(yoff // bh, (yoff + ysize - 1) // bh + 1):
+            missing = [bx for bx in cols if (by, bx) not in self.blocks]
+            self.hits += len(cols) - len(missing)
+            if missing:
+                self._read_blocks(by, missing[0], missing[-1] + 1)
+            # rows of the block in the window, and of the window in the block
+            top, bottom = max(yoff, by * bh), min(yoff + ysize, (by + 1) * bh)
+            for bx in cols:
+                block = self.blocks[(by, bx)]
+                self.blocks.move_to_end((by, bx))
+                if out is None:
+                    out = np.empty((self.RasterCount, ysize, xsize), block.dtype)
+                left, right = max(xoff, bx * bw), min(xoff + xsize, (bx + 1) * bw)
+                out[:, top - yoff : bottom - yoff, left - xoff : right - xoff] = block[
+                    :,
+                    top - by * bh : bottom - by * bh,
+                    left - bx * bw : right - bx * bw,
+                ]
+        # evict after the window is assembled, it may need more blocks
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        return out[0] if self.RasterCount == 1 else out
+
+
+def open_raster(image_path: str, level: int = 1, resampling: str = "average"):
+    # the dataset of image_path, read at 1/level of its resolution
+    from osgeo import gdal
 
-def read_rasterArray(image_path: str) -> Tuple[np.ndarray, Tuple[float, ...], str]:
     dataset = gdal.Open(image_path, gdal.GA_ReadOnly)
+    if dataset is None or level == 1:
+        return dataset
+    return OverviewLevel(dataset, level, resampling)
+
+
+def build_overviews(
+    image_path: str, factors: Sequence[int], resampling: str = "average"
+) -> List[int]:
+    """Build the overviews of a raster which it does not have yet.
+
+    Overviews are built once and kept with the raster (internal, or an
+    external .ovr file for read-only rasters), later reads at these factors
+    are served from them.
+
+    Args:
+        image_path (str): path of the raster
+        factors (list): downsampling factors, e.g. [2, 4, 8]
+        resampling (str): "nearest", "average", "bilinear", "cubic" or "mode"
+
+    Returns:
+        the factors built, empty when all overviews already exist
+    """
+    from osgeo import gdal
+
+    dataset = gdal.Open(image_path, gdal.GA_ReadOnly)
+    if dataset is None:
+        print("Image not found")
+        return []
+    band = dataset.GetRasterBand(1)
+    widths = {band.GetOverview(i).XSize for i in range(band.GetOverviewCount())}
+    width = dataset.RasterXSize
+    missing = [
+        f for f in sorted(set(factors)) if f > 1 and -(-width // f) not in widths
+    ]
+    if missing:
+        dataset.BuildOverviews(RESAMPLING[resampling][1], missing)
+    del dataset
+    return missing
+
+
+def read_rasterArray(
+    image_path: str, level: int = 1, resampling: str = "average"
+) -> Tuple[np.ndarray, Tuple[float, ...], str]:
+    dataset = open_raster(image_path, level, resampling)
     image = dataset.ReadAsArray()  # get the rasterArray
     # convert 2D raster to [1, H, W] format
     if len(image.shape) == 2:
@@ -17,61 +255,545 @@ def read_rasterArray(image_path: str) -> Tuple[np.ndarray, Tuple[float, ...], st
     return image, geotrans, proj
 
 
+def read_rasterWindow(
+    dataset: "gdal.Dataset", xoff: int, yoff: int, xsize: int, ysize: int
+) -> np.ndarray:
+    # read only the window [yoff:yoff+ysize, xoff:xoff+xsize] of all bands
+    image = dataset.ReadAsArray(int(xoff), int(yoff), int(xsize), int(ysize))
+    if len(image.shape) == 2:
+        image = image[np.newaxis, :, :]
+    return image
+
+
+def read_paddedStrip(
+    dataset: "gdal.Dataset",
+    row_start: int,
+    row_stop: int,
+    mode: str = "reflect",
+    constant_values=0,
+) -> np.ndarray:
+    # read the padded rows [row_start, row_stop) at full source width,
+    # rows beyond the bottom edge are padded like padding_mul_image does.
+    height, width = dataset.RasterYSize, dataset.RasterXSize
+    rows = pad_index(row_start, row_stop, height, mode)
+    top, bottom = int(rows.min()), int(rows.max()) + 1
+    strip = read_rasterWindow(dataset, 0, top, width, bottom - top)
+    if row_stop > height:
+        strip = strip[:, rows - top, :]
+        if mode == "constant":
+            strip[:, max(height - row_start, 0) :, :] = constant_values
+    return strip
+
+
 def save_rasterGeoTIF(
-    im_data: np.ndarray, im_geotrans: Tuple[float, ...], im_proj: str, file_name: str
+    im_data: np.ndarray,
+    im_geotrans: Tuple[float, ...],
+    im_proj: str,
+    file_name: str,
+    timer=None,
+    options: Optional[List[str]] = None,
+    vsimem: bool = False,
 ) -> None:
     if Path(file_name).is_file():
         print(f"Overwrite existing file: {file_name}")
+    # GDAL encodes the tile while writing it, both are timed as "write".
+    with timed(timer, "write"):
+        if vsimem:
+            data = encode_rasterGeoTIF(im_data, im_geotrans, im_proj, options)
+            Path(file_name).write_bytes(data)
+        else:
+            write_rasterGeoTIF(im_data, im_geotrans, im_proj, file_name, options)
+
+
+def gdal_datatype(dtype) -> int:
+    # GDAL data type storing dtype without loss: bool is written as Byte,
+    # int8 as Int16 before GDAL 3.7 (no Int8, its Byte would wrap negative
+    # values), types GDAL has no equivalent of (e.g. float16) as the smallest
+    # float type holding them
+    from osgeo import gdal, gdal_array
+
+    dtype = np.dtype(dtype)
+    if dtype == bool:
+        return gdal.GDT_Byte
+    if dtype == np.int8 and not hasattr(gdal, "GDT_Int8"):
+        return gdal.GDT_Int16
+    datatype = gdal_array.NumericTypeCodeToGDALTypeCode(dtype)
+    if datatype is None:
+        return gdal.GDT_Float32 if dtype.itemsize < 4 else gdal.GDT_Float64
+    return datatype
 
-    if "int8" in im_data.dtype.name:
-        datatype = gdal.GDT_Byte
-    elif "int16" in im_data.dtype.name:
-        datatype = gdal.GDT_UInt16
-    else:
-        datatype = gdal.GDT_Float32
 
-    if len(im_data.shape) == 3:
-        im_bands, im_height, im_width = im_data.shape
-    elif len(im_data.shape) == 2:
-        im_data = np.array([im_data])
-        im_bands, im_height, im_width = im_data.shape
+def create_rasterDataset(
+    driver_name: str,
+    file_name: str,
+    im_data: np.ndarray,
+    im_geotrans: Tuple[float, ...],
+    im_proj: str,
+    options: Optional[List[str]] = None,
+    per_band: bool = False,
+) -> "gdal.Dataset":
+    # a dataset of the driver holding im_data. The tile is written as it is,
+    # strided views (e.g. tiles of the padded raster) are not copied; all
+    # bands are written in one call unless per_band, or the GDAL version has
+    # no Dataset.WriteArray.
 
-    driver = gdal.GetDriverByName("GTiff")
+    from osgeo import gdal, gdal_array
+
+    datatype = gdal_datatype(im_data.dtype)
+    stored = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(datatype))
+    if stored != im_data.dtype:
+        im_data = im_data.astype(stored)
+    if len(im_data.shape) == 2:
+        im_data = im_data[np.newaxis]  # a view, not a copy
+    im_bands, im_height, im_width = im_data.shape
+
+    driver = gdal.GetDriverByName(driver_name)
     dataset = driver.Create(
-        file_name, int(im_width), int(im_height), int(im_bands), datatype
+        file_name,
+        int(im_width),
+        int(im_height),
+        int(im_bands),
+        datatype,
+        options=options or [],
     )
     if dataset is not None:
         dataset.SetGeoTransform(im_geotrans)
         dataset.SetProjection(im_proj)
-    for i in range(im_bands):
-        dataset.GetRasterBand(i + 1).WriteArray(im_data[i])
+    if im_bands > 1 and not per_band and hasattr(dataset, "WriteArray"):
+        dataset.WriteArray(im_data)
+    else:
+        for i in range(im_bands):
+            dataset.GetRasterBand(i + 1).WriteArray(im_data[i])
+    return dataset
+
+
+def write_rasterGeoTIF(
+    im_data: np.ndarray,
+    im_geotrans: Tuple[float, ...],
+    im_proj: str,
+    file_name: str,
+    options: Optional[List[str]] = None,
+    per_band: bool = False,
+) -> None:
+    # options are GTiff creation options, see encoders.gtiff_options
+    dataset = create_rasterDataset(
+        "GTiff", file_name, im_data, im_geotrans, im_proj, options, per_band
+    )
     del dataset
 
 
+def encode_rasterGeoTIF(
+    im_data: np.ndarray,
+    im_geotrans: Tuple[float, ...],
+    im_proj: str,
+    options: Optional[List[str]] = None,
+) -> bytes:
+    """Encode a tile to the bytes of a GeoTIFF file, without touching disk.
+
+    The tile is assembled in a MEM dataset and copied with its creation
+    options (compression, ...) to a GeoTIFF in /vsimem/, GDAL's in-memory
+    file system, whose bytes are returned, e.g. to upload the tile or to
+    pack it into a sinks.TarShardSink.
+    """
+    from osgeo import gdal
+
+    mem = create_rasterDataset("MEM", "", im_data, im_geotrans, im_proj)
+    # one file per call, encoding threads do not share it
+    vsi_path = f"/vsimem/splitraster/{uuid.uuid4().hex}.tif"
+    dataset = gdal.GetDriverByName("GTiff").CreateCopy(
+        vsi_path, mem, options=options or []
+    )
+    del dataset, mem  # flush the GeoTIFF
+    f = gdal.VSIFOpenL(vsi_path, "rb")
+    try:
+        gdal.VSIFSeekL(f, 0, 2)
+        size = gdal.VSIFTellL(f)
+        gdal.VSIFSeekL(f, 0, 0)
+        data = gdal.VSIFReadL(1, size, f)
+    finally:
+        gdal.VSIFCloseL(f)
+        gdal.Unlink(vsi_path)
+    return data
+
+
 def save_rasterArray(im_data: np.ndarray, file_name: str) -> bool:
     if Path(file_name).is_file():
         print(f"Overwrite existing file: {file_name}")
+    from osgeo import gdal_array
+
     gdal_array.SaveArray(im_data, file_name, format="GTiff")
     return True
 
 
+def tile_geotransforms(geotrans: Tuple[float, ...], origins: np.ndarray) -> np.ndarray:
+    # geotransform of every tile, origins is a (N, 2) array of (h, w) offsets
+    gt = np.asarray(geotrans, dtype=np.float64)
+    h = origins[:, 0]
+    w = origins[:, 1]
+    tile_gts = np.tile(gt, (len(origins), 1))
+    tile_gts[:, 0] = gt[0] + w * gt[1] + h * gt[2]
+    tile_gts[:, 3] = gt[3] + w * gt[4] + h * gt[5]
+    return tile_gts
+
+
+def tile_corners(tile_gts: np.ndarray, crop_size: int) -> np.ndarray:
+    # (N, 4, 2) array of the (x, y) corners of every tile, clockwise from
+    # the upper left one
+    px = np.array([0, crop_size, crop_size, 0], dtype=np.float64)
+    py = np.array([0, 0, crop_size, crop_size], dtype=np.float64)
+    x = tile_gts[:, [0]] + px * tile_gts[:, [1]] + py * tile_gts[:, [2]]
+    y = tile_gts[:, [3]] + px * tile_gts[:, [4]] + py * tile_gts[:, [5]]
+    return np.stack([x, y], axis=2)
+
+
+def write_tile_index(
+    index_path: str,
+    names: List[str],
+    origins: np.ndarray,
+    tile_gts: np.ndarray,
+    crop_size: int,
+    proj: str,
+) -> str:
+    """Write one sidecar index of tile name -> bounds for all tiles.
+
+    The format follows the suffix of index_path: ".csv" writes a table,
+    anything else a GeoJSON FeatureCollection of the tile footprints.
+    """
+    corners = tile_corners(tile_gts, crop_size)
+    lower = corners.min(axis=1)
+    upper = corners.max(axis=1)
+    rows = [
+        {
+            "id": i + 1,
+            "name": name,
+            "h": int(origins[i, 0]),
+            "w": int(origins[i, 1]),
+            "minx": float(lower[i, 0]),
+            "miny": float(lower[i, 1]),
+            "maxx": float(upper[i, 0]),
+            "maxy": float(upper[i, 1]),
+        }
+        for i, name in enumerate(names)
+    ]
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    if Path(index_path).suffix.lower() == ".csv":
+        with open(index_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["id"])
+            writer.writeheader()
+            writer.writerows(rows)
+        return index_path
+
+    features = [
+        {
+            "type": "Feature",
+            "properties": row,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [corners[i].tolist() + [corners[i][0].tolist()]],
+            },
+        }
+        for i, row in enumerate(rows)
+    ]
+    collection = {"type": "FeatureCollection", "features": features}
+    from osgeo import osr
+
+    srs = osr.SpatialReference(wkt=proj) if proj else None
+    if srs is not None and srs.GetAuthorityCode(None):
+        authority = srs.GetAuthorityName(None)
+        code = srs.GetAuthorityCode(None)
+        crs_name = f"urn:ogc:def:crs:{authority}::{code}"
+        collection["crs"] = {"type": "name", "properties": {"name": crs_name}}
+    with open(index_path, "w") as f:
+        json.dump(collection, f)
+    return index_path
+
+
 def count_files(folder_path: str) -> int:
     return sum(1 for path in Path(folder_path).iterdir() if path.is_file())
 
 
-def padding_mul_image(img: np.ndarray, stride: int) -> np.ndarray:
-    D, height, width = img.shape  # (D, H, W) format Channel First.
-    # get the minimal padding image size
-    H = int(np.ceil(height / stride) * stride)
-    W = int(np.ceil(width / stride) * stride)
+def padding_mul_image(
+    img: np.ndarray, stride: int, mode: str = "reflect", constant_values=0
+) -> np.ndarray:
+    # (D, H, W) format Channel First, all bands are padded at once.
+    return pad_image(img, stride, True, mode, constant_values)
+
+
+def open_source(
+    img_path: str,
+    stream: bool = False,
+    level: int = 1,
+    resampling: str = "average",
+    timer=None,
+    block_cache: bool = False,
+    crop_size: int = 256,
+) -> Optional[tuple]:
+    # (img, dataset, shape, geotrans, proj) of a raster to split, img is
+    # None when streaming and dataset None otherwise; None if it is missing.
+    # A streamed full resolution raster is read through a BlockCache when
+    # block_cache is set
+    if not stream:
+        with timed(timer, "read"):
+            img, geotrans, proj = read_rasterArray(img_path, level, resampling)
+        if img is None:
+            return None
+        return img, None, img.shape, geotrans, proj
+    dataset = open_raster(img_path, level, resampling)
+    if dataset is None:
+        return None
+    shape = (dataset.RasterCount, dataset.RasterYSize, dataset.RasterXSize)
+    geotrans, proj = dataset.GetGeoTransform(), dataset.GetProjection()
+    if block_cache and level == 1:
+        dataset = strip_block_cache(dataset, crop_size)
+    return None, dataset, shape, geotrans, proj
+
+
+def strip_block_cache(dataset: "gdal.Dataset", crop_size: int) -> BlockCache:
+    # a BlockCache keeping the block rows two strips share, and the bottom
+    # rows the padding reads again
+    cache = BlockCache(dataset)
+    block_rows = -(-crop_size // cache.block_height) + 1
+    cache.max_blocks = cache.n_block_cols * block_rows
+    return cache
+
+
+def padded_tiles(
+    img: np.ndarray,
+    keep: np.ndarray,
+    grid: Tuple[int, int, int],
+    crop_size: int,
+    virtual_padding: bool = False,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    timer=None,
+):
+    # the tiles of a loaded raster, in grid order, None for dropped tiles
+    n_rows, n_cols, stride = grid
+    if virtual_padding:
+        padded_img = img
+    else:
+        with timed(timer, "pad"):
+            padded_img = padding_mul_image(img, stride, pad_mode, pad_value)
+    for n, (h, w) in enumerate(tile_generator(n_rows, n_cols, stride)):
+        if not keep[n]:
+            yield None
+            continue
+        with timed(timer, "slice"):
+            yield get_tile(padded_img, h, w, crop_size, True, pad_mode, pad_value)
+
+
+def strip_tiles(
+    strip: np.ndarray,
+    cols: np.ndarray,
+    keep: np.ndarray,
+    origins: np.ndarray,
+    top: int,
+    width: int,
+    crop_size: int,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+):
+    # the tiles of one strip read from row top, None for dropped tiles; only
+    # tiles crossing the right edge take the padded columns cols
+    for keep_tile, (h, w) in zip(keep, origins):
+        if not keep_tile:
+            yield None
+        elif w + crop_size <= width:
+            yield strip[:, h - top : h - top + crop_size, w : w + crop_size]
+        else:
+            crop_img = strip[:, h - top : h - top + crop_size, cols[w : w + crop_size]]
+            if pad_mode == "constant":
+                crop_img[:, :, width - w :] = pad_value
+            yield crop_img
+
+
+def streamed_tiles(
+    dataset: "gdal.Dataset",
+    keep: np.ndarray,
+    origins: np.ndarray,
+    grid: Tuple[int, int, int],
+    crop_size: int,
+    strip_rows: int = 1,
+    tile_filter=None,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    timer=None,
+):
+    # the tiles of a raster read strip_rows tile rows at a time, in grid
+    # order, None for dropped tiles; keep is filled strip by strip
+    n_rows, n_cols, stride = grid
+    height, width = dataset.RasterYSize, dataset.RasterXSize
+    cols = pad_index(0, padded_size(width, stride), width, pad_mode)
+    for first_row in range(0, n_rows, strip_rows):
+        last_row = min(first_row + strip_rows, n_rows)
+        top = first_row * stride
+        bottom = (last_row - 1) * stride + crop_size
+        with timed(timer, "read"):
+            strip = read_paddedStrip(dataset, top, bottom, pad_mode, pad_value)
+        first, last = first_row * n_cols, last_row * n_cols
+        if tile_filter is not None:
+            with timed(timer, "filter"):
+                keep[first:last] = tile_filter.keep(
+                    strip[:, : height - top],
+                    origins[first:last] - (top, 0),
+                    crop_size,
+                    stride,
+                    True,
+                )
+        with timed(timer, "slice"):
+            tiles = list(
+                strip_tiles(
+                    strip,
+                    cols,
+                    keep[first:last],
+                    origins[first:last],
+                    top,
+                    width,
+                    crop_size,
+                    pad_mode,
+                    pad_value,
+                )
+            )
+        yield from tiles
+    if isinstance(dataset, BlockCache):
+        print(f"Block cache: {dataset.report}")
+
+
+class TileOutput:
+    """
+    Where split_image sends its tiles: a sink, the files of an incremental
+    split recorded in its manifest, or one GeoTIFF file per tile.
+    Args:
+        save_path: output folder
+        ext: tile file suffix
+        origins: (N, 2) grid origins of the tiles
+        tile_gts: (N, 6) geotransforms of the tiles
+        proj: projection of the tiles
+        sink: optional sink of all tiles
+        manifest: optional TileManifest of an incremental split
+        timer: optional StageTimer
+        creation_options: GTiff creation options of the tiles
+        vsimem: encode the tiles in memory, see save_rasterGeoTIF
+    """
+
+    def __init__(
+        self,
+        save_path: str,
+        ext: str,
+        origins: np.ndarray,
+        tile_gts: np.ndarray,
+        proj: str,
+        sink=None,
+        manifest: Optional[TileManifest] = None,
+        timer=None,
+        creation_options: Optional[List[str]] = None,
+        vsimem: bool = False,
+    ):
+        self.save_path = Path(save_path)
+        self.ext = ext
+        self.origins = origins
+        self.tile_gts = tile_gts
+        self.proj = proj
+        self.sink = sink
+        self.manifest = manifest
+        self.timer = timer
+        self.creation_options = creation_options
+        self.vsimem = vsimem
+        self.names = []  # names of the kept tiles
+        self.skipped = 0  # unchanged tiles of an incremental split
 
-    padded_img = np.zeros((D, H, W), dtype=img.dtype)
-    for d in range(D):  # padding every layer
-        onelayer = img[d, :, :]
-        padded_img[d, :, :] = np.pad(
-            onelayer, ((0, H - height), (0, W - width)), "reflect"
+    def save_args(self, n: int, crop_img: np.ndarray, crop_image_path) -> tuple:
+        return (
+            crop_img,
+            tuple(self.tile_gts[n]),
+            self.proj,
+            str(crop_image_path),
+            self.timer,
+            self.creation_options,
+            self.vsimem,
+        )
+
+    def submit(self, writer: TileWriter, pbar, n: int, crop_img, new_name: int):
+        # queue the tile n of the grid on the writer
+        h, w = self.origins[n]
+        if self.manifest is not None:
+            # a grid cell keeps its name across incremental runs
+            new_name = self.manifest.tile_id(h, w)
+        crop_image_name = f"{new_name:04d}{self.ext}"
+        crop_image_path = self.save_path / crop_image_name
+        if self.sink is not None:
+            self.submit_to_sink(writer, n, crop_img, crop_image_name)
+        elif self.manifest is not None:
+            self.submit_changed(writer, pbar, n, crop_img, new_name, crop_image_path)
+        else:
+            writer.submit(
+                save_rasterGeoTIF, *self.save_args(n, crop_img, crop_image_path)
+            )
+        self.names.append(crop_image_name)
+
+    def submit_changed(
+        self, writer: TileWriter, pbar, n: int, crop_img, tile_id: int, file_path
+    ):
+        # write the tile unless the manifest has it, unchanged
+        h, w = self.origins[n]
+        checksum = self.manifest.checksum(crop_img)
+        if self.manifest.is_done(h, w, checksum, file_path):
+            self.skipped += 1
+            pbar.update(1)
+            return
+        writer.submit(
+            self.manifest.written,
+            h,
+            w,
+            tile_id,
+            checksum,
+            file_path,
+            save_rasterGeoTIF,
+            *self.save_args(n, crop_img, file_path),
+        )
+
+    def open(self, n_tiles: int, tile_shape: Tuple[int, ...], dtype) -> None:
+        if self.sink is not None:
+            self.sink.open(n_tiles, tile_shape, dtype)
+
+    def write(self, tiles, new_name: int, workers: int = 1) -> None:
+        # write the tiles of the grid, in grid order, None for dropped tiles
+        with tqdm(
+            total=len(self.origins),
+            desc="Generating",
+            colour="green",
+            leave=True,
+            unit="img",
+        ) as pbar, TileWriter(workers, pbar) as writer:
+            for n, crop_img in enumerate(tiles):
+                if crop_img is not None:
+                    self.submit(writer, pbar, n, crop_img, new_name)
+                else:
+                    pbar.update(1)
+                new_name += 1
+
+    def close(self, n_tiles: int) -> None:
+        if self.sink is not None:
+            with timed(self.timer, "write"):
+                self.sink.close()
+        if self.manifest is not None:
+            self.manifest.finish(n_tiles)
+            print(f"{n_tiles - self.skipped} tiles written, {self.skipped} unchanged")
+
+    def submit_to_sink(self, writer: TileWriter, n: int, crop_img, name: str):
+        encode = None
+        if self.sink.needs_encoding:
+            encode = partial(
+                encode_rasterGeoTIF,
+                im_geotrans=tuple(self.tile_gts[n]),
+                im_proj=self.proj,
+                options=self.creation_options,
+            )
+        # the sink holds the kept tiles only, the index keeps the grid origin
+        # of each
+        writer.submit(
+            self.sink.add, len(self.names), name, crop_img, self.origins[n], encode
         )
-    return padded_img
 
 
 def split_image(
@@ -81,59 +803,399 @@ def split_image(
     repetition_rate: float = 0,
     overwrite: bool = True,
     ext: Optional[str] = ".",
+    stream: bool = False,
+    strip_rows: int = 1,
+    workers: int = 1,
+    index_path: Optional[str] = None,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    virtual_padding: bool = False,
+    timer=None,
+    creation_options: Optional[List[str]] = None,
+    sink=None,
+    incremental: bool = False,
+    tile_filter=None,
+    level: int = 1,
+    resampling: str = "average",
+    block_cache: bool = True,
+    vsimem: bool = False,
 ) -> Optional[int]:
+    """Split a raster into tiles.
+
+    Args:
+        img_path (str): path of input raster
+        save_path (str): path to save tiles
+        crop_size (int): tile size (H,W), i.e., 256x256
+        repetition_rate (float): overlap rate between neighbouring tiles
+        overwrite (bool): overwrite existing files
+        stream (bool): read the raster window by window instead of loading
+            the whole raster, peak memory is bounded by strip_rows tile rows
+        strip_rows (int): number of tile rows read at once in stream mode
+        workers (int): number of threads encoding and writing tiles
+        index_path (str): optional GeoJSON (or .csv) file listing the bounds
+            of every tile
+        pad_mode (str): "reflect", "symmetric", "edge" or "constant"
+        pad_value (float): fill value of the "constant" mode, e.g. nodata
+        virtual_padding (bool): do not allocate the padded raster, only the
+            tiles crossing the bottom or right edge are padded
+        timer (StageTimer): optional, times the read, pad, slice and write
+            stages
+        creation_options (list): GTiff creation options of the tiles, e.g.
+            encoders.gtiff_options("DEFLATE", predictor=2, tiled=True)
+        sink (NpyStackSink): optional, write all tiles into one (N, D, H, W)
+            .npy stack instead of one GeoTIFF per tile; sinks of encoded
+            tiles (TarShardSink, CallbackSink) get GeoTIFF bytes, see
+            encode_rasterGeoTIF
+        incremental (bool): record the written tiles in a manifest of
+            save_path, a rerun skips an unchanged raster and only rewrites
+            the tiles which changed; overwrite is ignored
+        tile_filter (TileFilter): optional, the dropped tiles are not
+            written and their names are skipped; its report counts the kept
+            and dropped tiles
+        level (int): split the raster at 1/level of its resolution, read
+            from its overviews, see OverviewLevel
+        resampling (str): resampling of the levels without an overview
+        block_cache (bool): in stream mode, read the raster by whole GDAL
+            blocks through a BlockCache large enough for the strips to
+            overlap, so every block is decoded once; prints its hits/misses
+        vsimem (bool): encode the tiles in memory (/vsimem/) and write each
+            file in one sequential write, GDAL does not access the output
+            file system, e.g. a network share
+
+    Returns:
+        number of tiles written
+    """
+    manifest = None
+    if incremental:
+        params = split_params(
+            crop_size,
+            repetition_rate,
+            pad_mode,
+            pad_value,
+            creation_options,
+            tile_filter,
+            level,
+            resampling,
+        )
+        manifest, n_done = start_manifest(img_path, save_path, params, sink)
+        if manifest is None or n_done is not None:
+            return n_done
     # check input image
-    img, geotrans, proj = read_rasterArray(img_path)
-    if img is None:
+    source = open_source(
+        img_path, stream, level, resampling, timer, block_cache, crop_size
+    )
+    if source is None:
         print("Image not found")
         return None
-    # get image suffix
-    ext = Path(img_path).suffix
+    img, dataset, shape, geotrans, proj = source
+    D, height, width = shape
     # check output folder, if not exists, creat it.
     Path(save_path).mkdir(parents=True, exist_ok=True)
 
-    print(f"Input Image File Shape (D, H, W):{ img.shape}")
+    print(f"Input Image File Shape (D, H, W):{ shape}")
 
-    stride = int(crop_size * (1 - repetition_rate))
+    stride = get_stride(crop_size, repetition_rate)
     print(f"crop_size = {crop_size}, stride = {stride}")
 
-    padded_img = padding_mul_image(img, stride)
+    H = padded_size(height, stride)
+    W = padded_size(width, stride)
 
-    H = padded_img.shape[1]
-    W = padded_img.shape[2]
+    print(f"Padding Image File Shape (D, H, W):{ (D, H, W)}")
 
-    print(f"Padding Image File Shape (D, H, W):{ padded_img.shape}")
+    new_name = first_tile_name([save_path], overwrite or incremental)
 
-    if overwrite:
-        new_name = 1
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    # every tile gets its own origin, computed once for the whole grid.
+    origins = tile_origins(n_rows, n_cols, stride)
+    tile_gts = tile_geotransforms(geotrans, origins)
+    # tiles dropped by the filter, decided per strip when streaming
+    keep = np.ones(n_rows * n_cols, dtype=bool)
+    grid = (n_rows, n_cols, stride)
+    if stream:
+        tiles = streamed_tiles(
+            dataset,
+            keep,
+            origins,
+            grid,
+            crop_size,
+            strip_rows,
+            tile_filter,
+            pad_mode,
+            pad_value,
+            timer,
+        )
+        # the data type of a sink, read from the first pixel
+        dtype = None if sink is None else read_rasterWindow(dataset, 0, 0, 1, 1).dtype
     else:
-        cnt = count_files(save_path)
-        new_name = cnt + 1
-        print(f"There are {cnt} files in the {save_path}")
-        print(f"New image name will start with {new_name}")
+        if tile_filter is not None:
+            with timed(timer, "filter"):
+                keep[:] = tile_filter.keep(img, origins, crop_size, stride, True)
+        tiles = padded_tiles(
+            img, keep, grid, crop_size, virtual_padding, pad_mode, pad_value, timer
+        )
+        dtype = img.dtype
+
+    output = TileOutput(
+        save_path,
+        Path(img_path).suffix,
+        origins,
+        tile_gts,
+        proj,
+        sink,
+        manifest,
+        timer,
+        creation_options,
+        vsimem,
+    )
+    # when streaming, the filter is only known strip by strip, the sink
+    # drops the entries left empty when it is closed
+    output.open(int(keep.sum()), (D, crop_size, crop_size), dtype)
+    output.write(tiles, new_name, workers)
+    n_tiles = int(keep.sum())
+    if tile_filter is not None:
+        print(f"Tile filter: {tile_filter.report}")
+    output.close(n_tiles)
+
+    if index_path is not None:
+        write_tile_index(
+            index_path, output.names, origins[keep], tile_gts[keep], crop_size, proj
+        )
+    return n_tiles
+
+
+def split_params(
+    crop_size: int,
+    repetition_rate: float = 0,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    creation_options: Optional[List[str]] = None,
+    tile_filter=None,
+    level: int = 1,
+    resampling: str = "average",
+) -> dict:
+    # the split parameters an incremental split records in its manifest
+    params = dict(
+        crop_size=crop_size,
+        repetition_rate=repetition_rate,
+        pad_mode=pad_mode,
+        pad_value=pad_value,
+        creation_options=creation_options or [],
+        tile_filter=repr(tile_filter),
+    )
+    if level != 1:
+        params.update(level=level, resampling=resampling)
+    return params
+
+
+def split_pyramid(
+    img_path: str,
+    save_path: str,
+    crop_size: int,
+    levels: Sequence[int] = (1, 2, 4),
+    resampling: str = "average",
+    build: bool = False,
+    index_path: Optional[str] = None,
+    **kwargs,
+) -> Optional[Dict[int, int]]:
+    """Split a raster into tiles at several resolutions, a tile pyramid.
+
+    Level f is the raster at 1/f of its resolution, its tiles are written to
+    save_path/{f}x. Every level is read from the overview of the raster
+    closest to it, the full resolution raster is not resampled.
+
+    Args:
+        img_path (str): path of input raster
+        save_path (str): path to save the level folders
+        crop_size (int): tile size (H,W) at every level
+        levels (list): downsampling factors, 1 is the full resolution
+        resampling (str): "nearest", "average", "bilinear", "cubic" or
+            "mode", for the overviews built and the levels without one
+        build (bool): build the missing overviews first, they are kept with
+            the raster for the next runs
+        index_path (str): optional tile index, one per level with the level
+            appended to its name, e.g. tiles_2x.geojson
+        kwargs: other split_image arguments, e.g. repetition_rate, stream
+
+    Returns:
+        number of tiles written per level
+    """
+    if build:
+        built = build_overviews(img_path, levels, resampling)
+        if built:
+            print(f"Built overviews {built} of {img_path}")
+    counts = {}
+    for level in levels:
+        level_index = None
+        if index_path is not None:
+            index = Path(index_path)
+            level_index = str(index.with_name(f"{index.stem}_{level}x{index.suffix}"))
+        n = split_image(
+            img_path,
+            str(Path(save_path) / f"{level}x"),
+            crop_size,
+            index_path=level_index,
+            level=level,
+            resampling=resampling,
+            **kwargs,
+        )
+        if n is None:
+            return None
+        counts[level] = n
+    return counts
+
+
+def split_aligned_images(
+    img_paths: List[str],
+    save_paths: List[str],
+    crop_size: int,
+    repetition_rate: float = 0,
+    overwrite: bool = True,
+    workers: int = 1,
+    index_path: Optional[str] = None,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    virtual_padding: bool = False,
+    creation_options: Optional[List[str]] = None,
+    tile_filter=None,
+) -> Optional[int]:
+    """Split aligned rasters (e.g. an image and its label) on one shared grid.
+
+    Every raster is read once and the tiles of the same grid cell get the
+    same name and geotransform in every save path.
+
+    Args:
+        img_paths (list): paths of input rasters, all with the same size
+        save_paths (list): paths to save tiles, one per raster
+        crop_size (int): tile size (H,W), i.e., 256x256
+        repetition_rate (float): overlap rate between neighbouring tiles
+        overwrite (bool): overwrite existing files
+        workers (int): number of threads encoding and writing tiles
+        index_path (str): optional GeoJSON (or .csv) file listing the bounds
+            of every tile
+        pad_mode (str): "reflect", "symmetric", "edge" or "constant"
+        pad_value (float): fill value of the "constant" mode, e.g. nodata
+        virtual_padding (bool): do not allocate the padded rasters
+        creation_options (list): GTiff creation options of the tiles
+        tile_filter (TileFilter): optional, nodata and variance are measured
+            on the first raster, the label fraction on the last one
 
-    n_rows = int((H - crop_size) / stride + 1)
-    n_cols = int((W - crop_size) / stride + 1)
+    Raises:
+        ValueError: if the rasters do not have the same height and width
+    """
+    if len(img_paths) != len(save_paths):
+        print("Every input raster needs its own save path.")
+        return None
+    # check the rasters are aligned before writing anything
+    rasters = read_aligned_rasters(img_paths)
+    if rasters is None:
+        return None
+    imgs = [img for img, _, _ in rasters]
+    geotrans, proj = rasters[0][1], rasters[0][2]
+    for save_path in save_paths:
+        Path(save_path).mkdir(parents=True, exist_ok=True)
+
+    stride = get_stride(crop_size, repetition_rate)
+    print(f"crop_size = {crop_size}, stride = {stride}")
+    H = padded_size(imgs[0].shape[1], stride)
+    W = padded_size(imgs[0].shape[2], stride)
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    origins = tile_origins(n_rows, n_cols, stride)
+    keep = np.ones(n_rows * n_cols, dtype=bool)
+    if tile_filter is not None:
+        keep = tile_filter.keep(
+            imgs[0], origins, crop_size, stride, True, label=imgs[-1]
+        )
+        print(f"Tile filter: {tile_filter.report}")
+    if not virtual_padding:
+        imgs = [padding_mul_image(img, stride, pad_mode, pad_value) for img in imgs]
+    print(f"Padding Image File Shape (H, W):{ (H, W)}")
 
-    def tile_generator():
-        for idh in range(n_rows):
-            h = idh * stride
-            for idw in range(n_cols):
-                w = idw * stride
-                yield h, w
+    new_name = first_tile_name(save_paths, overwrite)
+    if new_name is None:
+        return None
+
+    tile_gts = tile_geotransforms(geotrans, origins)
+    outputs = [
+        (img, img_proj, Path(save_path), Path(img_path).suffix)
+        for img, (_, _, img_proj), save_path, img_path in zip(
+            imgs, rasters, save_paths, img_paths
+        )
+    ]
+    names = write_aligned_tiles(
+        outputs,
+        keep,
+        origins,
+        tile_gts,
+        crop_size,
+        new_name,
+        workers,
+        pad_mode,
+        pad_value,
+        creation_options,
+    )
+
+    if index_path is not None:
+        write_tile_index(
+            index_path, names, origins[keep], tile_gts[keep], crop_size, proj
+        )
+    return int(keep.sum())
 
+
+def write_aligned_tiles(
+    outputs: list,
+    keep: np.ndarray,
+    origins: np.ndarray,
+    tile_gts: np.ndarray,
+    crop_size: int,
+    new_name: int = 1,
+    workers: int = 1,
+    pad_mode: str = "reflect",
+    pad_value: float = 0,
+    creation_options: Optional[List[str]] = None,
+) -> List[str]:
+    # write the kept grid cells of every (img, proj, save path, ext) output
+    # under the same name, returns the names of the first output
+    names = []
     with tqdm(
-        total=n_rows * n_cols, desc="Generating", colour="green", leave=True, unit="img"
-    ) as pbar:
-        for n, (h, w) in enumerate(tile_generator()):
-            crop_img = padded_img[:, h : h + crop_size, w : w + crop_size]
-            crop_image_name = f"{new_name:04d}{ext}"
-            crop_image_path = Path(save_path) / crop_image_name
-            save_rasterGeoTIF(crop_img, geotrans, proj, str(crop_image_path))
+        total=int(keep.sum()) * len(outputs),
+        desc="Generating",
+        colour="green",
+        leave=True,
+        unit="img",
+    ) as pbar, TileWriter(workers, pbar) as writer:
+        for n, (h, w) in enumerate(origins):
+            if keep[n]:
+                for img, img_proj, save_path, ext in outputs:
+                    crop_img = get_tile(img, h, w, crop_size, True, pad_mode, pad_value)
+                    writer.submit(
+                        save_rasterGeoTIF,
+                        crop_img,
+                        tuple(tile_gts[n]),
+                        img_proj,
+                        str(save_path / f"{new_name:04d}{ext}"),
+                        options=creation_options,
+                    )
+                names.append(f"{new_name:04d}{outputs[0][3]}")
             new_name += 1
-            pbar.update(1)
+    return names
+
 
-    return n + 1
+def read_aligned_rasters(img_paths: List[str]) -> Optional[list]:
+    # (img, geotrans, proj) of every raster, None if one is missing, raises
+    # ValueError if they do not have the same height and width
+    rasters = [read_rasterArray(img_path) for img_path in img_paths]
+    if any(img is None for img, _, _ in rasters):
+        print("Image not found")
+        return None
+    for img_path, (img, _, _) in zip(img_paths, rasters):
+        print(f"Input Image File Shape (D, H, W):{ img.shape} {img_path}")
+        if img.shape[1:] != rasters[0][0].shape[1:]:
+            raise ValueError(
+                f"Input rasters do not have the same height and width: "
+                f"{img_paths[0]} {rasters[0][0].shape[1:]}, "
+                f"{img_path} {img.shape[1:]}"
+            )
+    return rasters
 
 
 def random_crop_image(
@@ -146,6 +1208,15 @@ def random_crop_image(
     img_ext: str = ".tif",
     label_ext: str = ".tif",
     overwrite: bool = True,
+    index_path: Optional[str] = None,
+    workers: int = 1,
+    timer=None,
+    creation_options: Optional[List[str]] = None,
+    seed=None,
+    replace: bool = True,
+    min_spacing: int = 0,
+    class_proportions=None,
+    label_index=None,
 ) -> Optional[int]:
     """Generate Random cropped image pair from the input image pairs.
 
@@ -159,13 +1230,30 @@ def random_crop_image(
         img_ext (str): extension for image files
         label_ext (str): extension for label files
         overwrite (bool): overwrite existing files
+        index_path (str): optional GeoJSON (or .csv) file listing the bounds
+            of every crop
+        workers (int): number of threads encoding and writing pairs
+        timer (StageTimer): optional, times the read, slice and write stages
+        creation_options (list): GTiff creation options of the crops
+        seed (int): seed of the crop sampler, the same seed gives the same
+            crops
+        replace (bool): allow the same crop more than once
+        min_spacing (int): min distance in rows or columns between two
+            crops, see tile.sample_crop_origins
+        class_proportions (dict): draw the crops with these shares of the
+            label classes, e.g. {0: 0.2, 1: 0.8}, or "balanced" for the same
+            share per class; replace and min_spacing do not apply
+        label_index (LabelIndex): prebuilt class index of the label, built
+            from the label when class_proportions is given
     """
-    img, geotrans, proj = read_rasterArray(label_path)
+    with timed(timer, "read"):
+        img, geotrans, proj = read_rasterArray(img_path)
     if img is None:
         print("Input image is missing")
         return None
 
-    label, geotrans, proj = read_rasterArray(img_path)
+    with timed(timer, "read"):
+        label, _, _ = read_rasterArray(label_path)
     if label is None:
         print("Label image is missing")
         return None
@@ -181,53 +1269,153 @@ def random_crop_image(
         label_ext = Path(label_path).suffix
 
     # find the start name of the image paris.
-    if overwrite:
-        new_name = 1
-    else:
-        img_cnt = count_files(img_path)
-        label_cnt = count_files(label_path)
-        new_name = img_cnt + 1
-        print(f"There are {img_cnt} files in the {img_save_path}")
-        print(f"There are {label_cnt} files in the {label_save_path}")
-        if not img_cnt == label_cnt:
-            print("Image Pair doest not match in output folders.")
-            return None
-        print(f"New image pairs' name will start with {new_name}")
+    new_name = first_tile_name([img_save_path, label_save_path], overwrite)
+    if new_name is None:
+        return None
 
     crop_cnt = 0
     H = img.shape[1]
     W = img.shape[2]
+    # all crop origins and their geotransforms are computed at once
+    if class_proportions is not None:
+        origins = stratified_crop_origins(
+            label,
+            crop_size,
+            crop_number,
+            class_proportions,
+            seed,
+            label_index,
+            channel_first=True,
+        )
+    else:
+        origins = sample_crop_origins(
+            H, W, crop_size, crop_number, seed, replace, min_spacing
+        )
+    tile_gts = tile_geotransforms(geotrans, origins)
+    names = []
+
+    def save_pair(imgCrop, img_crop_path, labelCrop, label_crop_path, geotrans):
+        save_rasterGeoTIF(
+            imgCrop, geotrans, proj, img_crop_path, timer, creation_options
+        )
+        save_rasterGeoTIF(
+            labelCrop, geotrans, proj, label_crop_path, timer, creation_options
+        )
 
     with tqdm(
-        total=crop_number, desc="Generating", colour="green", leave=True, unit="img"
-    ) as pbar:
-        while crop_cnt < crop_number:
+        total=len(origins), desc="Generating", colour="green", leave=True, unit="img"
+    ) as pbar, TileWriter(workers, pbar) as writer:
+        for UpperLeftX, UpperLeftY in origins:
             # Crop img_crop, label_crop paris and save them to the output folders.
-            UpperLeftX = random.randint(0, H - crop_size)
-            UpperLeftY = random.randint(0, W - crop_size)
-
-            imgCrop = img[
-                :,
-                UpperLeftX : UpperLeftX + crop_size,
-                UpperLeftY : UpperLeftY + crop_size,
-            ]
-
-            labelCrop = label[
-                :,
-                UpperLeftX : UpperLeftX + crop_size,
-                UpperLeftY : UpperLeftY + crop_size,
-            ]
+            with timed(timer, "slice"):
+                imgCrop = img[
+                    :,
+                    UpperLeftX : UpperLeftX + crop_size,
+                    UpperLeftY : UpperLeftY + crop_size,
+                ]
+
+                labelCrop = label[
+                    :,
+                    UpperLeftX : UpperLeftX + crop_size,
+                    UpperLeftY : UpperLeftY + crop_size,
+                ]
             # save image pairs
             crop_image_name = f"{new_name:04d}{img_ext}"
-            crop_image_path = Path(img_save_path) / crop_image_name
-            save_rasterGeoTIF(imgCrop, geotrans, proj, str(crop_image_path))
-
-            crop_image_name = f"{new_name:04d}{label_ext}"
-            crop_image_path = Path(label_save_path) / crop_image_name
-            save_rasterGeoTIF(labelCrop, geotrans, proj, str(crop_image_path))
+            img_crop_path = str(Path(img_save_path) / crop_image_name)
+            label_crop_path = str(Path(label_save_path) / f"{new_name:04d}{label_ext}")
+            writer.submit(
+                save_pair,
+                imgCrop,
+                img_crop_path,
+                labelCrop,
+                label_crop_path,
+                tuple(tile_gts[crop_cnt]),
+            )
+            names.append(crop_image_name)
 
             new_name += 1  # update image name
             crop_cnt += 1  # add crop count
-            pbar.update(1)
 
+    if index_path is not None:
+        write_tile_index(index_path, names, origins, tile_gts, crop_size, proj)
     return crop_cnt  # return total crop sample pair number.
+
+
+def merge_tiles(
+    tile_path: str,
+    out_path: str,
+    height: int,
+    width: int,
+    crop_size: int,
+    repetition_rate: float = 0,
+    blend: str = "average",
+    first_name: int = 1,
+    memmap_dir: Optional[str] = None,
+    creation_options: Optional[List[str]] = None,
+) -> Optional[str]:
+    """Merge the tiles of split_image back into one GeoTIFF.
+
+    The geotransform and projection of the split raster are restored from
+    the tiles, and the output is written strip by strip.
+
+    Args:
+        tile_path (str): folder of the tiles, named 0001.tif, 0002.tif, ...
+        out_path (str): merged GeoTIFF file
+        height (int): height of the split raster
+        width (int): width of the split raster
+        crop_size (int): tile size of the split
+        repetition_rate (float): overlap rate of the split
+        blend (str): overlap blending, "average", "max" or "cosine"
+        first_name (int): name number of the first tile of the split
+        memmap_dir (str): optional folder of the temporary sum files, keeps
+            the memory bounded for rasters larger than the memory
+        creation_options (list): GTiff creation options of the output
+    """
+    from osgeo import gdal
+
+    tiles = find_tiles(tile_path, first_name)
+    if not tiles:
+        print(f"No tiles found in {tile_path}")
+        return None
+    first, tile_gt, proj = read_rasterArray(str(tiles[0][1]))
+    merger = TileMerger(
+        height,
+        width,
+        crop_size,
+        repetition_rate,
+        first.shape[0],
+        True,
+        blend,
+        memmap_dir,
+    )
+    # geotransform of the raster, moved back from the origin of a tile
+    row, col = divmod(tiles[0][0], merger.n_cols)
+    origin = np.array([[-row * merger.stride, -col * merger.stride]])
+    geotrans = tuple(tile_geotransforms(tile_gt, origin)[0])
+
+    with merger, tqdm(
+        total=len(tiles), desc="Merging", colour="green", leave=True, unit="img"
+    ) as pbar:
+        for n, file_name in tiles:
+            img, _, _ = read_rasterArray(str(file_name))
+            merger.add(n, img)
+            pbar.update(1)
+
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+        datatype = gdal_datatype(first.dtype)
+        driver = gdal.GetDriverByName("GTiff")
+        dataset = driver.Create(
+            str(out_path),
+            int(width),
+            int(height),
+            int(first.shape[0]),
+            datatype,
+            options=creation_options or [],
+        )
+        dataset.SetGeoTransform(geotrans)
+        dataset.SetProjection(proj)
+        for top, strip in merger.strips(first.dtype):
+            for i in range(strip.shape[0]):
+                dataset.GetRasterBand(i + 1).WriteArray(strip[i], 0, top)
+        del dataset
+    return out_path
@@ -0,0 +1,205 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from .merge import TileMerger
+from .tile import (
+    get_stride,
+    padded_size,
+    grid_shape,
+    tile_generator,
+    pad_image,
+    get_tile,
+)
+from .timing import timed
+
+
+def batched_tiles(
+    img: np.ndarray,
+    crop_size: int,
+    repetition_rate: float = 0,
+    batch_size: int = 16,
+    channel_first: bool = False,
+    pad_mode: str = "reflect",
+    pad_value=0,
+    virtual_padding: bool = False,
+    timer=None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate the tiles of an image in batches, on the split_image grid
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        crop_size: tile size
+        repetition_rate: overlap rate between neighbouring tiles
+        batch_size: tiles per batch, the last batch may be smaller
+        channel_first: bands are stored in the first dimension
+        pad_mode: padding mode, see tile.pad_image
+        pad_value: fill value of the "constant" padding mode
+        virtual_padding: do not pad the image, see tile.get_tile
+        timer: optional StageTimer, times the "tile" stage
+    Returns:
+        generator of (tile numbers, (B, ...tile shape) batch array)
+    """
+    stride = get_stride(crop_size, repetition_rate)
+    h_axis = 1 if channel_first and img.ndim == 3 else 0
+    H = padded_size(img.shape[h_axis], stride)
+    W = padded_size(img.shape[h_axis + 1], stride)
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    if virtual_padding:
+        source = img
+    else:
+        with timed(timer, "pad"):
+            source = pad_image(img, stride, channel_first, pad_mode, pad_value)
+    tile_shape = list(img.shape)
+    tile_shape[h_axis], tile_shape[h_axis + 1] = crop_size, crop_size
+
+    origins = list(tile_generator(n_rows, n_cols, stride))
+    for first in range(0, len(origins), batch_size):
+        numbers = np.arange(first, min(first + batch_size, len(origins)))
+        with timed(timer, "tile"):
+            # a new array per batch, the previous one may still be in use
+            batch = np.empty([len(numbers)] + tile_shape, dtype=img.dtype)
+            for i, n in enumerate(numbers):
+                h, w = origins[n]
+                batch[i] = get_tile(
+                    source, h, w, crop_size, channel_first, pad_mode, pad_value
+                )
+        yield numbers, batch
+
+
+def prefetch(items: Iterable, depth: int = 2) -> Iterator:
+    """
+    Produce the items on a background thread, at most depth items ahead of
+    the consumer, so reading and tiling the next batch overlaps with the
+    model running on the current one. Errors of the producer are raised in
+    the consumer.
+    Args:
+        items: iterable to produce
+        depth: max number of items waiting in the queue
+    """
+    done = object()
+    q = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                q.put(item)
+        except BaseException as e:
+            q.put(e)
+            return
+        q.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # the consumer stopped early, unblock the producer and let it end
+        stop.set()
+        while thread.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.01)
+
+
+def predict_image(
+    img: np.ndarray,
+    model: Callable[[np.ndarray], np.ndarray],
+    crop_size: int,
+    repetition_rate: float = 0,
+    batch_size: int = 16,
+    channel_first: bool = False,
+    blend: str = "cosine",
+    pad_mode: str = "reflect",
+    pad_value=0,
+    virtual_padding: bool = False,
+    prefetch_batches: int = 2,
+    dtype=None,
+    memmap_dir: Optional[str] = None,
+    timer=None,
+) -> np.ndarray:
+    """
+    Run a model over an image tile by tile (sliding window) and merge its
+    outputs back into one image. Tiles are fed to the model in batches,
+    the next batches are tiled on a background thread while the model runs.
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        model: callable taking a (B, ...tile shape) batch and returning the
+            (B, h, w), (B, h, w, C) or (B, C, h, w) if channel_first outputs,
+            with h = w = crop_size
+        crop_size: tile size
+        repetition_rate: overlap rate between neighbouring tiles
+        batch_size: tiles per model call
+        channel_first: bands are stored in the first dimension
+        blend: merging of the overlaps, "average", "max" or "cosine"
+        pad_mode: padding mode, see tile.pad_image
+        pad_value: fill value of the "constant" padding mode
+        virtual_padding: do not pad the image, see tile.get_tile
+        prefetch_batches: batches tiled ahead of the model
+        dtype: output data type, defaults to the model output data type
+        memmap_dir: optional folder of the merge sum files, see TileMerger
+        timer: optional StageTimer, times the pad, tile, model and merge
+            stages
+    Returns:
+        merged model output, with the height and width of img
+    """
+    h_axis = 1 if channel_first and img.ndim == 3 else 0
+    height, width = img.shape[h_axis], img.shape[h_axis + 1]
+    batches = batched_tiles(
+        img,
+        crop_size,
+        repetition_rate,
+        batch_size,
+        channel_first,
+        pad_mode,
+        pad_value,
+        virtual_padding,
+        timer,
+    )
+    merger = None
+    stride = get_stride(crop_size, repetition_rate)
+    n_tiles = np.prod(
+        grid_shape(
+            padded_size(height, stride), padded_size(width, stride), crop_size, stride
+        )
+    )
+    with tqdm(
+        total=int(n_tiles), desc="Predicting", colour="green", leave=True, unit="img"
+    ) as pbar:
+        for numbers, batch in prefetch(batches, prefetch_batches):
+            with timed(timer, "model"):
+                outputs = np.asarray(model(batch))
+            if merger is None:
+                bands = None
+                if outputs.ndim == 4:
+                    bands = outputs.shape[1] if channel_first else outputs.shape[3]
+                merger = TileMerger(
+                    height,
+                    width,
+                    crop_size,
+                    repetition_rate,
+                    bands,
+                    channel_first,
+                    blend,
+                    memmap_dir,
+                )
+                dtype = dtype or outputs.dtype
+            with timed(timer, "merge"):
+                for n, output in zip(numbers, outputs):
+                    merger.add(n, output)
+            pbar.update(len(numbers))
+    with merger:
+        return merger.result(dtype)
@@ -2,15 +2,35 @@
 # from osgeo import gdal
 from tqdm import tqdm
 import numpy as np
-from skimage.io import imread, imsave
 from pathlib import Path
-import random
-
-
-def read_image(file_name) -> np.ndarray:
+from functools import partial
+from .encoders import Encoder
+from .manifest import start_manifest
+from .merge import TileMerger, find_tiles
+from .pipeline import split_image as split_image_pipelined
+from .writer import TileWriter, first_tile_name
+from .timing import timed
+from .tile import (
+    get_stride,
+    padded_size,
+    grid_shape,
+    tile_generator,
+    pad_image,
+    get_tile,
+    sample_crop_origins,
+    stratified_crop_origins,
+    tile_origins,
+)
+
+
+def read_image(file_name, mmap=False) -> np.ndarray:
     """
     Read image from file_name
-    Args: file_name: image file name
+    Args:
+        file_name: image file name
+        mmap: memory-map .npy and uncompressed TIFF files instead of reading
+            them, only the pages of the tiles used are loaded; other files
+            (and compressed TIFF) are read as usual
     Returns: image array
     Note:
     The different color bands/channels are stored in the third dimension,
@@ -20,6 +40,15 @@ def read_image(file_name) -> np.ndarray:
         if not Path(file_name).is_file():
             print(file_name + "Can not open file!")
             return None
+        suffix = Path(file_name).suffix.lower()
+        if suffix == ".npy":
+            return np.load(file_name, mmap_mode="r" if mmap else None)
+        if mmap and suffix in [".tif", ".tiff"]:
+            img = memmap_tiff(file_name)
+            if img is not None:
+                return img
+        from skimage.io import imread  # imported on first use, it is slow
+
         img = imread(file_name)
         return img
     except Exception as e:
@@ -27,15 +56,54 @@ def read_image(file_name) -> np.ndarray:
         return None
 
 
-def save_image(img_arr, file_name) -> str:
+def memmap_tiff(file_name):
+    # tifffile can only map uncompressed, contiguous images; None otherwise
+    import tifffile
+
+    try:
+        return tifffile.memmap(file_name, mode="r")
+    except ValueError:
+        print(f"{file_name} can not be memory-mapped, reading it instead")
+        return None
+
+
+def encode_image(img_arr, ext) -> bytes:
+    """
+    Encode image to the bytes of an image file
+    Args:
+        img_arr: image array
+        ext: file format suffix, e.g. ".png"
+    Returns: encoded bytes, the same as skimage.io.imsave writes; .npy
+        (which imageio can not write) is encoded with np.save
+    """
+    if ext.lower() == ".npy":
+        return Encoder("npy").encode(img_arr)
+    import imageio.v3 as iio  # imported on first use, it is slow
+
+    if img_arr.dtype == bool:
+        img_arr = img_arr.astype(np.uint8) * 255
+    return iio.imwrite("<bytes>", img_arr, extension=ext)
+
+
+def save_image(img_arr, file_name, timer=None, encoder=None) -> str:
     """
     Save image to file_name
-    Args: img_arr: image array
+    Args:
+        img_arr: image array
+        timer: optional StageTimer, times the encode and write stages
+        encoder: optional encoders.Encoder, defaults to the format of the
+            file_name suffix with default settings
     Output: file_name: image file name
     """
     if Path(file_name).is_file():
         print(f"Overwrite existing file: {file_name}")
-    imsave(file_name, img_arr)
+    with timed(timer, "encode"):
+        if encoder is None:
+            data = encode_image(img_arr, Path(file_name).suffix)
+        else:
+            data = encoder.encode(img_arr)
+    with timed(timer, "write"):
+        Path(file_name).write_bytes(data)
     return file_name
 
 
@@ -52,37 +120,147 @@ def count_files(folder_path):
     return count
 
 
-def padding_image(img, stride) -> np.ndarray:
+def padding_image(img, stride, mode="reflect", constant_values=0) -> np.ndarray:
     """
     Padding image to the size of multiple of stride
     Args:
         img: image array
         stride: stride
+        mode: "reflect", "symmetric", "edge" or "constant"
+        constant_values: fill value of the "constant" mode
     Returns:
         padded image array
     """
-
-    if len(img.shape) == 2:
-        img = img[:, :, np.newaxis]
-    height = img.shape[0]
-    width = img.shape[1]
-    D = img.shape[2]  # this one is for (H, W, C) format
-    # get the minial padding image size
-    H = int(np.ceil(height / stride) * stride)
-    W = int(np.ceil(width / stride) * stride)
-
-    padded_img = np.zeros([H, W, D], dtype=img.dtype)
-    for d in range(D):  # padding every layer
-        onelayer = img[:, :, d]
-        padded_img[:, :, d] = np.pad(
-            onelayer, ((0, H - height), (0, W - width)), "reflect"
-        )
+    padded_img = pad_image(img, stride, mode=mode, constant_values=constant_values)
     padded_img = np.squeeze(padded_img)  # Remove axes of length one
     return padded_img
 
 
+def pad_source(
+    img, stride, virtual_padding=False, pad_mode="reflect", pad_value=0, timer=None
+):
+    """
+    Pad the image to split, unless it is virtually padded
+    Args:
+        img: image array
+        stride: stride
+        virtual_padding: do not pad, only the edge tiles are padded
+        pad_mode: padding mode, "reflect", "symmetric", "edge" or "constant"
+        pad_value: fill value of the "constant" padding mode
+        timer: optional StageTimer, times the pad stage
+    Returns:
+        padded image (img when not padded), padded height and width
+    """
+    # padding a mapped image would read all of it
+    if virtual_padding or isinstance(img, np.memmap):
+        H = padded_size(img.shape[0], stride)
+        W = padded_size(img.shape[1], stride)
+        print(f"Padding Image File Shape (H, W, D):{ (H, W) + img.shape[2:]}")
+        return img, H, W
+    with timed(timer, "pad"):
+        padded_img = padding_image(img, stride, pad_mode, pad_value)
+    print(f"Padding Image File Shape (H, W, D):{ padded_img.shape}")
+    return padded_img, padded_img.shape[0], padded_img.shape[1]
+
+
+class TileOutput:
+    """
+    Where split_image sends its tiles: a sink, the files of an incremental
+    split recorded in its manifest, or one file per tile.
+    Args:
+        save_path: output folder
+        ext: tile file suffix
+        sink: optional sink of all tiles
+        manifest: optional TileManifest of an incremental split
+        timer: optional StageTimer
+        encoder: optional encoders.Encoder, by default the format of ext
+    """
+
+    def __init__(
+        self, save_path, ext, sink=None, manifest=None, timer=None, encoder=None
+    ):
+        self.save_path = Path(save_path)
+        self.ext = ext
+        self.sink = sink
+        self.manifest = manifest
+        self.timer = timer
+        self.encoder = encoder
+        self.encode = partial(encode_image, ext=ext)
+        if encoder is not None:
+            self.encode = encoder.encode
+        self.kept = 0  # position of the tile in the sink, dropped tiles take none
+        self.skipped = 0  # unchanged tiles of an incremental split
+
+    def open(self, n_tiles, tile_shape, dtype) -> None:
+        if self.sink is not None:
+            self.sink.open(n_tiles, tile_shape, dtype)
+
+    def submit(self, writer, pbar, crop_img, h, w, new_name) -> None:
+        # queue the tile of origin (h, w) on the writer
+        crop_image_name = f"{new_name:04d}{self.ext}"
+        if self.sink is not None:
+            writer.submit(
+                self.sink.add, self.kept, crop_image_name, crop_img, (h, w), self.encode
+            )
+        elif self.manifest is not None:
+            self.submit_changed(writer, pbar, crop_img, h, w)
+        else:
+            crop_image_path = self.save_path / crop_image_name
+            writer.submit(
+                save_image, crop_img, crop_image_path, self.timer, self.encoder
+            )
+        self.kept += 1
+
+    def submit_changed(self, writer, pbar, crop_img, h, w) -> None:
+        # write the tile unless the manifest has it, unchanged; a grid cell
+        # keeps its name across incremental runs
+        tile_id = self.manifest.tile_id(h, w)
+        crop_image_path = self.save_path / f"{tile_id:04d}{self.ext}"
+        checksum = self.manifest.checksum(crop_img)
+        if self.manifest.is_done(h, w, checksum, crop_image_path):
+            self.skipped += 1
+            pbar.update(1)
+            return
+        writer.submit(
+            self.manifest.written,
+            h,
+            w,
+            tile_id,
+            checksum,
+            crop_image_path,
+            save_image,
+            crop_img,
+            crop_image_path,
+            self.timer,
+            self.encoder,
+        )
+
+    def close(self, n_tiles) -> None:
+        if self.sink is not None:
+            with timed(self.timer, "write"):
+                self.sink.close()
+        if self.manifest is not None:
+            self.manifest.finish(n_tiles)
+            print(f"{n_tiles - self.skipped} tiles written, {self.skipped} unchanged")
+
+
 def split_image(
-    img_path, save_path, crop_size, repetition_rate=0, overwrite=True
+    img_path,
+    save_path,
+    crop_size,
+    repetition_rate=0,
+    overwrite=True,
+    workers=1,
+    pad_mode="reflect",
+    pad_value=0,
+    virtual_padding=False,
+    timer=None,
+    encoder=None,
+    sink=None,
+    mmap=False,
+    incremental=False,
+    tile_filter=None,
+    pipeline=False,
 ) -> int:
     """
     Split image into tiles
@@ -92,68 +270,249 @@ def split_image(
         crop_size: crop size
         repetition_rate: repetition rate
         overwrite: overwrite existing files
+        workers: number of threads encoding and writing tiles
+        pad_mode: padding mode, "reflect", "symmetric", "edge" or "constant"
+        pad_value: fill value of the "constant" padding mode
+        virtual_padding: do not allocate the padded image, only the tiles
+            crossing the bottom or right edge are padded
+        timer: optional StageTimer, times the read, pad, slice, encode and
+            write stages
+        encoder: optional encoders.Encoder choosing the tile format and its
+            settings, e.g. Encoder("png", compress_level=1); by default the
+            tiles have the format of the input image
+        sink: optional sinks.TarShardSink or sinks.NpyStackSink packing all
+            tiles into a few large files instead of one file per tile
+        mmap: memory-map .npy and uncompressed TIFF inputs, a mapped image
+            is always virtually padded
+        incremental: record the written tiles in a manifest of save_path; a
+            rerun skips an unchanged image and only rewrites the tiles which
+            changed, tile names come from the manifest (overwrite is ignored)
+        tile_filter: optional filters.TileFilter, the dropped tiles are not
+            encoded nor written and their names are skipped; its report
+            counts the kept and dropped tiles
+        pipeline: run read, tile, encode and write as stages on their own
+            threads with bounded queues (see pipeline.split_image), workers
+            threads encode; prints the stage utilization instead of timer
     Returns:
-        number of tiles
+        number of tiles written
     """
+    if pipeline:
+        if sink is not None or incremental:
+            print("The pipeline writes one file per tile, not to a sink.")
+            return None
+        return split_image_pipelined(
+            img_path,
+            save_path,
+            crop_size,
+            repetition_rate,
+            overwrite,
+            encoder,
+            pad_mode,
+            pad_value,
+            mmap,
+            tile_filter,
+            encode_workers=workers,
+        )
+    # get image suffix
+    ext = Path(img_path).suffix if encoder is None else encoder.ext
+    manifest = None
+    if incremental:
+        params = dict(
+            crop_size=crop_size,
+            repetition_rate=repetition_rate,
+            pad_mode=pad_mode,
+            pad_value=pad_value,
+            encoder=repr(encoder),
+            ext=ext,
+            tile_filter=repr(tile_filter),
+        )
+        manifest, n_done = start_manifest(img_path, save_path, params, sink)
+        if manifest is None or n_done is not None:
+            return n_done
 
     # check input image
-    img = read_image(img_path)
+    with timed(timer, "read"):
+        img = read_image(img_path, mmap)
     if img is None:
         return None
-    # get image suffix
-    ext = Path(img_path).suffix
     # check output folder, if not exists, creat it.
     Path(save_path).mkdir(parents=True, exist_ok=True)
 
     print(f"Input Image File Shape (H, W, D):{ img.shape}")
 
-    stride = int(crop_size * (1 - repetition_rate))
+    stride = get_stride(crop_size, repetition_rate)
     print(f"crop_size = {crop_size}, stride = {stride}")
 
-    padded_img = padding_image(img, stride)
-    H = padded_img.shape[0]
-    W = padded_img.shape[1]
-    print(f"Padding Image File Shape (H, W, D):{ padded_img.shape}")
+    padded_img, H, W = pad_source(
+        img, stride, virtual_padding, pad_mode, pad_value, timer
+    )
+    new_name = first_tile_name([save_path], overwrite or incremental)
+
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    keep = np.ones(n_rows * n_cols, dtype=bool)
+    if tile_filter is not None:
+        with timed(timer, "filter"):
+            origins = tile_origins(n_rows, n_cols, stride)
+            keep = tile_filter.keep(img, origins, crop_size, stride)
+        print(f"Tile filter: {tile_filter.report}")
+    n_tiles = int(keep.sum())
+    output = TileOutput(save_path, ext, sink, manifest, timer, encoder)
+    tile_shape = (crop_size, crop_size) + padded_img.shape[2:]
+    output.open(n_tiles, tile_shape, padded_img.dtype)
 
-    if overwrite:
-        new_name = 1
-    else:
-        cnt = count_files(save_path)
-        new_name = cnt + 1
-        print(f"There are {cnt} files in the {save_path}")
-        print(f"New image name will start with {new_name}")
+    with tqdm(
+        total=n_tiles, desc="Generating", colour="green", leave=True, unit="img"
+    ) as pbar, TileWriter(workers, pbar) as writer:
+        for n, (h, w) in enumerate(tile_generator(n_rows, n_cols, stride)):
+            if keep[n]:
+                with timed(timer, "slice"):
+                    crop_img = get_tile(
+                        padded_img,
+                        h,
+                        w,
+                        crop_size,
+                        mode=pad_mode,
+                        constant_values=pad_value,
+                    )
+                output.submit(writer, pbar, crop_img, h, w, new_name)
+            new_name = new_name + 1
+    output.close(n_tiles)
+
+    return n_tiles
+
+
+def split_aligned_images(
+    img_paths,
+    save_paths,
+    crop_size,
+    repetition_rate=0,
+    overwrite=True,
+    workers=1,
+    pad_mode="reflect",
+    pad_value=0,
+    virtual_padding=False,
+    tile_filter=None,
+) -> int:
+    """
+    Split aligned images (e.g. an image and its ground truth) on one shared
+    tile grid, the tiles of the same grid cell get the same name in every
+    save path.
+    Args:
+        img_paths: list of image paths, all with the same height and width
+        save_paths: list of save paths, one per image
+        crop_size: crop size
+        repetition_rate: repetition rate
+        overwrite: overwrite existing files
+        workers: number of threads encoding and writing tiles
+        pad_mode: padding mode, "reflect", "symmetric", "edge" or "constant"
+        pad_value: fill value of the "constant" padding mode
+        virtual_padding: do not allocate the padded images
+        tile_filter: optional filters.TileFilter, nodata and variance are
+            measured on the first image, the label fraction on the last one
+    Returns:
+        number of tiles per image
+    Raises:
+        ValueError: if the images do not have the same height and width
+    """
+    if len(img_paths) != len(save_paths):
+        print("Every input image needs its own save path.")
+        return None
+    # check the images are aligned before writing anything
+    imgs = read_aligned_images(img_paths)
+    if imgs is None:
+        return None
+    for save_path in save_paths:
+        Path(save_path).mkdir(parents=True, exist_ok=True)
 
-    n_rows = int((H - crop_size) / stride + 1)
-    n_cols = int((W - crop_size) / stride + 1)
+    stride = get_stride(crop_size, repetition_rate)
+    print(f"crop_size = {crop_size}, stride = {stride}")
+    H = padded_size(imgs[0].shape[0], stride)
+    W = padded_size(imgs[0].shape[1], stride)
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    origins = tile_origins(n_rows, n_cols, stride)
+    keep = np.ones(n_rows * n_cols, dtype=bool)
+    if tile_filter is not None:
+        keep = tile_filter.keep(imgs[0], origins, crop_size, stride, label=imgs[-1])
+        print(f"Tile filter: {tile_filter.report}")
+    if not virtual_padding:
+        imgs = [padding_image(img, stride, pad_mode, pad_value) for img in imgs]
+    print(f"Padding Image File Shape (H, W):{ (H, W)}")
+
+    new_name = first_tile_name(save_paths, overwrite)
+    if new_name is None:
+        return None
 
-    def tile_generator():
-        for idh in range(n_rows):
-            h = idh * stride
-            for idw in range(n_cols):
-                w = idw * stride
-                yield h, w
+    outputs = [
+        (img, Path(save_path), Path(img_path).suffix)
+        for img, save_path, img_path in zip(imgs, save_paths, img_paths)
+    ]
+    write_aligned_tiles(
+        outputs, keep, origins, crop_size, new_name, workers, pad_mode, pad_value
+    )
+    return int(keep.sum())
 
-    with tqdm(
-        total=n_rows * n_cols, desc="Generating", colour="green", leave=True, unit="img"
-    ) as pbar:
-        if len(img.shape) == 2:
-            for n, (h, w) in enumerate(tile_generator()):
-                crop_img = padded_img[h : h + crop_size, w : w + crop_size]
-                crop_image_name = f"{new_name:04d}{ext}"
-                crop_image_path = Path(save_path) / crop_image_name
-                save_image(crop_img, crop_image_path)
-                new_name = new_name + 1
-                pbar.update(1)
-        else:
-            for n, (h, w) in enumerate(tile_generator()):
-                crop_img = padded_img[h : h + crop_size, w : w + crop_size, :]
-                crop_image_name = f"{new_name:04d}{ext}"
-                crop_image_path = Path(save_path) / crop_image_name
-                save_image(crop_img, crop_image_path)
-                new_name = new_name + 1
-                pbar.update(1)
 
-    return n + 1
+def read_aligned_images(img_paths):
+    """
+    Read images which must have the same height and width
+    Args:
+        img_paths: list of image paths
+    Returns:
+        list of image arrays, None if one is missing
+    Raises:
+        ValueError: if the images do not have the same height and width
+    """
+    imgs = [read_image(img_path) for img_path in img_paths]
+    if any(img is None for img in imgs):
+        return None
+    for img_path, img in zip(img_paths, imgs):
+        print(f"Input Image File Shape (H, W, D):{ img.shape} {img_path}")
+        if img.shape[:2] != imgs[0].shape[:2]:
+            raise ValueError(
+                f"Input images do not have the same height and width: "
+                f"{img_paths[0]} {imgs[0].shape[:2]}, {img_path} {img.shape[:2]}"
+            )
+    return imgs
+
+
+def write_aligned_tiles(
+    outputs,
+    keep,
+    origins,
+    crop_size,
+    new_name=1,
+    workers=1,
+    pad_mode="reflect",
+    pad_value=0,
+):
+    """
+    Write the kept grid cells of every output under the same name
+    Args:
+        outputs: list of (padded image, save path, file suffix)
+        keep: (N,) bool array of the kept grid cells
+        origins: (N, 2) array of the (h, w) grid origins
+        crop_size: crop size
+        new_name: number of the first grid cell
+        workers: number of threads encoding and writing tiles
+        pad_mode: padding mode of the edge tiles of unpadded images
+        pad_value: fill value of the "constant" padding mode
+    """
+    with tqdm(
+        total=int(keep.sum()) * len(outputs),
+        desc="Generating",
+        colour="green",
+        leave=True,
+        unit="img",
+    ) as pbar, TileWriter(workers, pbar) as writer:
+        for n, (h, w) in enumerate(origins):
+            if keep[n]:
+                for img, save_path, ext in outputs:
+                    crop_img = get_tile(
+                        img, h, w, crop_size, mode=pad_mode, constant_values=pad_value
+                    )
+                    crop_image_path = save_path / f"{new_name:04d}{ext}"
+                    writer.submit(save_image, crop_img, crop_image_path)
+            new_name = new_name + 1
 
 
 def random_crop_image(
@@ -166,6 +525,14 @@ def random_crop_image(
     img_ext=".jpg",
     label_ext=".png",
     overwrite=True,
+    workers=1,
+    timer=None,
+    mmap=False,
+    seed=None,
+    replace=True,
+    min_spacing=0,
+    class_proportions=None,
+    label_index=None,
 ) -> int:
     """Generate Random cropped image pair from the input image pairs.
 
@@ -174,12 +541,29 @@ def random_crop_image(
         img_save_path (str):
         crop_size (int): image tile size (H,W), i.e., 256x256
         overwrite (bool, optional): [overwrite existing files]. Defaults to True.
+        workers (int, optional): number of threads encoding and writing pairs.
+        timer (StageTimer, optional): times the read, slice, encode and write
+            stages.
+        mmap (bool, optional): memory-map .npy and uncompressed TIFF inputs,
+            only the pages of the crops are read.
+        seed (int, optional): seed of the crop sampler, the same seed gives
+            the same crops.
+        replace (bool, optional): allow the same crop more than once.
+        min_spacing (int, optional): min distance in rows or columns between
+            two crops, see tile.sample_crop_origins.
+        class_proportions (dict, optional): draw the crops with these shares
+            of the label classes, e.g. {0: 0.2, 1: 0.8}, or "balanced" for
+            the same share per class; replace and min_spacing do not apply.
+        label_index (LabelIndex, optional): prebuilt class index of the
+            label, built from the label when class_proportions is given.
     """
-    img = read_image(img_path)
+    with timed(timer, "read"):
+        img = read_image(img_path, mmap)
     if img is None:
         print("Input image is missing")
         return None
-    label = read_image(label_path)
+    with timed(timer, "read"):
+        label = read_image(label_path, mmap)
     if label is None:
         print("Label image is missing")
         return None
@@ -195,63 +579,108 @@ def random_crop_image(
         label_ext = Path(label_path).suffix
 
     # find the start name of the image paris.
-    if overwrite:
-        new_name = 1
-    else:
-        img_cnt = count_files(img_path)
-        label_cnt = count_files(label_path)
-        new_name = img_cnt + 1
-        print(f"There are {img_cnt} files in the {img_save_path}")
-        print(f"There are {label_cnt} files in the {label_save_path}")
-        if not img_cnt == label_cnt:
-            print("Image Pair doest not match in output folders.")
-            return None
-        print(f"New image pairs' name will start with {new_name}")
+    new_name = first_tile_name([img_save_path, label_save_path], overwrite)
+    if new_name is None:
+        return None
 
     crop_cnt = 0
     H = img.shape[0]
     W = img.shape[1]
+    # all crop origins are drawn at once
+    if class_proportions is not None:
+        origins = stratified_crop_origins(
+            label, crop_size, crop_number, class_proportions, seed, label_index
+        )
+    else:
+        origins = sample_crop_origins(
+            H, W, crop_size, crop_number, seed, replace, min_spacing
+        )
+
+    def save_pair(imgCrop, img_crop_path, labelCrop, label_crop_path):
+        save_image(imgCrop, img_crop_path, timer)
+        save_image(labelCrop, label_crop_path, timer)
 
     with tqdm(
-        total=crop_number, desc="Generating", colour="green", leave=True, unit="img"
-    ) as pbar:
-        while crop_cnt < crop_number:
+        total=len(origins), desc="Generating", colour="green", leave=True, unit="img"
+    ) as pbar, TileWriter(workers, pbar) as writer:
+        for UpperLeftX, UpperLeftY in origins:
             # Crop img_crop, label_crop paris and save them to the output folders.
-            UpperLeftX = random.randint(0, H - crop_size)
-            UpperLeftY = random.randint(0, W - crop_size)
-            if len(img.shape) == 2:
+            with timed(timer, "slice"):
                 imgCrop = img[
                     UpperLeftX : UpperLeftX + crop_size,
                     UpperLeftY : UpperLeftY + crop_size,
                 ]
-            else:
-                imgCrop = img[
-                    UpperLeftX : UpperLeftX + crop_size,
-                    UpperLeftY : UpperLeftY + crop_size,
-                    :,
-                ]
-            if len(label.shape) == 2:
-                labelCrop = label[
-                    UpperLeftX : UpperLeftX + crop_size,
-                    UpperLeftY : UpperLeftY + crop_size,
-                ]
-            else:
                 labelCrop = label[
                     UpperLeftX : UpperLeftX + crop_size,
                     UpperLeftY : UpperLeftY + crop_size,
-                    :,
                 ]
             # save image pairs
-            crop_image_name = f"{new_name:04d}{img_ext}"
-            crop_image_path = Path(img_save_path) / crop_image_name
-            save_image(imgCrop, crop_image_path)
-
-            crop_image_name = f"{new_name:04d}{label_ext}"
-            crop_image_path = Path(label_save_path) / crop_image_name
-            save_image(labelCrop, crop_image_path)
+            img_crop_path = Path(img_save_path) / f"{new_name:04d}{img_ext}"
+            label_crop_path = Path(label_save_path) / f"{new_name:04d}{label_ext}"
+            writer.submit(save_pair, imgCrop, img_crop_path, labelCrop, label_crop_path)
 
             new_name = new_name + 1  # update image name
             crop_cnt = crop_cnt + 1  # add crop count
-            pbar.update(1)
 
     return crop_cnt  # return total crop sample pair number.
+
+
+def merge_tiles(
+    tile_path,
+    out_path,
+    height,
+    width,
+    crop_size,
+    repetition_rate=0,
+    blend="average",
+    first_name=1,
+    memmap_dir=None,
+) -> np.ndarray:
+    """
+    Merge the tiles of split_image back into one image
+    Args:
+        tile_path: folder of the tiles, named 0001.png, 0002.png, ...
+        out_path: merged image file, a .npy file is written strip by strip
+            so the image may be larger than the memory
+        height: height of the split image
+        width: width of the split image
+        crop_size: crop size of the split
+        repetition_rate: repetition rate of the split
+        blend: overlap blending, "average", "max" or "cosine"
+        first_name: name number of the first tile of the split
+        memmap_dir: optional folder of the temporary sum files, see
+            merge.TileMerger
+    Returns:
+        merged image array
+    """
+    tiles = find_tiles(tile_path, first_name)
+    if not tiles:
+        print(f"No tiles found in {tile_path}")
+        return None
+    first = read_image(tiles[0][1])
+    bands = None if first.ndim == 2 else first.shape[2]
+    with TileMerger(
+        height,
+        width,
+        crop_size,
+        repetition_rate,
+        bands,
+        blend=blend,
+        memmap_dir=memmap_dir,
+    ) as merger, tqdm(
+        total=len(tiles), desc="Merging", colour="green", leave=True, unit="img"
+    ) as pbar:
+        for n, file_name in tiles:
+            merger.add(n, read_image(file_name))
+            pbar.update(1)
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+        if Path(out_path).suffix == ".npy":
+            out = np.lib.format.open_memmap(
+                out_path, mode="w+", dtype=first.dtype, shape=merger.sums.shape
+            )
+            merged = merger.result(out=out)
+            merged.flush()
+        else:
+            merged = merger.result(first.dtype)
+            save_image(merged, out_path)
+    return merged
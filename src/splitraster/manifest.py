@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+import zlib
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+MANIFEST_FILE = ".splitraster_manifest.jsonl"
+
+
+def scene_signature(img_path: str) -> dict:
+    # size and modification time, a changed scene is split again on resume
+    stat = os.stat(img_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def tile_checksum(tile: np.ndarray, value: int = 0) -> int:
+    # crc32 of the tile pixels, computed before encoding
+    return zlib.crc32(np.ascontiguousarray(tile).data, value)
+
+
+class TileManifest:
+    """
+    Record the tiles written to one output folder, so an incremental split
+    skips the tiles already written instead of counting the files of the
+    folder. The manifest is a JSON lines file in the output folder, one line
+    per written tile (source, grid position, name, checksum) and one line per
+    completed scene (source, size and mtime, split parameters). Splitting a
+    scene again with other parameters deletes its previous tiles, splitting a
+    changed scene deletes the tiles of the grid cells it no longer has. Lines
+    are appended as the tiles are written, a crashed run keeps its progress.
+    Args:
+        save_path: output folder
+    """
+
+    def __init__(self, save_path: str):
+        self.path = Path(save_path) / MANIFEST_FILE
+        self.scenes = {}  # source -> scene record
+        self.tiles = {}  # (source, h, w) -> tile record
+        self.last_id = 0
+        self.lines = 0
+        self.source = None
+        self._file = None
+        self._lock = threading.Lock()
+        if self.path.is_file():
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut by a crash
+                self.lines += 1
+                self._apply(record)
+
+    def _apply(self, record: dict) -> None:
+        if record["type"] == "scene":
+            self.scenes[record["source"]] = record
+        else:
+            self.tiles[(record["source"], record["h"], record["w"])] = record
+            self.last_id = max(self.last_id, record["id"])
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a+")
+                if self._file.tell() > 0:
+                    self._file.seek(self._file.tell() - 1)
+                    if self._file.read(1) != "\n":
+                        self._file.write("\n")  # end a line cut by a crash
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            self.lines += 1
+            self._apply(record)
+
+    def start(self, img_path: str, params: dict) -> Optional[int]:
+        """
+        Start splitting img_path with the split parameters params
+        Returns: the number of tiles if the scene is already split with the
+            same parameters and has not changed since, None otherwise
+        """
+        self.source = str(Path(img_path).resolve())
+        self.signature = scene_signature(img_path)
+        self.params = params
+        self.cells = set()  # grid cells of this split
+        # the split parameters seed the tile checksums, e.g. a new encoder
+        # setting rewrites every tile
+        self.seed = zlib.crc32(json.dumps(params, sort_keys=True).encode())
+        stale = [
+            key
+            for key, record in self.tiles.items()
+            if key[0] == self.source and record.get("seed") != self.seed
+        ]
+        if stale:
+            self._reset(stale)
+        scene = self.scenes.get(self.source)
+        if (
+            scene is not None
+            and scene["signature"] == self.signature
+            and scene["params"] == params
+        ):
+            return scene["tiles"]
+        return None
+
+    def _reset(self, stale: list) -> None:
+        # the scene was split with other parameters (another grid, format,
+        # ...): delete its tiles and records, the new tiles are numbered
+        # after the tiles of the other scenes
+        self._drop(stale)
+        self.scenes.pop(self.source, None)
+        self.last_id = max((r["id"] for r in self.tiles.values()), default=0)
+        self._compact()
+
+    def _drop(self, keys: list) -> None:
+        # delete the tiles and records of keys
+        for key in keys:
+            record = self.tiles.pop(key)
+            if "name" in record:
+                try:
+                    (self.path.parent / record["name"]).unlink()
+                except FileNotFoundError:
+                    pass
+
+    def tile_id(self, h: int, w: int) -> int:
+        # a grid cell keeps its tile name, new cells are numbered after the
+        # last tile of the folder
+        self.cells.add((self.source, int(h), int(w)))
+        record = self.tiles.get((self.source, int(h), int(w)))
+        if record is not None:
+            return record["id"]
+        self.last_id += 1
+        return self.last_id
+
+    def checksum(self, tile: np.ndarray) -> int:
+        return tile_checksum(tile, self.seed)
+
+    def is_done(self, h: int, w: int, checksum: int, file_path) -> bool:
+        record = self.tiles.get((self.source, int(h), int(w)))
+        if record is None or record["crc32"] != checksum:
+            return False
+        return Path(file_path).is_file()
+
+    def written(
+        self, h: int, w: int, tile_id: int, checksum: int, file_path, fn, *args
+    ):
+        # run the save call fn(*args) writing file_path, then record the tile
+        fn(*args)
+        record = {"type": "tile", "source": self.source, "h": int(h), "w": int(w)}
+        record.update(id=tile_id, name=Path(file_path).name, crc32=checksum)
+        self._append({**record, "seed": self.seed})
+
+    def finish(self, n_tiles: int) -> None:
+        # the cells the scene no longer has, e.g. it shrank, or the tile
+        # filter drops them now
+        outside = [
+            key for key in self.tiles if key[0] == self.source and key not in self.cells
+        ]
+        if outside:
+            print(f"{len(outside)} tiles outside the grid deleted")
+            self._drop(outside)
+        self._append(
+            {
+                "type": "scene",
+                "source": self.source,
+                "signature": self.signature,
+                "params": self.params,
+                "tiles": n_tiles,
+            }
+        )
+        self.close()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.lines > len(self.scenes) + len(self.tiles):
+            self._compact()
+
+    def _compact(self) -> None:
+        # drop the lines replaced by later ones, write to a temporary file first
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            for record in list(self.tiles.values()) + list(self.scenes.values()):
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
+        self.lines = len(self.scenes) + len(self.tiles)
+
+
+def start_manifest(img_path: str, save_path: str, params: dict, sink=None):
+    """
+    Open the manifest of save_path for an incremental split of img_path
+    Returns:
+        (manifest, n_tiles): n_tiles is the number of tiles when the scene is
+        already split with params, None otherwise; manifest is None when the
+        split can not run incrementally
+    """
+    if sink is not None:
+        print("Incremental mode writes one file per tile, not to a sink.")
+        return None, None
+    if not Path(img_path).is_file():
+        print(f"{img_path} Can not open file!")
+        return None, None
+    manifest = TileManifest(save_path)
+    n_done = manifest.start(img_path, params)
+    if n_done is not None:
+        print(f"{img_path} is already split into {n_done} tiles")
+    return manifest, n_done
@@ -0,0 +1,239 @@
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from .tile import get_stride, grid_shape, padded_size
+
+BLENDS = ["average", "max", "cosine"]
+
+
+def cosine_window(crop_size: int) -> np.ndarray:
+    """
+    Weight of every tile pixel for the "cosine" blend, a squared sine which
+    is largest at the tile centre and close to 0 on its edges
+    Args:
+        crop_size: tile size
+    Returns:
+        (crop_size, crop_size) weight array
+    """
+    ramp = np.sin(np.pi * (np.arange(crop_size) + 0.5) / crop_size) ** 2
+    return np.outer(ramp, ramp).astype(np.float32)
+
+
+class TileMerger:
+    """
+    Merge the tiles of a split back into the image, the inverse of the
+    split grid (stride, padding, overlap). Tiles are added one at a time, in
+    any order, the overlaps are blended and the padding is cropped away.
+    With memmap_dir the sums are kept in files there, so the merged image may
+    be larger than the memory.
+    Args:
+        height: height of the split image, before padding
+        width: width of the split image, before padding
+        crop_size: tile size
+        repetition_rate: overlap rate of the split
+        bands: number of bands, None for single band (H, W) tiles
+        channel_first: tiles are (C, H, W) as in geo, else (H, W, C)
+        blend: "average", "max" or "cosine" (weighted average, the tile
+            centres count more than their edges)
+        memmap_dir: optional folder of the sum files
+    """
+
+    def __init__(
+        self,
+        height: int,
+        width: int,
+        crop_size: int,
+        repetition_rate: float = 0,
+        bands: Optional[int] = None,
+        channel_first: bool = False,
+        blend: str = "average",
+        memmap_dir: Optional[str] = None,
+    ):
+        if blend not in BLENDS:
+            raise ValueError(f"Unsupported blend: {blend}, use one of {BLENDS}")
+        self.height, self.width = height, width
+        self.crop_size = crop_size
+        self.stride = get_stride(crop_size, repetition_rate)
+        H = padded_size(height, self.stride)
+        W = padded_size(width, self.stride)
+        self.n_rows, self.n_cols = grid_shape(H, W, crop_size, self.stride)
+        self.channel_first = channel_first
+        self.blend = blend
+
+        if bands is None:
+            shape = (height, width)
+        elif channel_first:
+            shape = (bands, height, width)
+        else:
+            shape = (height, width, bands)
+        self.h_axis = 1 if channel_first and bands is not None else 0
+        self._tmp = None
+        if memmap_dir is not None:
+            Path(memmap_dir).mkdir(parents=True, exist_ok=True)
+            self._tmp = tempfile.TemporaryDirectory(dir=memmap_dir)
+        fill = -np.inf if blend == "max" else 0
+        self.sums = self._zeros("sums", shape, fill)
+        self.weights = self._zeros("weights", (height, width), 0)
+        if blend == "cosine":
+            self.window = cosine_window(crop_size)
+        else:
+            self.window = np.ones((crop_size, crop_size), dtype=np.float32)
+
+    def _zeros(self, name: str, shape: Tuple[int, ...], fill) -> np.ndarray:
+        if self._tmp is None:
+            return np.full(shape, fill, dtype=np.float32)
+        arr = np.lib.format.open_memmap(
+            Path(self._tmp.name) / f"{name}.npy",
+            mode="w+",
+            dtype=np.float32,
+            shape=shape,
+        )
+        if fill != 0:
+            arr[...] = fill
+        return arr
+
+    def _region(self, rows: slice, cols: slice) -> tuple:
+        index = [slice(None)] * self.sums.ndim
+        index[self.h_axis], index[self.h_axis + 1] = rows, cols
+        return tuple(index)
+
+    def _expand(self, weights: np.ndarray) -> np.ndarray:
+        # broadcast (h, w) weights over the bands of the tile layout
+        if self.sums.ndim == 2:
+            return weights
+        return weights[np.newaxis] if self.h_axis == 1 else weights[..., np.newaxis]
+
+    def add(self, n: int, tile: np.ndarray) -> None:
+        """
+        Add tile n of the split, numbered row by row from 0 (tile name
+        "0001" is n = 0)
+        """
+        row, col = divmod(n, self.n_cols)
+        h, w = row * self.stride, col * self.stride
+        # the part of the tile in the padding is dropped
+        th = min(self.crop_size, self.height - h)
+        tw = min(self.crop_size, self.width - w)
+        rows, cols = slice(h, h + th), slice(w, w + tw)
+        part = tile[self._region(slice(0, th), slice(0, tw))].astype(np.float32)
+        sums = self.sums[self._region(rows, cols)]
+        if self.blend == "max":
+            np.maximum(sums, part, out=sums)
+            self.weights[rows, cols] += 1
+        else:
+            window = self.window[:th, :tw]
+            sums += part * self._expand(window)
+            self.weights[rows, cols] += window
+
+    def strips(
+        self, dtype=None, chunk_rows: int = 1024
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Generate the merged image strip by strip, memory stays bounded by
+        chunk_rows rows. Pixels no tile covers are 0.
+        Args:
+            dtype: output data type, integers are rounded; float32 if None
+            chunk_rows: rows per strip
+        Returns:
+            generator of (first row, strip)
+        """
+        dtype = np.dtype(dtype or np.float32)
+        for top in range(0, self.height, chunk_rows):
+            rows = slice(top, top + chunk_rows)
+            sums = np.array(self.sums[self._region(rows, slice(None))])
+            weights = self._expand(np.array(self.weights[rows]))
+            covered = np.broadcast_to(weights > 0, sums.shape)
+            if self.blend == "max":
+                strip = np.where(covered, sums, 0)
+            else:
+                strip = np.divide(sums, weights, out=np.zeros_like(sums), where=covered)
+            if np.issubdtype(dtype, np.integer):
+                info = np.iinfo(dtype)
+                strip = np.clip(np.rint(strip), info.min, info.max)
+            yield top, strip.astype(dtype)
+
+    def result(self, dtype=None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Get the merged image
+        Args:
+            dtype: output data type, see strips
+            out: optional array to write into, e.g. a np.memmap
+        Returns:
+            merged image, (H, W), (H, W, C) or (C, H, W) if channel_first
+        """
+        if out is None:
+            out = np.empty(self.sums.shape, dtype=dtype or np.float32)
+        for top, strip in self.strips(out.dtype):
+            rows = slice(top, top + strip.shape[self.h_axis])
+            out[self._region(rows, slice(None))] = strip
+        return out
+
+    def close(self) -> None:
+        # remove the sum files of memmap_dir
+        if self._tmp is not None:
+            self.sums = self.weights = None
+            self._tmp.cleanup()
+            self._tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def merge_tiles(
+    tiles: Iterable[Tuple[int, np.ndarray]],
+    height: int,
+    width: int,
+    crop_size: int,
+    repetition_rate: float = 0,
+    channel_first: bool = False,
+    blend: str = "average",
+    dtype=None,
+) -> np.ndarray:
+    """
+    Merge tiles back into the image, in memory
+    Args:
+        tiles: iterable of (n, tile), n is the tile number on the split grid
+            counted from 0, e.g. from enumerate(tile arrays)
+        height: height of the split image, before padding
+        width: width of the split image, before padding
+        crop_size: tile size
+        repetition_rate: overlap rate of the split
+        channel_first: tiles are (C, H, W)
+        blend: "average", "max" or "cosine"
+        dtype: output data type, defaults to the tile data type
+    Returns:
+        merged image
+    """
+    merger = None
+    for n, tile in tiles:
+        if merger is None:
+            bands = None if tile.ndim == 2 else tile.shape[0 if channel_first else 2]
+            merger = TileMerger(
+                height,
+                width,
+                crop_size,
+                repetition_rate,
+                bands,
+                channel_first,
+                blend,
+            )
+            dtype = dtype or tile.dtype
+        merger.add(n, tile)
+    if merger is None:
+        raise ValueError("No tiles to merge")
+    return merger.result(dtype)
+
+
+def find_tiles(tile_path: str, first_name: int = 1) -> list:
+    # (n, file) of the tiles in tile_path, named like "0001.png" by split_image
+    tiles = []
+    for path in sorted(Path(tile_path).iterdir()):
+        if path.is_file() and path.stem.isdigit():
+            tiles.append((int(path.stem) - first_name, path))
+    return tiles
@@ -0,0 +1,366 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from .tile import get_stride, padded_size, grid_shape, take_padded, tile_origins
+from .writer import first_tile_name
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    # another stage failed, the pipeline is shutting down
+    pass
+
+
+class Stage:
+    """
+    One stage of a Pipeline: workers threads take items from the queue of
+    the stage, run fn on them and pass its outputs to the next queue.
+    The time of every worker is split into busy (in fn), starved (waiting
+    for an input) and blocked (waiting for room in the next queue).
+    Args:
+        name: stage name, used in the report
+        fn: callable taking one item and returning an iterable of outputs,
+            e.g. a generator; none to drop the item, several to fan out
+        workers: number of threads
+    """
+
+    def __init__(self, name: str, fn: Callable[[object], Iterable], workers: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(int(workers), 1)
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, busy: float, starved: float, blocked: float) -> None:
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+
+class Pipeline:
+    """
+    Run items through a chain of stages, each on its own threads, connected
+    by bounded queues. A full queue blocks the stage before it (backpressure),
+    so memory stays bounded and a slow stage, e.g. the disk, does not stall
+    the others until the queue between them is full. The stage metrics show
+    which stage limits the throughput: its utilization is close to 100%
+    while the others are starved or blocked.
+    Args:
+        queue_size: max number of items waiting between two stages
+    """
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self.stages: List[Stage] = []
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, name: str, fn: Callable[[object], Iterable], workers: int = 1):
+        self.stages.append(Stage(name, fn, workers))
+        return self
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped
+            try:
+                return q.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while True:
+            if self._stop.is_set():
+                raise _Stopped
+            try:
+                return q.put(item, timeout=0.05)
+            except queue.Full:
+                pass
+
+    def _work(self, stage: Stage, inbox, outbox, live: list, on_output) -> None:
+        busy = starved = blocked = 0.0
+        items = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._get(inbox)
+                starved += time.perf_counter() - start
+                if item is _DONE:
+                    inbox.put(_DONE)  # for the other workers of the stage
+                    break
+                items += 1
+                outputs = iter(stage.fn(item))
+                while True:
+                    start = time.perf_counter()
+                    output = next(outputs, _DONE)
+                    busy += time.perf_counter() - start
+                    if output is _DONE:
+                        break
+                    if outbox is None:
+                        on_output(output)
+                        continue
+                    start = time.perf_counter()
+                    self._put(outbox, output)
+                    blocked += time.perf_counter() - start
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._error = self._error or e
+            self._stop.set()
+        finally:
+            stage.add(items, busy, starved, blocked)
+            with stage._lock:
+                live[0] -= 1
+                last = live[0] == 0
+            # the last worker of a stage ends the next one
+            if last and outbox is not None and not self._stop.is_set():
+                try:
+                    self._put(outbox, _DONE)
+                except _Stopped:
+                    pass
+
+    def run(self, items: Iterable, on_output: Optional[Callable] = None) -> int:
+        """
+        Feed items to the first stage and wait until all stages are done
+        Args:
+            items: inputs of the first stage
+            on_output: optional callable getting every output of the last
+                stage, on its threads
+        Returns:
+            number of outputs of the last stage
+        """
+        if not self.stages:
+            raise ValueError("The pipeline has no stages")
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        count = [0]
+        count_lock = threading.Lock()
+
+        def output(item):
+            with count_lock:
+                count[0] += 1
+            if on_output is not None:
+                on_output(item)
+
+        start = time.perf_counter()
+        threads = self._start(queues, output)
+        try:
+            self._feed(items, queues[0])
+        finally:
+            for thread in threads:
+                thread.join()
+            self.seconds = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+        return count[0]
+
+    def _start(self, queues: List[queue.Queue], on_output: Callable) -> list:
+        # start one thread per worker of every stage
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            live = [stage.workers]
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], outbox, live, on_output),
+                    daemon=True,
+                )
+                threads.append(thread)
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _feed(self, items: Iterable, inbox: queue.Queue) -> None:
+        try:
+            for item in items:
+                self._put(inbox, item)
+            self._put(inbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException:
+            self._stop.set()
+            raise
+
+    @property
+    def metrics(self) -> dict:
+        # per stage: items, busy/starved/blocked seconds summed over the
+        # workers, and utilization, the busy share of the worker time
+        wall = self.seconds or 1.0
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "items": stage.items,
+                "busy": stage.busy,
+                "starved": stage.starved,
+                "blocked": stage.blocked,
+                "utilization": stage.busy / (wall * stage.workers),
+            }
+            for stage in self.stages
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{'stage':<10}{'workers':>8}{'items':>8}{'busy':>10}"
+            f"{'starved':>10}{'blocked':>10}{'util':>8}"
+        ]
+        for name, m in self.metrics.items():
+            lines.append(
+                f"{name:<10}{m['workers']:>8}{m['items']:>8}{m['busy']:>10.3f}"
+                f"{m['starved']:>10.3f}{m['blocked']:>10.3f}{m['utilization']:>8.1%}"
+            )
+        lines.append(f"total {self.seconds:.3f}s")
+        return "\n".join(lines)
+
+
+def strip_tiles(
+    strip: np.ndarray,
+    cells: range,
+    keep: np.ndarray,
+    n_cols: int,
+    stride: int,
+    crop_size: int,
+    width: int,
+    pad_mode: str = "reflect",
+    pad_value=0,
+):
+    # (n, tile) of the kept grid cells n of a strip padded in height, whose
+    # first row is the one of the first cell; tiles crossing the right edge
+    # are padded
+    top = cells[0] // n_cols * stride
+    for n in cells:
+        if not keep[n]:
+            continue
+        h = n // n_cols * stride - top
+        w = n % n_cols * stride
+        rows = strip[h : h + crop_size]
+        if w + crop_size <= width:
+            yield n, rows[:, w : w + crop_size]
+        else:
+            yield n, take_padded(rows, 1, w, w + crop_size, pad_mode, pad_value)
+
+
+def split_image(
+    img_path,
+    save_path,
+    crop_size,
+    repetition_rate=0,
+    overwrite=True,
+    encoder=None,
+    pad_mode="reflect",
+    pad_value=0,
+    mmap=False,
+    tile_filter=None,
+    strip_rows=1,
+    encode_workers=2,
+    write_workers=1,
+    queue_size=16,
+) -> Optional[int]:
+    """
+    Split image into tiles with a staged pipeline: read (strips of tile rows,
+    padded), tile, encode and write run on their own threads, connected by
+    bounded queues, so reading, encoding and writing overlap. Tiles and
+    names are the same as io.split_image gives; the stage utilization is
+    printed at the end.
+    Args:
+        img_path: image path
+        save_path: save path
+        crop_size: crop size
+        repetition_rate: repetition rate
+        overwrite: overwrite existing files
+        encoder: optional encoders.Encoder, by default the tiles have the
+            format of the input image
+        pad_mode: padding mode, "reflect", "symmetric", "edge" or "constant"
+        pad_value: fill value of the "constant" padding mode
+        mmap: memory-map .npy and uncompressed TIFF inputs, the read stage
+            then reads the image strip by strip
+        tile_filter: optional filters.TileFilter, the dropped tiles are not
+            encoded nor written and their names are skipped
+        strip_rows: number of tile rows read at once
+        encode_workers: number of encoding threads
+        write_workers: number of writing threads
+        queue_size: max number of items waiting between two stages
+    Returns:
+        number of tiles written
+    """
+    from .io import encode_image, read_image
+
+    ext = Path(img_path).suffix if encoder is None else encoder.ext
+    img = read_image(img_path, mmap)
+    if img is None:
+        return None
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    print(f"Input Image File Shape (H, W, D):{ img.shape}")
+
+    stride = get_stride(crop_size, repetition_rate)
+    print(f"crop_size = {crop_size}, stride = {stride}")
+    height, width = img.shape[:2]
+    H, W = padded_size(height, stride), padded_size(width, stride)
+    print(f"Padding Image File Shape (H, W, D):{ (H, W) + img.shape[2:]}")
+
+    new_name = first_tile_name([save_path], overwrite)
+
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    keep = np.ones(n_rows * n_cols, dtype=bool)
+    if tile_filter is not None:
+        origins = tile_origins(n_rows, n_cols, stride)
+        keep = tile_filter.keep(img, origins, crop_size, stride)
+        print(f"Tile filter: {tile_filter.report}")
+    n_tiles = int(keep.sum())
+    encode = encoder.encode if encoder is not None else None
+
+    def read(first_row):
+        # the padded rows of the tile rows [first_row, first_row + strip_rows)
+        last_row = min(first_row + strip_rows, n_rows)
+        top = first_row * stride
+        bottom = (last_row - 1) * stride + crop_size
+        strip = take_padded(img, 0, top, bottom, pad_mode, pad_value)
+        yield first_row, last_row, np.ascontiguousarray(strip)
+
+    def tile(item):
+        first_row, last_row, strip = item
+        rows = range(first_row * n_cols, last_row * n_cols)
+        for n, crop_img in strip_tiles(
+            strip, rows, keep, n_cols, stride, crop_size, width, pad_mode, pad_value
+        ):
+            yield f"{new_name + n:04d}{ext}", crop_img
+
+    def encode_tile(item):
+        name, crop_img = item
+        if encode is None:
+            yield name, encode_image(crop_img, ext)
+        else:
+            yield name, encode(crop_img)
+
+    def write(item):
+        name, data = item
+        (Path(save_path) / name).write_bytes(data)
+        yield name
+
+    pipeline = (
+        Pipeline(queue_size)
+        .stage("read", read)
+        .stage("tile", tile)
+        .stage("encode", encode_tile, encode_workers)
+        .stage("write", write, write_workers)
+    )
+    with tqdm(
+        total=n_tiles, desc="Generating", colour="green", leave=True, unit="img"
+    ) as pbar:
+        pipeline.run(
+            range(0, n_rows, strip_rows), on_output=lambda name: pbar.update(1)
+        )
+    print(pipeline.report())
+    return n_tiles
@@ -0,0 +1,203 @@
+import csv
+import io
+import os
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+
+class TarShardSink:
+    """
+    Pack encoded tiles into tar shards of bounded size (WebDataset style),
+    so the output is a few large sequential files instead of one file per
+    tile. A shard is closed once it holds shard_size bytes or max_tiles
+    tiles, shards are named {prefix}-000000.tar, {prefix}-000001.tar, ...
+    An index.csv lists the shard of every tile.
+    Args:
+        save_path: folder of the shards
+        shard_size: max bytes per shard
+        max_tiles: optional max number of tiles per shard
+        prefix: shard file name prefix
+    """
+
+    needs_encoding = True
+
+    def __init__(
+        self,
+        save_path: str,
+        shard_size: int = 1 << 30,
+        max_tiles: Optional[int] = None,
+        prefix: str = "shard",
+    ):
+        self.save_path = Path(save_path)
+        self.shard_size = shard_size
+        self.max_tiles = max_tiles
+        self.prefix = prefix
+        self.shard_id = -1
+        self.tar = None
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def open(self, n_tiles: int, tile_shape: Tuple[int, ...], dtype) -> None:
+        self.save_path.mkdir(parents=True, exist_ok=True)
+
+    def _next_shard(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+        self.shard_id += 1
+        self.shard_name = f"{self.prefix}-{self.shard_id:06d}.tar"
+        self.tar = tarfile.open(self.save_path / self.shard_name, "w")
+        self.shard_bytes, self.shard_tiles = 0, 0
+
+    def add(
+        self,
+        index: int,
+        name: str,
+        crop_img: np.ndarray,
+        origin: Tuple[int, int],
+        encode: Optional[Callable[[np.ndarray], bytes]] = None,
+    ) -> None:
+        if encode is None:
+            raise ValueError("TarShardSink needs an encoder for the tiles")
+        data = encode(crop_img)  # outside the lock, encoders run in parallel
+        self.add_bytes(index, name, data, origin)
+
+    def add_bytes(
+        self, index: int, name: str, data: bytes, origin: Tuple[int, int]
+    ) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self._lock:
+            full = self.tar is None or self.shard_bytes + len(data) > self.shard_size
+            if self.max_tiles is not None and self.tar is not None:
+                full = full or self.shard_tiles >= self.max_tiles
+            if full and (self.tar is None or self.shard_tiles > 0):
+                self._next_shard()
+            self.tar.addfile(info, io.BytesIO(data))
+            self.shard_bytes += len(data)
+            self.shard_tiles += 1
+            self.rows.append((index, name, self.shard_name, *origin))
+
+    def close(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        write_index(self.save_path / "index.csv", ["shard"], self.rows)
+
+
+class NpyStackSink:
+    """
+    Write all tiles into one memory-mapped (N, ...tile shape) .npy stack,
+    training readers can np.load(..., mmap_mode="r") it. An index.csv gives
+    the name and the (h, w) origin of every tile in the stack. Tiles dropped
+    by a filter take no entry.
+    Args:
+        save_path: folder of the stack
+        name: file name of the stack, without suffix
+    """
+
+    needs_encoding = False
+
+    def __init__(self, save_path: str, name: str = "tiles"):
+        self.save_path = Path(save_path)
+        self.name = name
+        self.stack = None
+        self.rows = []
+
+    def open(self, n_tiles: int, tile_shape: Tuple[int, ...], dtype) -> None:
+        self.save_path.mkdir(parents=True, exist_ok=True)
+        self.stack = np.lib.format.open_memmap(
+            self.save_path / f"{self.name}.npy",
+            mode="w+",
+            dtype=dtype,
+            shape=(n_tiles,) + tuple(tile_shape),
+        )
+        self.rows = [None] * n_tiles
+
+    def add(
+        self,
+        index: int,
+        name: str,
+        crop_img: np.ndarray,
+        origin: Tuple[int, int],
+        encode: Optional[Callable[[np.ndarray], bytes]] = None,
+    ) -> None:
+        self.stack[index] = crop_img
+        self.rows[index] = (index, name, *origin)
+
+    def close(self) -> None:
+        if self.stack is None:
+            return
+        rows = [row for row in self.rows if row is not None]
+        if len(rows) < len(self.stack):
+            # fewer tiles than opened for, e.g. filtered while streaming;
+            # the tiles fill the first entries, drop the rest
+            self._truncate(len(rows))
+        else:
+            self.stack.flush()
+        self.stack = None
+        write_index(self.save_path / f"{self.name}_index.csv", [], rows)
+
+    def _truncate(self, n_tiles: int) -> None:
+        path = self.save_path / f"{self.name}.npy"
+        tmp_path = self.save_path / f"{self.name}.tmp.npy"
+        stack = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=self.stack.dtype,
+            shape=(n_tiles,) + self.stack.shape[1:],
+        )
+        for i in range(0, n_tiles, 256):
+            stack[i : i + 256] = self.stack[i : min(i + 256, n_tiles)]
+        stack.flush()
+        # release both mappings before replacing the file
+        del stack
+        self.stack = None
+        os.replace(tmp_path, path)
+
+
+class CallbackSink:
+    """
+    Hand every encoded tile to a callable instead of writing it to disk, e.g.
+    to upload the tiles to an object store. The callable runs on the writer
+    threads, once per tile.
+    Args:
+        fn: callable taking the tile name, its encoded bytes and its (h, w)
+            origin
+    """
+
+    needs_encoding = True
+
+    def __init__(self, fn: Callable[[str, bytes, Tuple[int, int]], None]):
+        self.fn = fn
+
+    def open(self, n_tiles: int, tile_shape: Tuple[int, ...], dtype) -> None:
+        pass
+
+    def add(
+        self,
+        index: int,
+        name: str,
+        crop_img: np.ndarray,
+        origin: Tuple[int, int],
+        encode: Optional[Callable[[np.ndarray], bytes]] = None,
+    ) -> None:
+        if encode is None:
+            raise ValueError("CallbackSink needs an encoder for the tiles")
+        self.fn(name, encode(crop_img), tuple(int(x) for x in origin))
+
+    def close(self) -> None:
+        pass
+
+
+def write_index(index_path: Path, columns: list, rows: list) -> None:
+    # tile index of a sink: position, tile name, sink columns, origin
+    with open(index_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["index", "name"] + columns + ["h", "w"])
+        writer.writerows(sorted(rows))
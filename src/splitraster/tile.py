@@ -0,0 +1,601 @@
+import numpy as np
+from typing import Iterator, Optional, Tuple
+
+
+def get_stride(crop_size: int, repetition_rate: float = 0) -> int:
+    """
+    Get the step between two neighbouring tiles
+    Args:
+        crop_size: tile size
+        repetition_rate: overlap rate between neighbouring tiles
+    Returns:
+        stride in pixels
+    """
+    return int(crop_size * (1 - repetition_rate))
+
+
+def padded_size(size: int, stride: int) -> int:
+    """
+    Get the minimal padded size which is a multiple of stride
+    Args:
+        size: height or width of the image
+        stride: stride
+    Returns:
+        padded size
+    """
+    return int(np.ceil(size / stride) * stride)
+
+
+def grid_shape(H: int, W: int, crop_size: int, stride: int) -> Tuple[int, int]:
+    """
+    Get the number of tile rows and columns of a padded image
+    Args:
+        H: padded image height
+        W: padded image width
+        crop_size: tile size
+        stride: stride
+    Returns:
+        (n_rows, n_cols)
+    """
+    n_rows = int((H - crop_size) / stride + 1)
+    n_cols = int((W - crop_size) / stride + 1)
+    return n_rows, n_cols
+
+
+def tile_generator(n_rows: int, n_cols: int, stride: int) -> Iterator[Tuple[int, int]]:
+    """
+    Generate the upper left corner (h, w) of every tile, row by row
+    Args:
+        n_rows: number of tile rows
+        n_cols: number of tile columns
+        stride: stride
+    """
+    for idh in range(n_rows):
+        h = idh * stride
+        for idw in range(n_cols):
+            w = idw * stride
+            yield h, w
+
+
+def reflect_index(start: int, stop: int, size: int) -> np.ndarray:
+    """
+    Map the padded positions [start, stop) back to the source positions,
+    the same way np.pad(..., "reflect") does.
+    Args:
+        start: first padded position
+        stop: end of the padded positions (exclusive)
+        size: source size along this axis
+    Returns:
+        source index array
+    """
+    idx = np.arange(start, stop)
+    if size == 1:
+        return np.zeros_like(idx)
+    period = 2 * (size - 1)
+    idx = np.abs(idx) % period
+    return np.where(idx >= size, period - idx, idx)
+
+
+def tile_origins(n_rows: int, n_cols: int, stride: int) -> np.ndarray:
+    """
+    Get the upper left corner of every tile as one array, in the same order
+    as tile_generator
+    Args:
+        n_rows: number of tile rows
+        n_cols: number of tile columns
+        stride: stride
+    Returns:
+        (n_rows * n_cols, 2) array of (h, w)
+    """
+    idh, idw = np.indices((n_rows, n_cols))
+    return np.stack([idh.ravel(), idw.ravel()], axis=1) * stride
+
+
+def pad_index(start: int, stop: int, size: int, mode: str = "reflect") -> np.ndarray:
+    """
+    Map the padded positions [start, stop) back to the source positions
+    Args:
+        start: first padded position
+        stop: end of the padded positions (exclusive)
+        size: source size along this axis
+        mode: "reflect", "symmetric", "edge" as in np.pad; "constant" maps
+            to the edge too, the caller overwrites those positions
+    Returns:
+        source index array
+    """
+    if mode == "reflect":
+        return reflect_index(start, stop, size)
+    idx = np.arange(start, stop)
+    if mode == "symmetric":
+        period = 2 * size
+        idx = idx % period
+        return np.where(idx >= size, period - 1 - idx, idx)
+    if mode in ("edge", "constant"):
+        return np.clip(idx, 0, size - 1)
+    raise ValueError(f"Unsupported padding mode: {mode}")
+
+
+def take_padded(
+    arr: np.ndarray,
+    axis: int,
+    start: int,
+    stop: int,
+    mode: str = "reflect",
+    constant_values=0,
+) -> np.ndarray:
+    """
+    Take the padded positions [start, stop) of arr along one axis, as if arr
+    was padded at its end with np.pad
+    Args:
+        arr: source array
+        axis: axis to take along
+        start: first padded position
+        stop: end of the padded positions (exclusive)
+        mode: padding mode, see pad_index
+        constant_values: fill value of the "constant" mode
+    Returns:
+        array with stop - start positions along axis
+    """
+    size = arr.shape[axis]
+    # fancy indexing, np.take would first copy a non-contiguous arr
+    index = [slice(None)] * arr.ndim
+    index[axis] = pad_index(start, stop, size, mode)
+    out = arr[tuple(index)]
+    if mode == "constant" and stop > size:
+        outside = [slice(None)] * arr.ndim
+        outside[axis] = slice(max(size - start, 0), None)
+        out[tuple(outside)] = constant_values
+    return out
+
+
+def pad_image(
+    img: np.ndarray,
+    stride: int,
+    channel_first: bool = False,
+    mode: str = "reflect",
+    constant_values=0,
+) -> np.ndarray:
+    """
+    Pad the image to the size of multiple of stride, all bands at once.
+    The padded array is allocated once, the image is copied into it and only
+    the bottom and right margin strips are filled. The image itself is
+    returned when no padding is needed.
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        stride: stride
+        channel_first: bands are stored in the first dimension
+        mode: "reflect", "symmetric", "edge" or "constant"
+        constant_values: fill value of the "constant" mode, e.g. nodata
+    Returns:
+        padded image array
+    """
+    h_axis = 1 if channel_first and img.ndim == 3 else 0
+    w_axis = h_axis + 1
+    height, width = img.shape[h_axis], img.shape[w_axis]
+    H, W = padded_size(height, stride), padded_size(width, stride)
+    if H == height and W == width:
+        return img
+
+    shape = list(img.shape)
+    shape[h_axis], shape[w_axis] = H, W
+    padded_img = np.empty(shape, dtype=img.dtype)
+
+    def region(rows, cols):
+        index = [slice(None)] * img.ndim
+        index[h_axis], index[w_axis] = rows, cols
+        return tuple(index)
+
+    padded_img[region(slice(0, height), slice(0, width))] = img
+    # same order as np.pad: rows first, then columns of all padded rows,
+    # so the bottom right corner is padded from the bottom strip.
+    if H > height:
+        padded_img[region(slice(height, H), slice(0, width))] = take_padded(
+            img, h_axis, height, H, mode, constant_values
+        )
+    if W > width:
+        padded_img[region(slice(None), slice(width, W))] = take_padded(
+            padded_img[region(slice(None), slice(0, width))],
+            w_axis,
+            width,
+            W,
+            mode,
+            constant_values,
+        )
+    return padded_img
+
+
+def get_tile(
+    img: np.ndarray,
+    h: int,
+    w: int,
+    crop_size: int,
+    channel_first: bool = False,
+    mode: str = "reflect",
+    constant_values=0,
+) -> np.ndarray:
+    """
+    Get the tile at (h, w) of the padded image without padding the image.
+    Tiles inside the image are views of it, only tiles crossing the bottom or
+    right edge are assembled, with the same values as pad_image gives.
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        h: tile top row in the padded image
+        w: tile left column in the padded image
+        crop_size: tile size
+        channel_first: bands are stored in the first dimension
+        mode: padding mode, see pad_image
+        constant_values: fill value of the "constant" mode
+    Returns:
+        tile array
+    """
+    h_axis = 1 if channel_first and img.ndim == 3 else 0
+    w_axis = h_axis + 1
+    height, width = img.shape[h_axis], img.shape[w_axis]
+    index = [slice(None)] * img.ndim
+    if h + crop_size <= height and w + crop_size <= width:
+        index[h_axis] = slice(h, h + crop_size)
+        index[w_axis] = slice(w, w + crop_size)
+        return img[tuple(index)]
+
+    # the padding is separable, padded[r, c] = img[rows[r], cols[c]]
+    rows = pad_index(h, h + crop_size, height, mode)
+    cols = pad_index(w, w + crop_size, width, mode)
+    index[h_axis] = rows[:, np.newaxis]
+    index[w_axis] = cols[np.newaxis, :]
+    crop_img = img[tuple(index)]
+    if mode == "constant":
+        index = [slice(None)] * img.ndim
+        index[h_axis] = slice(max(height - h, 0), None)
+        crop_img[tuple(index)] = constant_values
+        index[h_axis] = slice(None)
+        index[w_axis] = slice(max(width - w, 0), None)
+        crop_img[tuple(index)] = constant_values
+    return crop_img
+
+
+def iter_tiles(
+    img: np.ndarray,
+    crop_size: int,
+    repetition_rate: float = 0,
+    channel_first: bool = False,
+    pad_mode: str = "reflect",
+    pad_value=0,
+    virtual_padding: bool = False,
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    Iterate over the tiles of an image without writing them to files.
+    The image is padded once and every tile is a view into the padded array,
+    so no tile is copied. Tiles come in the same order as split_image names
+    them.
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        crop_size: tile size
+        repetition_rate: overlap rate between neighbouring tiles
+        channel_first: bands are stored in the first dimension (geo layout)
+        pad_mode: padding mode, see pad_image
+        pad_value: fill value of the "constant" padding mode
+        virtual_padding: do not pad the image, tiles inside it are views of
+            img and only the edge tiles are assembled (see get_tile)
+    Returns:
+        generator of (row, col, tile view)
+    """
+    stride = get_stride(crop_size, repetition_rate)
+    h_axis = 1 if channel_first and img.ndim == 3 else 0
+    H = padded_size(img.shape[h_axis], stride)
+    W = padded_size(img.shape[h_axis + 1], stride)
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    if virtual_padding:
+        source = img
+    else:
+        source = pad_image(img, stride, channel_first, pad_mode, pad_value)
+    for n, (h, w) in enumerate(tile_generator(n_rows, n_cols, stride)):
+        tile = get_tile(source, h, w, crop_size, channel_first, pad_mode, pad_value)
+        yield n // n_cols, n % n_cols, tile
+
+
+def sample_crop_origins(
+    height: int,
+    width: int,
+    crop_size: int,
+    crop_number: int,
+    seed=None,
+    replace: bool = True,
+    min_spacing: int = 0,
+) -> np.ndarray:
+    """
+    Draw the upper left corners of random crops, all at once
+    Args:
+        height: image height
+        width: image width
+        crop_size: crop size
+        crop_number: number of crops
+        seed: seed or np.random.Generator, the same seed gives the same crops
+        replace: allow the same origin more than once
+        min_spacing: min distance in rows or columns between two origins,
+            fewer crops are returned when the image has no room for more
+    Returns:
+        (crop_number, 2) array of (h, w)
+    """
+    rng = np.random.default_rng(seed)
+    n_h, n_w = height - crop_size + 1, width - crop_size + 1
+    if n_h <= 0 or n_w <= 0:
+        raise ValueError(f"Crop size {crop_size} is larger than the image")
+    if min_spacing > 1:
+        return spaced_origins(rng, n_h, n_w, crop_number, min_spacing)
+    if replace:
+        return rng.integers(0, [n_h, n_w], size=(crop_number, 2))
+    if crop_number > n_h * n_w:
+        raise ValueError(f"The image has only {n_h * n_w} distinct crops")
+    flat = rng.choice(n_h * n_w, size=crop_number, replace=False)
+    return np.stack(np.divmod(flat, n_w), axis=1)
+
+
+def spaced_origins(
+    rng: np.random.Generator,
+    n_h: int,
+    n_w: int,
+    crop_number: int,
+    spacing: int,
+    max_rounds: int = 30,
+) -> np.ndarray:
+    # dart throwing: candidates are drawn in batches and kept when no kept
+    # origin is closer than spacing in both rows and columns. A grid of
+    # spacing x spacing cells holds at most one origin, so only the 3 x 3
+    # neighbouring cells are checked.
+    cells = np.full((n_h // spacing + 1, n_w // spacing + 1), -1, dtype=np.int64)
+    kept = np.empty((crop_number, 2), dtype=np.int64)
+    n = 0
+    for _ in range(max_rounds):
+        candidates = rng.integers(0, [n_h, n_w], size=(2 * (crop_number - n), 2))
+        for h, w in candidates:
+            ch, cw = h // spacing, w // spacing
+            near = cells[max(ch - 1, 0) : ch + 2, max(cw - 1, 0) : cw + 2]
+            others = kept[near[near >= 0]]
+            if (np.abs(others - (h, w)).max(axis=1, initial=0) < spacing).any():
+                continue
+            cells[ch, cw] = n
+            kept[n] = h, w
+            n += 1
+            if n == crop_number:
+                return kept
+    print(f"Only {n} crops fit with a min spacing of {spacing}")
+    return kept[:n]
+
+
+def gather_crops(
+    img: np.ndarray,
+    origins: np.ndarray,
+    crop_size: int,
+    channel_first: bool = False,
+) -> np.ndarray:
+    """
+    Copy the crops at origins into one array with a single fancy index
+    Args:
+        img: image array, (H, W), (H, W, C) or (C, H, W) if channel_first
+        origins: (N, 2) array of (h, w), see sample_crop_origins
+        crop_size: crop size
+        channel_first: bands are stored in the first dimension
+    Returns:
+        (N, h, w), (N, h, w, C) or (N, C, h, w) if channel_first
+    """
+    offsets = np.arange(crop_size)
+    rows = (origins[:, 0, np.newaxis] + offsets)[:, :, np.newaxis]
+    cols = (origins[:, 1, np.newaxis] + offsets)[:, np.newaxis, :]
+    if channel_first and img.ndim == 3:
+        return np.moveaxis(img[:, rows, cols], 0, 1)
+    return img[rows, cols]
+
+
+def block_sums(values: np.ndarray, size: int) -> np.ndarray:
+    """
+    Sum the size x size blocks of a 2D array
+    Args:
+        values: 2D array
+        size: block size, the last blocks are summed over the part inside
+            the array
+    Returns:
+        (ceil(H / size), ceil(W / size)) array of block sums
+    """
+    H, W = values.shape
+    nbh, nbw = -(-H // size), -(-W // size)
+    padded = np.zeros((nbh * size, nbw * size), dtype=values.dtype)
+    padded[:H, :W] = values
+    return padded.reshape(nbh, size, nbw, size).sum(axis=(1, 3))
+
+
+class LabelIndex:
+    """
+    Where the classes of a label raster are: the number of pixels of each
+    class in every block of block_size x block_size pixels. Built once, it
+    draws crops containing a chosen class without trying random crops.
+    Args:
+        label: label array, (H, W), (H, W, C) or (C, H, W) if channel_first;
+            the first band is used
+        block_size: block size, at most half the crop size so a crop
+            centred in a block contains all of it
+        classes: class values to index, defaults to all values of label
+        chunk_rows: rows of the label counted at once, bounds the memory
+        channel_first: bands are stored in the first dimension
+    """
+
+    def __init__(
+        self,
+        label: np.ndarray,
+        block_size: int = 64,
+        classes=None,
+        chunk_rows: int = 1024,
+        channel_first: bool = False,
+    ):
+        if label.ndim == 3:
+            label = label[0] if channel_first or len(label) == 1 else label[..., 0]
+        self.shape = label.shape
+        self.block_size = block_size
+        step = max(chunk_rows // block_size, 1) * block_size
+        if classes is None:
+            classes = set()
+            for top in range(0, label.shape[0], step):
+                classes.update(np.unique(label[top : top + step]).tolist())
+        self.classes = np.array(sorted(classes))
+        counts = []
+        for top in range(0, label.shape[0], step):
+            chunk = label[top : top + step]
+            counts.append([block_sums(chunk == c, block_size) for c in self.classes])
+        # (n_classes, block rows, block columns) pixel counts
+        self.counts = np.concatenate(counts, axis=1)
+
+    def sample(
+        self,
+        crop_size: int,
+        crop_number: int,
+        proportions=None,
+        seed=None,
+    ):
+        """
+        Draw crop origins, the class of each crop is drawn with the target
+        proportions and the crop is centred in a block holding that class
+        Args:
+            crop_size: crop size
+            crop_number: number of crops
+            proportions: dict of class value -> share of the crops, defaults
+                to the same share for every class present
+            seed: seed or np.random.Generator
+        Returns:
+            (crop_number, 2) array of (h, w) and the (crop_number,) array of
+            the class of each crop
+        """
+        rng = np.random.default_rng(seed)
+        totals = self.counts.reshape(len(self.classes), -1).sum(axis=1)
+        if proportions is None:
+            weights = (totals > 0).astype(np.float64)
+        else:
+            weights = np.array([proportions.get(c, 0) for c in self.classes.tolist()])
+            weights = np.where(totals > 0, weights, 0).astype(np.float64)
+        if weights.sum() == 0:
+            raise ValueError("None of the requested classes is in the label")
+        chosen = rng.choice(
+            len(self.classes), size=crop_number, p=weights / weights.sum()
+        )
+
+        H, W = self.shape
+        n_bw = self.counts.shape[2]
+        origins = np.empty((crop_number, 2), dtype=np.int64)
+        for k in np.unique(chosen):
+            picks = np.flatnonzero(chosen == k)
+            # blocks drawn in proportion to their pixels of the class
+            cdf = np.cumsum(self.counts[k].ravel())
+            blocks = np.searchsorted(cdf, rng.random(len(picks)) * cdf[-1], "right")
+            corner = np.stack(np.divmod(blocks, n_bw), axis=1) * self.block_size
+            center = corner + rng.integers(0, self.block_size, size=(len(picks), 2))
+            center = np.minimum(center, [H - 1, W - 1])
+            origins[picks] = np.clip(
+                center - crop_size // 2, 0, [H - crop_size, W - crop_size]
+            )
+        return origins, self.classes[chosen]
+
+    def save(self, file_name: str) -> None:
+        np.savez(
+            file_name,
+            shape=self.shape,
+            block_size=self.block_size,
+            classes=self.classes,
+            counts=self.counts,
+        )
+
+    @classmethod
+    def load(cls, file_name: str) -> "LabelIndex":
+        data = np.load(file_name)
+        index = cls.__new__(cls)
+        index.shape = tuple(data["shape"].tolist())
+        index.block_size = int(data["block_size"])
+        index.classes = data["classes"]
+        index.counts = data["counts"]
+        return index
+
+
+def stratified_crop_origins(
+    label: np.ndarray,
+    crop_size: int,
+    crop_number: int,
+    proportions="balanced",
+    seed=None,
+    label_index: Optional[LabelIndex] = None,
+    channel_first: bool = False,
+) -> np.ndarray:
+    """
+    Draw crop origins with target class proportions, see LabelIndex
+    Args:
+        label: label array, only read when label_index is None
+        crop_size: crop size
+        crop_number: number of crops
+        proportions: dict of class value -> share of the crops, or
+            "balanced" for the same share for every class
+        seed: seed or np.random.Generator
+        label_index: optional prebuilt (or loaded) LabelIndex of label
+        channel_first: bands of label are stored in the first dimension
+    Returns:
+        (crop_number, 2) array of (h, w)
+    """
+    if label_index is None:
+        label_index = LabelIndex(
+            label, block_size=max(crop_size // 4, 1), channel_first=channel_first
+        )
+    if isinstance(proportions, str) and proportions == "balanced":
+        proportions = None
+    origins, _ = label_index.sample(crop_size, crop_number, proportions, seed)
+    return origins
+
+
+def plan_split(
+    height: int,
+    width: int,
+    bands: int,
+    itemsize: int,
+    crop_size: int,
+    repetition_rate: float = 0,
+    virtual_padding: bool = False,
+    strip_rows: Optional[int] = None,
+    workers: int = 1,
+    mmap: bool = False,
+) -> dict:
+    """
+    Estimate a split without reading or writing anything
+    Args:
+        height: image height
+        width: image width
+        bands: number of bands
+        itemsize: bytes per pixel value
+        crop_size: tile size
+        repetition_rate: overlap rate between neighbouring tiles
+        virtual_padding: the padded image is not allocated
+        strip_rows: tile rows held in memory by a streaming split, None when
+            the whole image is loaded
+        workers: number of writer threads, each may hold queued tiles
+        mmap: the image is memory-mapped, it is neither loaded nor padded,
+            only the pages of the tiles are read
+    Returns:
+        dict with the grid size, tile count, uncompressed output bytes and
+        the estimated peak memory in bytes
+    """
+    stride = get_stride(crop_size, repetition_rate)
+    H, W = padded_size(height, stride), padded_size(width, stride)
+    n_rows, n_cols = grid_shape(H, W, crop_size, stride)
+    pixel_bytes = bands * itemsize
+    tile_bytes = crop_size * crop_size * pixel_bytes
+    if strip_rows is not None:
+        rows_in_memory = (min(strip_rows, n_rows) - 1) * stride + crop_size
+        data_bytes = rows_in_memory * width * pixel_bytes
+    elif mmap:
+        data_bytes = 0
+    else:
+        data_bytes = height * width * pixel_bytes
+        if not virtual_padding and (H, W) != (height, width):
+            data_bytes += H * W * pixel_bytes
+    queued_bytes = 2 * max(workers, 1) * tile_bytes
+    return {
+        "stride": stride,
+        "padded_shape": (H, W),
+        "grid": (n_rows, n_cols),
+        "tiles": n_rows * n_cols,
+        "output_bytes": n_rows * n_cols * tile_bytes,
+        "peak_memory_bytes": data_bytes + queued_bytes,
+    }
@@ -0,0 +1,56 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Accumulate the wall time spent in each stage of a split (read, pad,
+    slice, encode, write). Safe to use from the writer threads, in which case
+    the encode and write times are summed over the threads.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def merge(self, seconds: dict, calls: dict) -> None:
+        # add the stage times of another timer, e.g. of a worker process
+        with self._lock:
+            for name in seconds:
+                self.seconds[name] = self.seconds.get(name, 0.0) + seconds[name]
+                self.calls[name] = self.calls.get(name, 0) + calls[name]
+
+    def report(self) -> str:
+        total = sum(self.seconds.values()) or 1.0
+        lines = [f"{'stage':<10}{'calls':>10}{'seconds':>12}{'share':>8}"]
+        for name, seconds in self.seconds.items():
+            lines.append(
+                f"{name:<10}{self.calls[name]:>10}{seconds:>12.3f}"
+                f"{seconds / total:>8.1%}"
+            )
+        return "\n".join(lines)
+
+
+@contextmanager
+def timed(timer, name: str):
+    # time a stage when a StageTimer is given, do nothing otherwise
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
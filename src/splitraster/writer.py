@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+class TileWriter:
+    """
+    Run tile save calls on a thread pool.
+    The encoders (skimage/PIL, GDAL) release the GIL, so threads are enough
+    to keep several cores busy without pickling the tiles to other processes.
+    At most max_pending tiles are in flight, so memory stays bounded.
+    With workers <= 1 every call runs inline, same as a plain loop.
+    Args:
+        workers: number of writer threads
+        pbar: optional tqdm bar, updated when a tile is written
+        max_pending: max number of queued tiles, defaults to 2 * workers
+    """
+
+    def __init__(self, workers: int = 1, pbar=None, max_pending: Optional[int] = None):
+        self.workers = max(int(workers or 1), 1)
+        self.pbar = pbar
+        self.max_pending = max_pending or 2 * self.workers
+        self.pending = set()
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        if self.pool is None:
+            fn(*args, **kwargs)
+            self._done(1)
+            return
+        if len(self.pending) >= self.max_pending:
+            self._wait(FIRST_COMPLETED)
+        self.pending.add(self.pool.submit(fn, *args, **kwargs))
+
+    def _wait(self, return_when) -> None:
+        done, self.pending = wait(self.pending, return_when=return_when)
+        for future in done:
+            future.result()  # re-raise errors of the writer threads
+        self._done(len(done))
+
+    def _done(self, n: int) -> None:
+        if self.pbar is not None:
+            self.pbar.update(n)
+
+    def close(self) -> None:
+        if self.pool is None:
+            return
+        try:
+            if self.pending:
+                self._wait(ALL_COMPLETED)
+        finally:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.pool is not None:
+            # the split loop failed, drop the queued tiles and keep its error
+            for future in self.pending:
+                future.cancel()
+            self.pending = set()
+        self.close()
+        return False
+
+
+def first_tile_name(save_paths: List[str], overwrite: bool = True) -> Optional[int]:
+    """
+    Number of the first new tile: 1 when overwriting, otherwise the one after
+    the files already in the output folders
+    Args:
+        save_paths: output folders, e.g. of the images and of their labels
+        overwrite: overwrite existing files
+    Returns:
+        tile number, None when the folders hold different numbers of files
+    """
+    if overwrite:
+        return 1
+    counts = []
+    for save_path in save_paths:
+        counts.append(sum(1 for path in Path(save_path).iterdir() if path.is_file()))
+        print(f"There are {counts[-1]} files in the {save_path}")
+    if len(set(counts)) > 1:
+        print(f"Image sets do not match in output folders: {counts}")
+        return None
+    print(f"New image name will start with {counts[0] + 1}")
+    return counts[0] + 1
@@ -123,4 +123,970 @@ def test_rgb_gt_random_crop():
 #     )
 
 
+#  Example E
+def test_rgb_parallel_writer() -> None:
+    from pathlib import Path
+    from splitraster import io
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Workers/Sequential"
+    save_path_parallel = "./data/processed/Workers/Parallel"
+
+    n = io.split_image(input_image_path, save_path, 256, overwrite=True)
+    m = io.split_image(
+        input_image_path, save_path_parallel, 256, overwrite=True, workers=4
+    )
+    assert n == m
+    for tile in Path(save_path).iterdir():
+        assert tile.read_bytes() == (Path(save_path_parallel) / tile.name).read_bytes()
+
+
+#  Example F
+def test_rgb_iter_tiles() -> None:
+    import numpy as np
+    from splitraster import io, tile
+
+    img = io.read_image("./data/raw/RGB.png")
+    tiles = list(tile.iter_tiles(img, crop_size=256, repetition_rate=0.5))
+    assert len(tiles) == 49
+    row, col, first = tiles[0]
+    assert (row, col) == (0, 0) and first.shape == (256, 256, 3)
+    assert np.array_equal(first, img[:256, :256])
+    assert first.base is tiles[-1][2].base  # views of one padded array
+
+
+#  Example G
+def test_padding_modes() -> None:
+    import numpy as np
+    from splitraster import tile
+
+    img = np.arange(4 * 37 * 53, dtype=np.uint16).reshape(4, 37, 53)
+    for mode in ["reflect", "symmetric", "edge", "constant"]:
+        padded_img = tile.pad_image(img, 16, channel_first=True, mode=mode)
+        expected = np.pad(img, ((0, 0), (0, 11), (0, 11)), mode)
+        assert np.array_equal(padded_img, expected)
+
+
+#  Example H
+def test_gt_virtual_padding() -> None:
+    from pathlib import Path
+    from splitraster import io
+
+    gt_image_path = "./data/raw/GT.png"
+    save_path = "./data/processed/Virtual/Padded"
+    save_path_virtual = "./data/processed/Virtual/Virtual"
+
+    n = io.split_image(gt_image_path, save_path, 256, repetition_rate=0.5)
+    m = io.split_image(
+        gt_image_path, save_path_virtual, 256, repetition_rate=0.5, virtual_padding=True
+    )
+    assert n == m
+    for tile in Path(save_path).iterdir():
+        assert tile.read_bytes() == (Path(save_path_virtual) / tile.name).read_bytes()
+
+
+#  Example I
+def test_split_directory(capsys) -> None:
+    from splitraster import batch
+    from splitraster.timing import StageTimer
+
+    pattern = "./data/raw/*.png"
+    save_root = "./data/processed/Batch"
+
+    summary = batch.split_directory(pattern, save_root, 256, workers=2, resume=False)
+    assert summary["processed"] == 2 and summary["tiles"] == 32
+    summary = batch.split_directory(pattern, save_root, 256, workers=2)
+    assert summary["skipped"] == 2 and summary["tiles"] == 0
+
+    # the stage times of the scene processes reach the timer
+    timer = StageTimer()
+    batch.split_directory(pattern, save_root, 256, workers=2, resume=False, timer=timer)
+    assert timer.calls["encode"] == 32 and timer.calls["write"] == 32
+
+    # batch.main parses its arguments with the split-dir command of the cli
+    argv = [pattern, save_root, "--workers", "2", "--no-resume", "--profile"]
+    assert batch.main(argv) == 0
+    assert "encode" in capsys.readouterr().out
+
+
+#  Example I, scenes with the same file name in different folders
+def test_split_directory_same_names() -> None:
+    import shutil
+    from pathlib import Path
+    from splitraster import batch
+
+    src = Path("./data/processed/BatchNames/src")
+    for folder in ["a", "b"]:
+        (src / folder).mkdir(parents=True, exist_ok=True)
+        shutil.copy("./data/raw/RGB.png", src / folder / "scene.png")
+    save_root = Path("./data/processed/BatchNames/out")
+
+    summary = batch.split_directory(f"{src}/**/*.png", str(save_root), 256, workers=2)
+    assert summary["processed"] == 2 and summary["tiles"] == 32
+    for folder in ["a", "b"]:
+        assert len(list((save_root / folder / "scene").iterdir())) == 16
+
+    shutil.copy("./data/raw/RGB.png", src / "a" / "scene.jpg")
+    try:
+        batch.split_directory(f"{src}/**/*.*", str(save_root), 256)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("scenes sharing a folder not detected")
+
+
+#  Example J
+def test_rgb_gt_aligned_split() -> None:
+    from pathlib import Path
+    from splitraster import io
+
+    input_image_path = "./data/raw/RGB.png"
+    gt_image_path = "./data/raw/GT.png"
+    input_save_path = "./data/processed/Aligned/RGB"
+    gt_save_path = "./data/processed/Aligned/GT"
+
+    n = io.split_aligned_images(
+        [input_image_path, gt_image_path],
+        [input_save_path, gt_save_path],
+        crop_size=256,
+        repetition_rate=0.5,
+    )
+    assert n == 49
+    rgb_tiles = sorted(path.name for path in Path(input_save_path).iterdir())
+    gt_tiles = sorted(path.name for path in Path(gt_save_path).iterdir())
+    assert rgb_tiles == gt_tiles
+
+    # a height/width mismatch raises before any tile is written
+    import numpy as np
+    import pytest
+
+    small_path = "./data/processed/Aligned/small.npy"
+    np.save(small_path, io.read_image(gt_image_path)[:-1])
+    with pytest.raises(ValueError):
+        io.split_aligned_images(
+            [input_image_path, small_path],
+            [
+                "./data/processed/Aligned/Mismatch/RGB",
+                "./data/processed/Aligned/Mismatch/GT",
+            ],
+            crop_size=256,
+        )
+    assert not Path("./data/processed/Aligned/Mismatch").exists()
+
+
+#  Example K
+def test_cli_dry_run() -> None:
+    import numpy as np
+    from pathlib import Path
+    from splitraster import cli, io
+
+    save_path = "./data/processed/CLI/RGB"
+    argv = ["split", "./data/raw/RGB.png", save_path, "--dry-run", "--workers", "4"]
+    assert cli.main(argv) == 0
+    assert not Path(save_path).exists()
+
+    # .npy inputs, a mapped one is not counted as resident memory
+    npy_path = "./data/processed/CLI/RGB.npy"
+    Path(npy_path).parent.mkdir(parents=True, exist_ok=True)
+    np.save(npy_path, io.read_image("./data/raw/RGB.png"))
+    argv = ["split", npy_path, save_path, "--dry-run"]
+    loaded = cli.dry_run_split(cli.build_parser().parse_args(argv))
+    mapped = cli.dry_run_split(cli.build_parser().parse_args(argv + ["--mmap"]))
+    assert cli.main(argv + ["--mmap"]) == 0
+    assert loaded["tiles"] == mapped["tiles"] == 16
+    assert mapped["peak_memory_bytes"] == 2 * 256 * 256 * 3
+    assert loaded["peak_memory_bytes"] > 1024 * 1024 * 3
+
+
+#  Example L
+def test_lazy_imports() -> None:
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, splitraster.tile, splitraster.io, splitraster.geo; "
+        "print([m for m in ('skimage', 'imageio', 'osgeo') if m in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+#  Example M
+def test_rgb_npy_encoder() -> None:
+    import numpy as np
+    from splitraster import io, tile
+    from splitraster.encoders import Encoder
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Encoder/RGB"
+
+    n = io.split_image(input_image_path, save_path, 256, encoder=Encoder("npy"))
+    assert n == 16
+    img = io.read_image(input_image_path)
+    _, _, last = list(tile.iter_tiles(img, 256))[-1]
+    assert np.array_equal(np.load(f"{save_path}/0016.npy"), last)
+
+
+#  Example N
+def test_rgb_sinks() -> None:
+    import tarfile
+    import numpy as np
+    from splitraster import io, tile
+    from splitraster.sinks import NpyStackSink, TarShardSink
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Sinks"
+
+    sink = TarShardSink(f"{save_path}/shards", max_tiles=10)
+    n = io.split_image(input_image_path, save_path, 256, workers=2, sink=sink)
+    assert n == 16
+    with tarfile.open(f"{save_path}/shards/shard-000001.tar") as tar:
+        assert len(tar.getnames()) == 6
+
+    sink = NpyStackSink(save_path)
+    n = io.split_image(input_image_path, save_path, 256, sink=sink)
+    stack = np.load(f"{save_path}/tiles.npy", mmap_mode="r")
+    img = io.read_image(input_image_path)
+    _, _, last = list(tile.iter_tiles(img, 256))[-1]
+    assert stack.shape == (16, 256, 256, 3)
+    assert np.array_equal(stack[-1], last)
+
+
+#  Example O
+def test_rgb_mmap_input() -> None:
+    import numpy as np
+    import tifffile
+    from pathlib import Path
+    from splitraster import io
+
+    img = io.read_image("./data/raw/RGB.png")
+    save_path = "./data/processed/Mmap"
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    np.save(f"{save_path}/RGB.npy", img)
+    tifffile.imwrite(f"{save_path}/RGB.tif", img)
+
+    for input_path in [f"{save_path}/RGB.npy", f"{save_path}/RGB.tif"]:
+        mapped = io.read_image(input_path, mmap=True)
+        assert isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped, img)
+
+    io.split_image("./data/raw/RGB.png", f"{save_path}/png", 256)
+    n = io.split_image(f"{save_path}/RGB.tif", f"{save_path}/tif", 256, mmap=True)
+    assert n == 16
+    tile = io.read_image(f"{save_path}/tif/0016.tif")
+    assert np.array_equal(tile, io.read_image(f"{save_path}/png/0016.png"))
+
+    # tiles of a .npy input are .npy files, loaded or mapped
+    for mmap in [False, True]:
+        n = io.split_image(
+            f"{save_path}/RGB.npy", f"{save_path}/npy_{mmap}", 256, mmap=mmap
+        )
+        assert n == 16
+        tile = io.read_image(f"{save_path}/npy_{mmap}/0016.npy")
+        assert np.array_equal(tile, io.read_image(f"{save_path}/png/0016.png"))
+
+
+#  Example P
+def test_rgb_incremental_split() -> None:
+    import numpy as np
+    from pathlib import Path
+    from splitraster import io
+    from splitraster.manifest import TileManifest
+
+    save_path = "./data/processed/Incremental"
+    input_image_path = f"{save_path}/RGB.png"
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    img = io.read_image("./data/raw/RGB.png")
+    io.save_image(img, input_image_path)
+
+    n = io.split_image(input_image_path, f"{save_path}/tiles", 256, incremental=True)
+    assert n == 16
+    # an unchanged image is not read again
+    n = io.split_image(input_image_path, f"{save_path}/tiles", 256, incremental=True)
+    assert n == 16
+
+    # only the changed tile is rewritten
+    last = Path(f"{save_path}/tiles/0016.png").stat().st_mtime_ns
+    img = img.copy()
+    img[0, 0] = 255 - img[0, 0]
+    io.save_image(img, input_image_path)
+    n = io.split_image(input_image_path, f"{save_path}/tiles", 256, incremental=True)
+    assert n == 16
+    assert Path(f"{save_path}/tiles/0016.png").stat().st_mtime_ns == last
+    assert np.array_equal(io.read_image(f"{save_path}/tiles/0001.png")[0, 0], img[0, 0])
+
+    # other settings replace the tiles of the previous grid
+    n = io.split_image(input_image_path, f"{save_path}/tiles", 500, incremental=True)
+    assert n == 4
+    names = sorted(path.name for path in Path(f"{save_path}/tiles").glob("*.png"))
+    assert names == ["0001.png", "0002.png", "0003.png", "0004.png"]
+    for name in names:
+        assert io.read_image(f"{save_path}/tiles/{name}").shape == (500, 500, 3)
+
+    # a shrunk image drops the tiles and records of the cells outside its grid
+    io.save_image(img[:500, :500], input_image_path)
+    n = io.split_image(input_image_path, f"{save_path}/tiles", 500, incremental=True)
+    assert n == 1
+    names = sorted(path.name for path in Path(f"{save_path}/tiles").glob("*.png"))
+    assert names == ["0001.png"]
+    manifest = TileManifest(f"{save_path}/tiles")
+    assert list(manifest.tiles) == [(str(Path(input_image_path).resolve()), 0, 0)]
+
+
+#  Example Q
+def test_rgb_gt_seeded_random_crop() -> None:
+    import numpy as np
+    from splitraster import io, tile
+
+    input_image_path = "./data/raw/RGB.png"
+    gt_image_path = "./data/raw/GT.png"
+    save_path = "./data/processed/Seeded"
+
+    for run in ["a", "b"]:
+        n = io.random_crop_image(
+            input_image_path,
+            f"{save_path}/{run}/RGB",
+            gt_image_path,
+            f"{save_path}/{run}/GT",
+            crop_size=256,
+            crop_number=10,
+            seed=7,
+            min_spacing=64,
+        )
+        assert n == 10
+    for name in ["RGB/0010.jpg", "GT/0010.png"]:
+        a = io.read_image(f"{save_path}/a/{name}")
+        assert np.array_equal(a, io.read_image(f"{save_path}/b/{name}"))
+
+    img = io.read_image(input_image_path)
+    origins = tile.sample_crop_origins(1000, 1000, 256, 100, seed=7, replace=False)
+    assert len(np.unique(origins, axis=0)) == 100
+    crops = tile.gather_crops(img, origins, 256)
+    h, w = origins[-1]
+    assert crops.shape == (100, 256, 256, 3)
+    assert np.array_equal(crops[-1], img[h : h + 256, w : w + 256])
+
+
+#  Example R
+def test_rgb_gt_tile_filter() -> None:
+    import csv
+    import numpy as np
+    from pathlib import Path
+    from splitraster import io
+    from splitraster.filters import TileFilter
+    from splitraster.sinks import NpyStackSink
+
+    input_image_path = "./data/raw/RGB.png"
+    gt_image_path = "./data/raw/GT.png"
+    save_path = "./data/processed/Filter/RGB"
+    save_path_gt = "./data/processed/Filter/GT"
+
+    tile_filter = TileFilter(min_positive=0.01)
+    n = io.split_aligned_images(
+        [input_image_path, gt_image_path],
+        [save_path, save_path_gt],
+        crop_size=256,
+        tile_filter=tile_filter,
+    )
+    report = tile_filter.report
+    assert report["kept"] == n and report["kept"] + report["dropped"] == 16
+    names = sorted(p.stem for p in Path(save_path).iterdir())
+    assert names == sorted(p.stem for p in Path(save_path_gt).iterdir())
+    assert len(names) == n
+
+    # the padding of the edge tiles counts as nodata
+    tile_filter = TileFilter(max_nodata=0.05)
+    n = io.split_image(gt_image_path, save_path_gt, 256, tile_filter=tile_filter)
+    assert n == 9 and tile_filter.report["nodata"] == 7
+
+    # a stack holds the kept tiles only, its index keeps their grid origins
+    gt = io.read_image(gt_image_path)
+    n = io.split_image(
+        gt_image_path,
+        "./data/processed/Filter/Stack",
+        256,
+        tile_filter=TileFilter(max_nodata=0.05),
+        sink=NpyStackSink("./data/processed/Filter/Stack"),
+    )
+    stack = np.load("./data/processed/Filter/Stack/tiles.npy", mmap_mode="r")
+    assert len(stack) == n == 9
+    with open("./data/processed/Filter/Stack/tiles_index.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert [int(row["index"]) for row in rows] == list(range(9))
+    for row, tile in zip(rows, stack):
+        h, w = int(row["h"]), int(row["w"])
+        assert np.array_equal(tile, gt[h : h + 256, w : w + 256])
+
+    # blocks of gcd(256, 255) = 1 pixel: the sums are taken per tile, and
+    # match the summed-area tables of blocks of 1 pixel
+    img = io.read_image(input_image_path)
+    origins = np.array([[h, w] for h in [0, 255, 510] for w in [0, 255, 765]])
+    tile_filter = TileFilter(nodata=0, min_std=5.0, min_positive=0.01)
+    bands = np.moveaxis(img, 2, 0)
+    per_tile = tile_filter.tile_stats(bands, origins, 256, gt)
+    tables = tile_filter.window_stats(bands, origins, 256, 1, gt)
+    for key in ["valid", "sum", "sumsq", "positive"]:
+        assert np.allclose(per_tile[key], tables[key])
+    n = io.split_image(
+        input_image_path, save_path, 256, 1 / 256, tile_filter=tile_filter
+    )
+    assert n == tile_filter.report["kept"] > 0
+
+
+#  Example S
+def test_rgb_gt_balanced_random_crop() -> None:
+    import numpy as np
+    from splitraster import io
+    from splitraster.tile import LabelIndex
+
+    input_image_path = "./data/raw/RGB.png"
+    gt_image_path = "./data/raw/GT.png"
+    save_path = "./data/processed/Balanced/RGB"
+    save_path_gt = "./data/processed/Balanced/GT"
+
+    gt = io.read_image(gt_image_path)
+    label_index = LabelIndex(gt, block_size=32, classes=[0, 92])
+    n = io.random_crop_image(
+        input_image_path,
+        save_path,
+        gt_image_path,
+        save_path_gt,
+        crop_size=128,
+        crop_number=20,
+        seed=3,
+        class_proportions={92: 1.0},
+        label_index=label_index,
+    )
+    assert n == 20
+    for i in range(1, n + 1):
+        assert (io.read_image(f"{save_path_gt}/{i:04d}.png") == 92).any()
+
+    # a multi-band label read by geo is (C, H, W), its first band is indexed
+    bands = np.stack([gt, np.zeros_like(gt)])
+    band_index = LabelIndex(bands, block_size=32, classes=[0, 92], channel_first=True)
+    assert np.array_equal(band_index.counts, label_index.counts)
+
+
+#  Example T
+def test_rgb_merge_tiles() -> None:
+    import numpy as np
+    from splitraster import io
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Merge/RGB"
+
+    img = io.read_image(input_image_path)
+    io.split_image(input_image_path, save_path, 256, repetition_rate=0.5)
+    for blend in ["average", "max", "cosine"]:
+        merged = io.merge_tiles(
+            save_path,
+            f"./data/processed/Merge/{blend}.png",
+            1000,
+            1000,
+            256,
+            repetition_rate=0.5,
+            blend=blend,
+        )
+        assert np.array_equal(merged, img)
+
+    merged = io.merge_tiles(
+        save_path,
+        "./data/processed/Merge/RGB.npy",
+        1000,
+        1000,
+        256,
+        repetition_rate=0.5,
+        memmap_dir="./data/processed/Merge/tmp",
+    )
+    assert np.array_equal(np.load("./data/processed/Merge/RGB.npy"), img)
+
+
+#  Example U
+def test_rgb_predict_image() -> None:
+    import numpy as np
+    from splitraster import io
+    from splitraster.infer import predict_image
+
+    img = io.read_image("./data/raw/RGB.png")
+    calls = []
+
+    def model(batch):
+        calls.append(len(batch))
+        return batch[..., 0] // 2
+
+    # an identity-like model gives back the image, whatever the batching
+    for virtual_padding in [False, True]:
+        pred = predict_image(
+            img,
+            model,
+            256,
+            repetition_rate=0.5,
+            batch_size=5,
+            virtual_padding=virtual_padding,
+        )
+        assert pred.shape == (1000, 1000)
+        assert np.array_equal(pred, img[..., 0] // 2)
+    assert max(calls) == 5
+
+    def failing(batch):
+        raise RuntimeError("model error")
+
+    try:
+        predict_image(img, failing, 256)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("model error not raised")
+
+
+#  Example V
+def test_rgb_callback_sink() -> None:
+    import imageio.v3 as iio
+    import numpy as np
+    from splitraster import io
+    from splitraster.encoders import Encoder
+    from splitraster.sinks import CallbackSink
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Callback/RGB"
+    uploaded = {}
+
+    def upload(name, data, origin):
+        uploaded[name] = (data, origin)
+
+    n = io.split_image(
+        input_image_path,
+        save_path,
+        256,
+        workers=4,
+        encoder=Encoder("png"),
+        sink=CallbackSink(upload),
+    )
+    assert n == len(uploaded) == 16
+    img = io.read_image(input_image_path)
+    data, (h, w) = uploaded["0006.png"]
+    assert (h, w) == (256, 256)
+    assert np.array_equal(iio.imread(data), img[256:512, 256:512])
+
+
+#  Example W
+def test_rgb_split_pipeline() -> None:
+    import filecmp
+    from pathlib import Path
+    from splitraster import io
+    from splitraster.pipeline import Pipeline
+
+    input_image_path = "./data/raw/RGB.png"
+    save_path = "./data/processed/Pipeline"
+
+    n = io.split_image(input_image_path, f"{save_path}/loop", 256, 0.5)
+    m = io.split_image(
+        input_image_path, f"{save_path}/stages", 256, 0.5, workers=3, pipeline=True
+    )
+    assert n == m == 49
+    for path in Path(f"{save_path}/loop").iterdir():
+        assert filecmp.cmp(path, f"{save_path}/stages/{path.name}", shallow=False)
+
+    pipeline = Pipeline(queue_size=2).stage("double", lambda x: [x, x])
+    pipeline.stage("square", lambda x: [x * x], workers=4)
+    assert pipeline.run(range(100)) == 200
+    assert pipeline.metrics["square"]["items"] == 200
+
+
+#  Example X
+def test_geo_streaming_split() -> None:
+    import pytest
+
+    pytest.importorskip("osgeo")
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/Stream"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    img = np.random.default_rng(0).integers(0, 4000, (3, 300, 400), dtype=np.uint16)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/input.tif")
+
+    for pad_mode in ["reflect", "symmetric", "edge", "constant"]:
+        loaded = f"{save_path}/{pad_mode}/loaded"
+        n = geo.split_image(
+            f"{save_path}/input.tif", loaded, 128, 0.25, pad_mode=pad_mode
+        )
+        assert n == 12
+        # an inner tile is the raster window, with the geotransform of its origin
+        tile, tile_gt, _ = geo.read_rasterArray(f"{loaded}/0006.tif")
+        assert np.array_equal(tile, img[:, 96:224, 96:224])
+        assert tile_gt == (500048.0, 0.5, 0.0, 3999952.0, 0.0, -0.5)
+        for strip_rows in [1, 2, 5]:
+            streamed = f"{save_path}/{pad_mode}/strip_rows_{strip_rows}"
+            m = geo.split_image(
+                f"{save_path}/input.tif",
+                streamed,
+                128,
+                0.25,
+                stream=True,
+                strip_rows=strip_rows,
+                pad_mode=pad_mode,
+            )
+            assert m == n
+            for path in Path(loaded).glob("*.tif"):
+                expected, expected_gt, _ = geo.read_rasterArray(str(path))
+                tile, tile_gt, _ = geo.read_rasterArray(f"{streamed}/{path.name}")
+                assert np.array_equal(tile, expected)
+                assert tile_gt == expected_gt
+
+
+#  Example Y
+def test_geo_tile_datatypes() -> None:
+    import pytest
+
+    pytest.importorskip("osgeo")
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/Datatypes"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    rng = np.random.default_rng(0)
+    images = {
+        "int16": rng.integers(-3000, 3000, (2, 200, 200), dtype=np.int16),
+        "uint32": rng.integers(0, 2**32, (2, 200, 200), dtype=np.uint32),
+        "float64": rng.normal(0, 1e6, (2, 200, 200)),
+        "bool": rng.random((1, 200, 200)) > 0.5,
+    }
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    for name, img in images.items():
+        geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/{name}.tif")
+        n = geo.split_image(f"{save_path}/{name}.tif", f"{save_path}/{name}", 100)
+        assert n == 4
+        tile, _, _ = geo.read_rasterArray(f"{save_path}/{name}/0004.tif")
+        # bool tiles are written as Byte, 0 and 1
+        expected = img[:, 100:, 100:]
+        if img.dtype == bool:
+            expected = expected.astype(np.uint8)
+        assert tile.dtype == expected.dtype
+        assert np.array_equal(tile, expected)
+
+
+#  Example Z
+def test_geo_block_cache(capsys) -> None:
+    import pytest
+
+    pytest.importorskip("osgeo")
+    import ast
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+    from splitraster.encoders import gtiff_options
+
+    save_path = "./data/processed/BlockCache"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    img = np.random.default_rng(0).integers(0, 4000, (3, 300, 400), dtype=np.uint16)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    options = gtiff_options(tiled=True, blocksize=32)
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/input.tif", options)
+
+    n = geo.split_image(f"{save_path}/input.tif", f"{save_path}/loaded", 128, 0.5)
+    for strip_rows in [1, 3]:
+        streamed = f"{save_path}/strip_rows_{strip_rows}"
+        capsys.readouterr()
+        m = geo.split_image(
+            f"{save_path}/input.tif",
+            streamed,
+            128,
+            0.5,
+            stream=True,
+            strip_rows=strip_rows,
+        )
+        assert m == n
+        # the strips overlap, still every block is decoded once
+        line = [
+            line
+            for line in capsys.readouterr().out.splitlines()
+            if line.startswith("Block cache: ")
+        ][0]
+        report = ast.literal_eval(line[len("Block cache: ") :])
+        assert report["block_size"] == (32, 32)
+        assert report["misses"] == report["blocks"] == 130
+        assert report["hits"] > 0
+        for path in Path(f"{save_path}/loaded").glob("*.tif"):
+            expected, _, _ = geo.read_rasterArray(str(path))
+            tile, _, _ = geo.read_rasterArray(f"{streamed}/{path.name}")
+            assert np.array_equal(tile, expected)
+
+
+#  Example AA
+def test_geo_encoded_sinks() -> None:
+    import pytest
+
+    gdal = pytest.importorskip("osgeo.gdal")
+    import tarfile
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+    from splitraster.encoders import gtiff_options
+    from splitraster.sinks import CallbackSink, TarShardSink
+
+    save_path = "./data/processed/GeoSinks"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    img = np.random.default_rng(0).integers(0, 4000, (3, 300, 400), dtype=np.uint16)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/input.tif")
+
+    def decode(data):
+        # read GeoTIFF bytes back through GDAL's in-memory file system
+        vsi_path = "/vsimem/test_geo_encoded_sinks.tif"
+        gdal.FileFromMemBuffer(vsi_path, data)
+        try:
+            dataset = gdal.Open(vsi_path)
+            tile, tile_gt = dataset.ReadAsArray(), dataset.GetGeoTransform()
+            del dataset
+        finally:
+            gdal.Unlink(vsi_path)
+        return tile, tile_gt
+
+    uploaded = {}
+
+    def upload(name, data, origin):
+        uploaded[name] = (data, origin)
+
+    options = gtiff_options("DEFLATE", predictor=2)
+    n = geo.split_image(
+        f"{save_path}/input.tif",
+        f"{save_path}/callback",
+        128,
+        workers=2,
+        creation_options=options,
+        sink=CallbackSink(upload),
+    )
+    assert n == len(uploaded) == 12
+    data, (h, w) = uploaded["0006.tif"]
+    assert (h, w) == (128, 128)
+    tile, tile_gt = decode(data)
+    assert np.array_equal(tile, img[:, 128:256, 128:256])
+    assert tile_gt == (500064.0, 0.5, 0.0, 3999936.0, 0.0, -0.5)
+
+    sink = TarShardSink(f"{save_path}/shards", max_tiles=5)
+    n = geo.split_image(
+        f"{save_path}/input.tif", save_path, 128, creation_options=options, sink=sink
+    )
+    assert n == 12
+    with tarfile.open(f"{save_path}/shards/shard-000001.tar") as tar:
+        assert tar.getnames() == [f"{i:04d}.tif" for i in range(6, 11)]
+        tile, tile_gt = decode(tar.extractfile("0006.tif").read())
+    assert np.array_equal(tile, img[:, 128:256, 128:256])
+    assert tile_gt == (500064.0, 0.5, 0.0, 3999936.0, 0.0, -0.5)
+
+
+#  Example AB
+def test_geo_pyramid() -> None:
+    import pytest
+
+    pytest.importorskip("osgeo")
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/Pyramid"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    # constant 2x2 blocks, every resampling gives the same 2x level
+    small = np.random.default_rng(0).integers(0, 4000, (2, 128, 192), np.uint16)
+    img = small.repeat(2, axis=1).repeat(2, axis=2)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/input.tif")
+
+    assert geo.build_overviews(f"{save_path}/input.tif", [1, 2, 4]) == [2, 4]
+    assert geo.build_overviews(f"{save_path}/input.tif", [2, 4]) == []
+    counts = geo.split_pyramid(
+        f"{save_path}/input.tif", f"{save_path}/levels", 64, levels=(1, 2)
+    )
+    assert counts == {1: 24, 2: 6}
+    reference = img.reshape(2, 128, 2, 192, 2).mean(axis=(2, 4))
+    tile, tile_gt, _ = geo.read_rasterArray(f"{save_path}/levels/2x/0002.tif")
+    assert np.array_equal(tile, reference[:, :64, 64:128])
+    assert tile_gt == (500064.0, 1.0, 0.0, 4000000.0, 0.0, -1.0)
+
+    n = geo.split_image(f"{save_path}/input.tif", f"{save_path}/level_2", 64, level=2)
+    assert n == counts[2]
+    for path in Path(f"{save_path}/levels/2x").glob("*.tif"):
+        expected, expected_gt, _ = geo.read_rasterArray(str(path))
+        tile, tile_gt, _ = geo.read_rasterArray(f"{save_path}/level_2/{path.name}")
+        assert np.array_equal(tile, expected)
+        assert tile_gt == expected_gt
+
+
+#  Example AC
+def test_geo_merge_tiles() -> None:
+    import pytest
+
+    osr = pytest.importorskip("osgeo.osr")
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/GeoMerge"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32633)
+    # taller than a merge strip (1024 rows), the output is written in two
+    img = np.random.default_rng(0).integers(0, 4000, (2, 1100, 150), np.uint16)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, srs.ExportToWkt(), f"{save_path}/input.tif")
+    _, source_gt, source_proj = geo.read_rasterArray(f"{save_path}/input.tif")
+
+    n = geo.split_image(f"{save_path}/input.tif", f"{save_path}/tiles", 128, 0.5)
+    assert n > 1
+    for memmap_dir in [None, save_path]:
+        out_path = geo.merge_tiles(
+            f"{save_path}/tiles",
+            f"{save_path}/merged.tif",
+            1100,
+            150,
+            128,
+            0.5,
+            memmap_dir=memmap_dir,
+        )
+        merged, merged_gt, merged_proj = geo.read_rasterArray(out_path)
+        assert merged.dtype == img.dtype
+        assert np.array_equal(merged, img)
+        assert merged_gt == source_gt
+        assert merged_proj == source_proj
+
+
+#  Example AD
+def test_geo_aligned_split() -> None:
+    import pytest
+
+    pytest.importorskip("osgeo")
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/GeoAligned"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    img = np.random.default_rng(0).integers(0, 255, (3, 300, 400), np.uint8)
+    label = (img[:1] > 127).astype(np.uint8)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/image.tif")
+    geo.write_rasterGeoTIF(label, geotrans, "", f"{save_path}/label.tif")
+
+    n = geo.split_aligned_images(
+        [f"{save_path}/image.tif", f"{save_path}/label.tif"],
+        [f"{save_path}/image", f"{save_path}/label"],
+        crop_size=128,
+        repetition_rate=0.5,
+        pad_mode="constant",
+    )
+    img_tiles = sorted(path.name for path in Path(f"{save_path}/image").glob("*.tif"))
+    label_tiles = sorted(path.name for path in Path(f"{save_path}/label").glob("*.tif"))
+    assert n == len(img_tiles) > 1
+    assert img_tiles == label_tiles
+    for name in img_tiles:
+        img_tile, img_gt, _ = geo.read_rasterArray(f"{save_path}/image/{name}")
+        label_tile, label_gt, _ = geo.read_rasterArray(f"{save_path}/label/{name}")
+        # same grid cell: same geotransform, and the label of the image pixels
+        assert img_gt == label_gt
+        assert np.array_equal(label_tile, (img_tile[:1] > 127).astype(np.uint8))
+
+    # a height/width mismatch raises before any tile is written
+    geo.write_rasterGeoTIF(label[:, :-1], geotrans, "", f"{save_path}/small.tif")
+    with pytest.raises(ValueError):
+        geo.split_aligned_images(
+            [f"{save_path}/image.tif", f"{save_path}/small.tif"],
+            [f"{save_path}/mismatch/image", f"{save_path}/mismatch/label"],
+            crop_size=128,
+        )
+    assert not Path(f"{save_path}/mismatch").exists()
+
+
+#  Example AE
+def test_geo_tile_index() -> None:
+    import pytest
+
+    osr = pytest.importorskip("osgeo.osr")
+    import csv
+    import json
+    import numpy as np
+    from pathlib import Path
+    from splitraster import geo
+
+    save_path = "./data/processed/GeoIndex"
+    # non-zero origin, north-up raster with a negative y pixel size
+    geotrans = (500000.0, 2.0, 0.0, 4000000.0, 0.0, -3.0)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32633)
+    img = np.random.default_rng(0).integers(0, 255, (1, 200, 300), np.uint8)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+    geo.write_rasterGeoTIF(img, geotrans, srs.ExportToWkt(), f"{save_path}/input.tif")
+
+    for index_path in [f"{save_path}/index.geojson", f"{save_path}/index.csv"]:
+        n = geo.split_image(
+            f"{save_path}/input.tif",
+            f"{save_path}/tiles",
+            128,
+            0.5,
+            index_path=index_path,
+        )
+        if index_path.endswith(".csv"):
+            with open(index_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+        else:
+            with open(index_path) as f:
+                collection = json.load(f)
+            assert collection["crs"]["properties"]["name"].endswith("::32633")
+            rows = [feature["properties"] for feature in collection["features"]]
+            for feature in collection["features"]:
+                ring = feature["geometry"]["coordinates"][0]
+                assert len(ring) == 5 and ring[0] == ring[-1]
+        assert len(rows) == n
+        assert float(rows[0]["minx"]) == 500000.0
+        assert float(rows[0]["maxy"]) == 4000000.0
+
+        origins = np.array([[int(row["h"]), int(row["w"])] for row in rows])
+        tile_gts = geo.tile_geotransforms(geotrans, origins)
+        for row, tile_gt in zip(rows, tile_gts):
+            # the tile geotransform is the one written into the tile
+            _, gt, _ = geo.read_rasterArray(f"{save_path}/tiles/{row['name']}")
+            assert np.allclose(gt, tile_gt)
+            # upper left corner at the origin, y decreasing down the rows
+            minx, maxy = tile_gt[0], tile_gt[3]
+            maxx, miny = minx + 128 * tile_gt[1], maxy + 128 * tile_gt[5]
+            bounds = [float(row[key]) for key in ["minx", "miny", "maxx", "maxy"]]
+            assert np.allclose(bounds, [minx, miny, maxx, maxy])
+            assert miny < maxy
+
+
+#  Example AF
+def test_geo_int8_datatype(monkeypatch) -> None:
+    import pytest
+
+    gdal = pytest.importorskip("osgeo.gdal")
+    import numpy as np
+    from pathlib import Path
+    from osgeo import gdal_array
+    from splitraster import geo
+
+    save_path = "./data/processed/GeoInt8"
+    geotrans = (500000.0, 0.5, 0.0, 4000000.0, 0.0, -0.5)
+    img = np.arange(-128, 128, dtype=np.int8).reshape(1, 16, 16)
+    Path(save_path).mkdir(parents=True, exist_ok=True)
+
+    # GDAL < 3.7: no Int8, and int8 maps to Byte
+    monkeypatch.delattr(gdal, "GDT_Int8", raising=False)
+    to_gdal = gdal_array.NumericTypeCodeToGDALTypeCode
+    monkeypatch.setattr(
+        gdal_array,
+        "NumericTypeCodeToGDALTypeCode",
+        lambda t: gdal.GDT_Byte if np.dtype(t) == np.int8 else to_gdal(t),
+    )
+    assert geo.gdal_datatype(np.int8) == gdal.GDT_Int16
+    geo.write_rasterGeoTIF(img, geotrans, "", f"{save_path}/int8.tif")
+    tile, _, _ = geo.read_rasterArray(f"{save_path}/int8.tif")
+    assert tile.dtype == np.int16
+    assert np.array_equal(tile, img)
+
+
 print("PASS")